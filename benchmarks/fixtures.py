@@ -0,0 +1,134 @@
+"""
+Canned statsapi / search-api data for the benchmarks, in the shape the real
+endpoints return with the hydrations mlbstreamer asks for.
+"""
+import random
+from datetime import datetime, timedelta
+
+from mlbstreamer import replay
+
+TEAMS = [
+    ("ARI", "D-backs"), ("ATL", "Braves"), ("BAL", "Orioles"),
+    ("BOS", "Red Sox"), ("CHC", "Cubs"), ("CWS", "White Sox"),
+    ("CIN", "Reds"), ("CLE", "Indians"), ("COL", "Rockies"),
+    ("DET", "Tigers"), ("HOU", "Astros"), ("KC", "Royals"),
+    ("LAA", "Angels"), ("LAD", "Dodgers"), ("MIA", "Marlins"),
+    ("MIL", "Brewers"), ("MIN", "Twins"), ("NYM", "Mets"),
+    ("NYY", "Yankees"), ("OAK", "Athletics"), ("PHI", "Phillies"),
+    ("PIT", "Pirates"), ("SD", "Padres"), ("SF", "Giants"),
+    ("SEA", "Mariners"), ("STL", "Cardinals"), ("TB", "Rays"),
+    ("TEX", "Rangers"), ("TOR", "Blue Jays"), ("WSH", "Nationals"),
+]
+
+
+def make_team(n):
+    (abbrev, name) = TEAMS[n % len(TEAMS)]
+    return {"team": {"abbreviation": abbrev, "teamName": name,
+                     "fileCode": abbrev.lower()}}
+
+
+def make_game(game_pk, game_date, away, home, innings=9, game_number=1,
+              hour=19):
+    """
+    Build a finished game in the shape returned by the statsapi schedule
+    endpoint, with the linescore and media hydrations.
+    """
+    r = random.Random(game_pk)
+    line = [ {"num": i+1,
+              "away": {"runs": r.randint(0, 2)},
+              "home": {"runs": r.randint(0, 2)}}
+             for i in range(innings) ]
+    totals = {
+        side: {"runs": sum(i[side]["runs"] for i in line),
+               "hits": r.randint(4, 14),
+               "errors": r.randint(0, 2)}
+        for side in ["away", "home"]
+    }
+    start = datetime.combine(game_date, datetime.min.time()) + timedelta(
+        hours=hour + 4*(game_number-1)
+    )
+    return {
+        "gamePk": game_pk,
+        "gameType": "R",
+        "gameNumber": game_number,
+        "doubleHeader": "Y" if game_number > 1 else "N",
+        "gameDate": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "status": {"statusCode": "F", "abstractGameState": "Final"},
+        "teams": {"away": make_team(away), "home": make_team(home)},
+        "linescore": {"innings": line, "teams": totals},
+        "content": {"media": {"epg": [{
+            "title": "MLBTV",
+            "items": [
+                {"mediaFeedType": feed, "callLetters": feed[:3],
+                 "mediaId": "%d-%s" %(game_pk, feed.lower()),
+                 "mediaState": "MEDIA_ARCHIVE", "freeGame": False}
+                for feed in ["HOME", "AWAY"]
+            ]
+        }]}}
+    }
+
+
+def make_schedule(game_date, games):
+    return {"dates": [{"date": game_date.strftime("%Y-%m-%d"),
+                       "games": games}]}
+
+
+def make_teams():
+    return {"teams": [
+        dict(id=100+n, **make_team(n)["team"]) for n in range(len(TEAMS))
+    ]}
+
+
+def make_airings(game):
+    """
+    Airings for each of a game's feeds, with a broadcast start and the
+    start of each half inning.
+    """
+    start = datetime.strptime(game["gameDate"], "%Y-%m-%dT%H:%M:%SZ")
+    airings = []
+    for item in game["content"]["media"]["epg"][0]["items"]:
+        milestones = [{
+            "milestoneType": "BROADCAST_START",
+            "milestoneTime": [
+                {"type": "absolute",
+                 "startDatetime": start.strftime("%Y-%m-%dT%H:%M:%SZ")},
+                {"type": "offset", "start": 300},
+            ],
+            "keywords": []
+        }]
+        for n in range(len(game["linescore"]["innings"]) * 2):
+            milestones.append({
+                "milestoneType": "INNING_START",
+                "milestoneTime": [{"type": "offset", "start": 600 + 1200*n}],
+                "keywords": [
+                    {"type": "inning", "value": str(n//2 + 1)},
+                    {"type": "top", "value": "true" if n % 2 == 0 else "false"},
+                ]
+            })
+        airings.append({
+            "mediaId": item["mediaId"],
+            "startDate": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "milestones": milestones
+        })
+    return {"data": {"Airings": airings}}
+
+
+def write_replay_fixtures(path, schedule):
+    """
+    Write the fixtures the replay server needs to resolve the games in a
+    schedule: sports, teams, the schedule itself and the games' airings.
+    """
+    games = [ g for d in schedule["dates"] for g in d["games"] ]
+    airings = {"data": {"Airings": [
+        a for g in games for a in make_airings(g)["data"]["Airings"]
+    ]}}
+    store = replay.FixtureStore(path)
+    for (url, data) in [
+            ("http://statsapi.mlb.com/api/v1/sports",
+             {"sports": [{"id": 1, "code": "mlb"}]}),
+            ("http://statsapi.mlb.com/api/v1/teams", make_teams()),
+            ("http://statsapi.mlb.com/api/v1/schedule", schedule),
+            ("https://search-api-mlbtv.mlb.com/svc/search/v2/graphql/"
+             "persisted/query/core/Airings", airings),
+    ]:
+        store.write(replay.make_fixture("GET", url, data))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Throughput benchmark for the built-in HLS downloader's write path.
+
+Generates a master playlist and a finished media playlist of random
+segments, serves them with `python -m http.server` in a separate process
+(so serving them doesn't count against the downloader), and downloads the
+stream with HLSDownloader a few times.
+
+Reports the wall time and throughput of each run, the downloader's CPU time
+per megabit written, and how much the process's peak RSS grew over the run,
+which should stay near zero however many segments are downloaded since
+segment buffers are reused.
+"""
+import sys
+import os
+import time
+import socket
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import statistics
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from mlbstreamer import hls
+
+DEFAULT_RUNS = 3
+DEFAULT_SEGMENTS = 200
+DEFAULT_SEGMENT_SIZE = 4*1024*1024
+SEGMENT_DURATION = 5.0
+
+
+class BenchmarkSession(object):
+    """
+    Just enough of a StreamSession for HLSDownloader.
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.headers = {}
+
+
+def generate_stream(path, segments, segment_size):
+    bandwidth = int(segment_size * 8 / SEGMENT_DURATION)
+    with open(os.path.join(path, "master.m3u8"), "w") as f:
+        f.write("#EXTM3U\n"
+                "#EXT-X-STREAM-INF:BANDWIDTH=%d,RESOLUTION=1280x720,"
+                "FRAME-RATE=59.94\n"
+                "720p/index.m3u8\n" %(bandwidth))
+    os.mkdir(os.path.join(path, "720p"))
+    with open(os.path.join(path, "720p", "index.m3u8"), "w") as f:
+        f.write("#EXTM3U\n#EXT-X-TARGETDURATION:%d\n"
+                "#EXT-X-MEDIA-SEQUENCE:0\n" %(SEGMENT_DURATION))
+        for n in range(segments):
+            f.write("#EXTINF:%.1f,\nseg%d.ts\n" %(SEGMENT_DURATION, n))
+            segment = os.path.join(path, "720p", "seg%d.ts" %(n))
+            # every segment links to the same data, to keep setup quick
+            if n == 0:
+                with open(segment, "wb") as s:
+                    s.write(os.urandom(segment_size))
+            else:
+                os.link(os.path.join(path, "720p", "seg0.ts"), segment)
+        f.write("#EXT-X-ENDLIST\n")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(path):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "http.server", str(port),
+         "--bind", "127.0.0.1", "--directory", path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = "http://127.0.0.1:%d/master.m3u8" %(port)
+    for i in range(100):
+        try:
+            requests.head(url)
+            return (server, url)
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("server didn't start")
+
+
+def run(url, output, workers):
+    for path in [output, output + hls.MANIFEST_SUFFIX]:
+        if os.path.exists(path):
+            os.remove(path)
+    downloader = hls.HLSDownloader(BenchmarkSession(), url, output,
+                                   resolution="720p", workers=workers)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    downloader.run()
+    return dict(
+        wall = time.perf_counter() - wall,
+        cpu = time.process_time() - cpu,
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+        size = os.path.getsize(output)
+    )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-n", "--runs", type=int, default=DEFAULT_RUNS,
+                        help="number of downloads")
+    parser.add_argument("--segments", type=int, default=DEFAULT_SEGMENTS,
+                        help="segments in the stream")
+    parser.add_argument("--segment-size", type=int, default=DEFAULT_SEGMENT_SIZE,
+                        help="segment size in bytes")
+    parser.add_argument("-w", "--workers", type=int, default=hls.DEFAULT_WORKERS,
+                        help="concurrent segment downloads")
+    parser.add_argument("--no-preallocate", action="store_true",
+                        help="don't preallocate the output file")
+    parser.add_argument("-d", "--dir",
+                        help="directory to write to (default: a temporary "
+                        "directory)")
+    options = parser.parse_args()
+
+    if options.no_preallocate:
+        hls.PREALLOCATE_MARGIN = 0
+
+    stream_dir = tempfile.mkdtemp(prefix="mlbstreamer-bench-")
+    output_dir = options.dir or stream_dir
+    server = None
+    try:
+        generate_stream(stream_dir, options.segments, options.segment_size)
+        (server, url) = serve(stream_dir)
+        output = os.path.join(output_dir, "hls_write.ts")
+
+        results = []
+        for n in range(options.runs):
+            result = run(url, output, options.workers)
+            megabits = result["size"] * 8 / 1e6
+            print("run %d: %.1f MB in %.2fs (%.0f Mbit/s), "
+                  "%.2f CPU ms/Mbit, peak RSS +%d KiB" %(
+                      n + 1, result["size"] / 1e6, result["wall"],
+                      megabits / result["wall"],
+                      result["cpu"] * 1000 / megabits, result["rss"]))
+            results.append(result)
+
+        megabits = options.segments * options.segment_size * 8 / 1e6
+        print("median: %.2fs, %.2f CPU ms/Mbit" %(
+            statistics.median(r["wall"] for r in results),
+            statistics.median(r["cpu"] for r in results) * 1000 / megabits))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(stream_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""
+Latency benchmark for resolving a game in mlbplay.
+
+Times everything play_stream does before it starts the player -- parsing
+the game specifier, teams(), schedule(), get_media(), the team profile
+lookup, get_stream() and the inning offset from media_timestamps() -- up to
+the finished streamlink command line.  Requests go to a local replay server
+with canned fixtures, with simulated latency and jitter.
+
+Scenarios:
+
+* cold: no saved session and empty caches, so every run logs in
+* warm: logged in, with the schedule, teams and airings cached
+* expired-token: warm, but with an expired access token
+
+Reports percentiles for the whole resolution and for each stage (stages
+are inclusive, e.g. get_media includes the schedule() it calls).  With
+--save-baseline the results are saved; otherwise they're compared with the
+saved baseline, and the run fails if the median or p90 of any scenario got
+slower by more than --tolerance.
+"""
+import sys
+import os
+import json
+import time
+import shutil
+import inspect
+import argparse
+import tempfile
+import statistics
+from datetime import date, datetime, timedelta, timezone
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from mlbstreamer import replay
+
+import fixtures
+
+DEFAULT_RUNS = 20
+DEFAULT_LATENCY_MS = 20
+DEFAULT_JITTER_MS = 5
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "latency_baseline.json")
+
+SCENARIOS = ["cold", "warm", "expired-token"]
+
+GAME_DATE = date(2019, 5, 1)
+GAME_SPECIFIER = "%s.pit" %(GAME_DATE)
+
+CONFIG = """
+profiles:
+    default:
+        providers:
+            mlb:
+                username: benchmark@example.com
+                password: benchmark
+        player: mpv
+    proxy:
+        proxies:
+            http: http://127.0.0.1:9
+            https: http://127.0.0.1:9
+"""
+
+PROXY_PROFILE_MAP = """
+profile_map:
+    team:
+        - pit: proxy
+"""
+
+# (class, method, stage) for each timed stage
+STAGES = [
+    ("MLBStreamSession", "teams", "teams"),
+    ("MLBStreamSession", "schedule", "schedule"),
+    ("MLBStreamSession", "get_media", "get_media"),
+    ("Config", "team_profile", "team_profile"),
+    ("MLBStreamSession", "get_stream", "get_stream"),
+    ("MLBStreamSession", "refresh_access_token", "refresh_access_token"),
+    ("MLBStreamSession", "media_timestamps", "media_timestamps"),
+]
+
+
+class StageTimer(object):
+
+    def __init__(self):
+        self.times = {}
+
+    def add(self, stage, elapsed):
+        self.times[stage] = self.times.get(stage, 0) + elapsed
+
+    def instrument(self, cls, name, stage):
+        """
+        Replace a method with one that adds the time spent in it to `stage`.
+        Works for memoized methods and generators too.
+        """
+        original = inspect.getattr_static(cls, name)
+        timer = self
+
+        if inspect.isgeneratorfunction(original):
+            def timed(self, *args, **kwargs):
+                gen = original.__get__(self, type(self))(*args, **kwargs)
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        timer.add(stage, time.perf_counter() - start)
+                    yield item
+        else:
+            def timed(self, *args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original.__get__(self, type(self))(*args, **kwargs)
+                finally:
+                    timer.add(stage, time.perf_counter() - start)
+
+        setattr(cls, name, timed)
+
+
+def percentiles(values):
+    values = sorted(values)
+    if len(values) < 2:
+        quantiles = values * 99
+    else:
+        quantiles = statistics.quantiles(values, n=100, method="inclusive")
+    return dict(
+        p50 = statistics.median(values),
+        p90 = quantiles[89],
+        p99 = quantiles[98],
+        max = values[-1]
+    )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-n", "--runs", type=int, default=DEFAULT_RUNS,
+                        help="number of runs per scenario")
+    parser.add_argument("-s", "--scenario", action="append",
+                        choices=SCENARIOS, help="only run these scenarios")
+    parser.add_argument("-l", "--latency", type=float,
+                        default=DEFAULT_LATENCY_MS,
+                        help="simulated server latency in milliseconds")
+    parser.add_argument("-j", "--jitter", type=float,
+                        default=DEFAULT_JITTER_MS,
+                        help="simulated latency jitter in milliseconds")
+    parser.add_argument("-b", "--begin", default="T3",
+                        help="inning to start from, to exercise the offset lookup")
+    parser.add_argument("--proxied", action="store_true",
+                        help="route the game through a team profile with proxies")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="baseline file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="save the results as the new baseline")
+    parser.add_argument("-t", "--tolerance", type=float,
+                        default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown relative to the baseline")
+    options = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    config_dir = os.path.join(work_dir, "config")
+    fixture_dir = os.path.join(work_dir, "fixtures")
+    os.makedirs(config_dir)
+    with open(os.path.join(config_dir, "config.yaml"), "w") as f:
+        f.write(CONFIG + (PROXY_PROFILE_MAP if options.proxied else ""))
+
+    schedule = fixtures.make_schedule(GAME_DATE, [
+        fixtures.make_game(565000, GAME_DATE, 3, 21)
+    ])
+    fixtures.write_replay_fixtures(fixture_dir, schedule)
+
+    server = replay.ReplayServer(
+        fixture_dir, port=0,
+        latency=options.latency/1000, jitter=options.jitter/1000
+    )
+    server.start()
+
+    # These have to be set before the config and sessions are loaded
+    os.environ["MLBSTREAMER_CONFIG_DIR"] = config_dir
+    os.environ[replay.REPLAY_URL_ENV] = server.url
+
+    from mlbstreamer import config
+    from mlbstreamer import state
+    from mlbstreamer import session
+    from mlbstreamer import play
+    from mlbstreamer import utils
+
+    utils.setup_logging(-2, handlers=[], quiet_stdout=True)
+
+    timer = StageTimer()
+    classes = dict(MLBStreamSession=session.MLBStreamSession,
+                   Config=config.Config)
+    for (cls, name, stage) in STAGES:
+        timer.instrument(classes[cls], name, stage)
+
+    def reset_sessions():
+        session.pool.close()
+        for filename in os.listdir(config_dir):
+            if filename.endswith((".session", ".cookies")):
+                os.remove(os.path.join(config_dir, filename))
+
+    def prepare(scenario):
+        play.resolved_streams.streams.clear()
+        if scenario == "cold":
+            reset_sessions()
+            state.store.clear()
+        elif scenario == "expired-token":
+            for (s, last_used) in session.pool.sessions.values():
+                s.access_token_expiry = (
+                    datetime.now(timezone.utc) - timedelta(minutes=1)
+                )
+
+    def resolve(scenario):
+        prepare(scenario)
+        timer.times = {}
+        start = time.perf_counter()
+        if scenario == "cold":
+            state.session = session.get("mlb")
+            timer.add("login", time.perf_counter() - start)
+        resolved = play.resolve_stream(GAME_SPECIFIER)
+        play.build_command(resolved, "best", offset=options.begin)
+        timer.add("total", time.perf_counter() - start)
+        return timer.times
+
+    results = {}
+    try:
+        for scenario in SCENARIOS:
+            if options.scenario and scenario not in options.scenario:
+                continue
+            if scenario != "cold":
+                # warm up the session and caches
+                state.session = session.get("mlb")
+                resolve("warm")
+            runs = [ resolve(scenario) for _ in range(options.runs) ]
+            stages = sorted(set(s for r in runs for s in r))
+            results[scenario] = {
+                stage: percentiles([ r.get(stage, 0) * 1000 for r in runs ])
+                for stage in stages
+            }
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir)
+
+    for scenario, stages in results.items():
+        print("%s:" %(scenario))
+        for stage, p in sorted(stages.items(), key=lambda i: -i[1]["p50"]):
+            print("    %-22s p50 %8.2fms  p90 %8.2fms  p99 %8.2fms  max %8.2fms" %(
+                stage, p["p50"], p["p90"], p["p99"], p["max"]))
+
+    settings = dict(latency=options.latency, jitter=options.jitter,
+                    begin=options.begin, proxied=options.proxied)
+
+    if options.save_baseline:
+        with open(options.baseline, "w") as f:
+            json.dump(dict(settings=settings, results=results), f,
+                      indent=4, sort_keys=True)
+        print("saved baseline to %s" %(options.baseline))
+        return
+
+    if not os.path.exists(options.baseline):
+        print("no baseline at %s, run with --save-baseline to create one" %(
+            options.baseline))
+        return
+
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    if baseline["settings"] != settings:
+        print("warning: baseline was run with %s" %(baseline["settings"]))
+
+    failed = False
+    for scenario, stages in results.items():
+        try:
+            expected = baseline["results"][scenario]["total"]
+        except KeyError:
+            continue
+        for p in ["p50", "p90"]:
+            limit = expected[p] * (1 + options.tolerance)
+            if stages["total"][p] > limit:
+                print("REGRESSION: %s total %s %.2fms > %.2fms (baseline %.2fms)" %(
+                    scenario, p, stages["total"][p], limit, expected[p]))
+                failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+"""
+Render benchmark for the mlbstreamer TUI.
+
+Builds a ScheduleView against a session that serves canned schedules, draws
+it on an in-memory screen, and reports:
+
+* query to first paint: from creating the view to the first full draw
+* redraw time per keypress: moving the focus and paging between dates
+* widget counts: live urwid widgets after the first paint, and how many
+  more are alive after the keypresses
+
+Nothing here touches the network, so the numbers only depend on the table,
+line score and palette code.
+
+The run fails if, in any scenario, the median first paint or the median
+redraw for any key goes over its budget, or if the keypresses leave more
+than --max-widget-growth times as many widgets alive as the first paint.
+"""
+import sys
+import os
+import gc
+import json
+import logging
+import time
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+import urwid
+
+from mlbstreamer import state
+from mlbstreamer import session
+import mlbstreamer.__main__ as tui
+
+from fixtures import make_game, make_schedule
+
+DEFAULT_RUNS = 5
+DEFAULT_SIZE = (160, 50)
+DEFAULT_KEYPRESSES = 20
+
+# Budgets, in milliseconds
+DEFAULT_MAX_FIRST_PAINT_MS = 250
+DEFAULT_MAX_REDRAW_MS = 25
+DEFAULT_MAX_WIDGET_GROWTH = 2.0
+
+
+def scenarios(game_date):
+    pk = 500000
+    return {
+        "1-game": make_schedule(game_date, [
+            make_game(pk+1, game_date, 21, 4)
+        ]),
+        "15-game": make_schedule(game_date, [
+            make_game(pk+10+n, game_date, 2*n, 2*n+1, hour=13+n%8)
+            for n in range(15)
+        ]),
+        "extra-innings": make_schedule(game_date, [
+            make_game(pk+30, game_date, 17, 18, innings=16),
+            make_game(pk+31, game_date, 1, 13, innings=12),
+            make_game(pk+32, game_date, 8, 9),
+        ]),
+        "doubleheader": make_schedule(game_date, [
+            make_game(pk+40, game_date, 21, 20, game_number=1, hour=13),
+            make_game(pk+41, game_date, 21, 20, game_number=2, hour=13),
+            make_game(pk+42, game_date, 3, 26, innings=10),
+        ]),
+    }
+
+
+class FixtureSession(object):
+    """
+    Stands in for a logged-in MLB session, serving one canned schedule for
+    every date.  Installed as the "mlb" provider, so the session pool
+    creates it like any other session.
+    """
+
+    RESOLUTIONS = session.MLBStreamSession.RESOLUTIONS
+
+    # the schedule served by the session the pool creates next
+    next_schedule = None
+
+    def __init__(self, schedule):
+        self._schedule = schedule
+
+    @classmethod
+    def new(cls, **kwargs):
+        return cls(cls.next_schedule)
+
+    @classmethod
+    def session_type(cls):
+        return "mlb"
+
+    last_used = 0
+    in_use = False
+
+    def save(self):
+        pass
+
+    def close(self):
+        pass
+
+    def schedule(self, **kwargs):
+        return self._schedule
+
+    def refresh_schedule(self, **kwargs):
+        return self._schedule
+
+
+class InlineWorker(object):
+    """
+    Queues background tasks and runs them when asked, so the benchmark
+    controls what work happens inside each measurement.
+    """
+
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args, callback=None, errback=None, **kwargs):
+        self.tasks.append((fn, args, kwargs, callback, errback))
+
+    def run_next(self):
+        (fn, args, kwargs, callback, errback) = self.tasks.pop(0)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if not errback:
+                raise
+            errback(e)
+            return
+        if callback:
+            callback(result)
+
+    def run_all(self):
+        while self.tasks:
+            self.run_next()
+
+    def shutdown(self):
+        pass
+
+
+class BenchmarkScreen(urwid.BaseScreen):
+    """
+    Screen that renders into memory instead of a terminal.
+    """
+
+    def __init__(self, size):
+        super(BenchmarkScreen, self).__init__()
+        self.size = size
+        self.canvas = None
+
+    def get_cols_rows(self):
+        return self.size
+
+    def draw_screen(self, size, canvas):
+        # walk the whole canvas like a real screen would
+        self.canvas = canvas
+        for row in canvas.content():
+            pass
+
+    def clear(self):
+        pass
+
+
+def count_widgets():
+    gc.collect()
+    return sum(1 for o in gc.get_objects() if isinstance(o, urwid.Widget))
+
+
+def run_scenario(schedule, game_date, size, keypresses):
+
+    tui.GamesDataTable.page_cache.pages.clear()
+    state.worker = InlineWorker()
+    session.pool.close()
+    FixtureSession.next_schedule = schedule
+
+    widgets_before = count_widgets()
+
+    start = time.perf_counter()
+    view = tui.ScheduleView("mlb", game_date)
+    state.loop = urwid.MainLoop(
+        view,
+        tui.get_palette(),
+        screen=BenchmarkScreen(size),
+        pop_ups=True
+    )
+    # log in, then load the schedule for the first date
+    while view.table is None or view.table.rows is None:
+        state.worker.run_next()
+    state.loop.draw_screen()
+    first_paint = time.perf_counter() - start
+
+    widgets_first_paint = count_widgets() - widgets_before
+
+    # let the neighbouring days load, as they would in the background
+    state.worker.run_all()
+
+    keys = (["down"] * keypresses + ["up"] * keypresses
+            + ["right", "left"] * (keypresses // 2))
+    redraws = {}
+    for key in keys:
+        start = time.perf_counter()
+        state.loop.process_input([key])
+        state.worker.run_all()
+        state.loop.draw_screen()
+        redraws.setdefault(key, []).append(time.perf_counter() - start)
+
+    widgets_after = count_widgets() - widgets_before
+    view.table.stop_updates()
+
+    return dict(
+        first_paint = first_paint,
+        redraws = redraws,
+        widgets_first_paint = widgets_first_paint,
+        widgets_after = widgets_after
+    )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--runs", type=int, default=DEFAULT_RUNS,
+                        help="number of runs per scenario")
+    parser.add_argument("-k", "--keypresses", type=int,
+                        default=DEFAULT_KEYPRESSES,
+                        help="keypresses of each kind per run")
+    parser.add_argument("-s", "--scenario", action="append",
+                        help="only run these scenarios")
+    parser.add_argument("--size", default="%dx%d" %(DEFAULT_SIZE),
+                        help="screen size, e.g. 160x50")
+    parser.add_argument("-o", "--output",
+                        help="write results to this file as JSON")
+    parser.add_argument("--max-first-paint", type=float,
+                        default=DEFAULT_MAX_FIRST_PAINT_MS,
+                        help="maximum median first paint in milliseconds")
+    parser.add_argument("--max-redraw", type=float,
+                        default=DEFAULT_MAX_REDRAW_MS,
+                        help="maximum median redraw per keypress in "
+                        "milliseconds")
+    parser.add_argument("--max-widget-growth", type=float,
+                        default=DEFAULT_MAX_WIDGET_GROWTH,
+                        help="maximum ratio of widgets alive after the "
+                        "keypresses to widgets after the first paint")
+    options = parser.parse_args()
+
+    size = tuple(int(n) for n in options.size.split("x"))
+    game_date = datetime.now().date() - timedelta(days=30)
+
+    # the toolbar reads the default resolution from the command line options,
+    # and the TUI's logger is normally set up by its main()
+    tui.options = argparse.Namespace(resolution=None)
+    tui.logger = logging.getLogger("mlbstreamer")
+    session.PROVIDERS["mlb"] = FixtureSession
+
+    results = {}
+    for name, schedule in scenarios(game_date).items():
+        if options.scenario and name not in options.scenario:
+            continue
+        runs = [ run_scenario(schedule, game_date, size, options.keypresses)
+                 for _ in range(options.runs) ]
+
+        first_paint = [ r["first_paint"] * 1000 for r in runs ]
+        redraws = {}
+        for key in runs[0]["redraws"]:
+            times = [ t * 1000 for r in runs for t in r["redraws"][key] ]
+            redraws[key] = dict(
+                median = statistics.median(times),
+                max = max(times)
+            )
+        results[name] = dict(
+            first_paint_ms = statistics.median(first_paint),
+            redraw_ms = redraws,
+            widgets_first_paint = runs[-1]["widgets_first_paint"],
+            widgets_after = runs[-1]["widgets_after"],
+        )
+
+        print("%s: first paint %.1fms, %d widgets (%d after keypresses)" %(
+            name,
+            results[name]["first_paint_ms"],
+            results[name]["widgets_first_paint"],
+            results[name]["widgets_after"],
+        ))
+        for key, t in redraws.items():
+            print("    %-6s median %.2fms, max %.2fms" %(
+                key, t["median"], t["max"]))
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    failed = False
+    for name, result in results.items():
+        if result["first_paint_ms"] > options.max_first_paint:
+            print("%s: first paint over budget: %.1fms > %.1fms" %(
+                name, result["first_paint_ms"], options.max_first_paint))
+            failed = True
+        for key, t in result["redraw_ms"].items():
+            if t["median"] > options.max_redraw:
+                print("%s: %s redraw over budget: %.2fms > %.2fms" %(
+                    name, key, t["median"], options.max_redraw))
+                failed = True
+        if (result["widgets_after"]
+            > result["widgets_first_paint"] * options.max_widget_growth):
+            print("%s: widgets leaked: %d alive after keypresses, "
+                  "%d after first paint" %(
+                      name, result["widgets_after"],
+                      result["widgets_first_paint"]))
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
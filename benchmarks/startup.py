@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Startup-time benchmark for mlbplay.
+
+Runs ``python -X importtime`` on the modules on the mlbplay fast path and
+fails if the median cumulative import time goes over the threshold, or if
+any of the modules that should only be loaded on demand show up.
+"""
+import sys
+import os
+import re
+import argparse
+import statistics
+import subprocess
+
+DEFAULT_MODULE = "mlbstreamer.play"
+DEFAULT_THRESHOLD_MS = 400
+DEFAULT_RUNS = 10
+
+# Modules that must not be imported when starting mlbplay
+LAZY_MODULES = [
+    "prompt_toolkit",
+    "tzlocal",
+    "distutils",
+    "lxml",
+    "requests_toolbelt",
+    "six",
+    "urwid",
+    "panwid",
+]
+
+IMPORTTIME_RE = re.compile(
+    r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)"
+)
+
+
+def import_times(module):
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    if proc.returncode:
+        raise Exception(proc.stderr.decode("utf-8"))
+
+    times = {}
+    for line in proc.stderr.decode("utf-8").splitlines():
+        m = IMPORTTIME_RE.match(line)
+        if not m:
+            continue
+        (self_us, cumulative_us, indent, name) = m.groups()
+        times[name] = int(cumulative_us)
+    return times
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-m", "--module", default=DEFAULT_MODULE,
+                        help="module to import")
+    parser.add_argument("-n", "--runs", type=int, default=DEFAULT_RUNS,
+                        help="number of interpreter runs")
+    parser.add_argument("-t", "--threshold", type=float,
+                        default=DEFAULT_THRESHOLD_MS,
+                        help="maximum median import time in milliseconds")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="list the slowest imports")
+    options = parser.parse_args()
+
+    runs = [ import_times(options.module) for _ in range(options.runs) ]
+    totals = [ r[options.module] / 1000 for r in runs ]
+    median = statistics.median(totals)
+
+    print("%s: median %.1fms, min %.1fms, max %.1fms over %d runs" %(
+        options.module, median, min(totals), max(totals), options.runs))
+
+    if options.verbose:
+        slowest = sorted(runs[-1].items(), key=lambda t: t[1], reverse=True)
+        for name, us in slowest[:20]:
+            print("%10.1fms  %s" %(us / 1000, name))
+
+    failed = False
+    eager = sorted(set(
+        name for name in runs[-1]
+        if name.split(".")[0] in LAZY_MODULES
+    ))
+    if eager:
+        print("modules imported eagerly: %s" %(", ".join(eager)))
+        failed = True
+
+    if median > options.threshold:
+        print("import time regression: %.1fms > %.1fms" %(
+            median, options.threshold))
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,11 @@ from datetime import datetime, timedelta
 from collections import namedtuple
 import argparse
 import subprocess
-import select
+import time
+import queue
+import threading
+import functools
+from collections import OrderedDict
 
 import urwid
 import urwid.raw_display
@@ -31,28 +35,90 @@ from . import play
 from . import widgets
 from . import utils
 from . import session
+from . import worker
+from . import timing
+from . import metrics
+from . import hls
 from .exceptions import *
 
 
 class UrwidLoggingHandler(logging.Handler):
-
-    pipe = None
-    # def __init__(self, console):
-
-    #     self.console = console
-    #     super(UrwidLoggingHandler, self).__init__()
-
-    def connect(self, pipe):
-        self.pipe = pipe
+    """
+    Hands log records to the TUI without ever blocking the thread that
+    logged them, so it's safe to log from worker threads.
+
+    Records are queued, and the main loop is woken up through a watch pipe
+    only when there isn't already a wakeup pending, so a burst of records is
+    delivered as a single batch.  If the queue fills up, new records are
+    dropped, and the number dropped is reported in the console.
+    """
+
+    MAX_QUEUE = 10000
+
+    def __init__(self, max_queue=MAX_QUEUE):
+        super(UrwidLoggingHandler, self).__init__()
+        self.records = queue.Queue(max_queue)
+        self.wakeup = threading.Event()
+        self.dropped_lock = threading.Lock()
+        self.dropped = 0
+        self.total_dropped = 0
+        self.pipe = None
+        self.callback = None
+
+    def connect(self, loop, callback):
+        self.callback = callback
+        self.pipe = loop.watch_pipe(self.on_pipe)
+        os.set_blocking(self.pipe, False)
+        # deliver anything logged before we were connected
+        if not self.records.empty():
+            self.notify()
 
     def emit(self, rec):
 
-        if not self.pipe:
+        try:
+            msg = self.format(rec)
+        except Exception:
+            self.handleError(rec)
             return
-        msg = self.format(rec)
-        (ignore, ready, ignore) = select.select([], [self.pipe], [])
-        if self.pipe in ready:
-            os.write(self.pipe, (msg+"\n").encode("utf-8"))
+        try:
+            self.records.put_nowait(msg)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+                self.total_dropped += 1
+        self.notify()
+
+    def notify(self):
+        if not self.pipe or self.wakeup.is_set():
+            return
+        self.wakeup.set()
+        try:
+            os.write(self.pipe, b"\n")
+        except (BlockingIOError, OSError):
+            # the main loop already has a wakeup waiting to be read
+            pass
+
+    def on_pipe(self, data):
+
+        # Clear the flag before draining, so records logged while we're
+        # draining wake us up again.
+        self.wakeup.clear()
+        while True:
+            try:
+                msg = self.records.get_nowait()
+            except queue.Empty:
+                break
+            self.callback(msg)
+
+        with self.dropped_lock:
+            (dropped, self.dropped) = (self.dropped, 0)
+        if dropped:
+            self.callback(
+                "[%d log messages dropped, %d total]" %(
+                    dropped, self.total_dropped
+                )
+            )
+        return True
 
 
 def parse_int(n):
@@ -64,7 +130,18 @@ def parse_int(n):
         return None
 
 class LineScore(AttrDict):
-    pass
+    """
+    Compact line score data for one game.  The table widget for it is only
+    built when the row is actually rendered.
+    """
+
+    def get_widget(self):
+        if not self.get("widget"):
+            self.widget = urwid.BoxAdapter(
+                self.table_class.from_line_score(self),
+                3
+            )
+        return self.widget
 
 class Side(AttrDict):
     pass
@@ -73,23 +150,78 @@ class Inning(AttrDict):
     pass
 
 
-class MLBLineScoreDataTable(DataTable):
+def format_line_score(line_score):
+    if not line_score:
+        return None
+    return line_score.get_widget()
+
+
+class LineScoreDataTable(DataTable):
 
     @classmethod
     def from_json(cls, line_score,
                      away_team=None, home_team=None,
                      hide_spoilers=False
     ):
+        return cls.from_line_score(
+            cls.parse(line_score, away_team, home_team, hide_spoilers)
+        )
+
+    @classmethod
+    def from_line_score(cls, line_score):
+        # DataTable binds its columns to itself, so each table needs its own
+        return cls([ DataTableColumn(name, **kwargs)
+                     for (name, kwargs) in cls.get_columns(*line_score.columns) ],
+                   data=line_score.data)
 
+    @classmethod
+    @functools.lru_cache()
+    def get_columns(cls, periods, stats):
+        # Column specs only depend on the number of innings / periods and
+        # which stats are available, so share them between tables.
         columns = [
-            DataTableColumn("team", width=6, label="", align="right", padding=1),
+            ("team", dict(width=6, label="", align="right", padding=1)),
         ]
+        if periods is not None:
+            for i in range(max(periods, cls.MIN_PERIODS)):
+                columns.append(
+                    (str(i+1), dict(label=cls.period_label(i), width=3))
+                )
+        columns.append(
+            ("empty", dict(label="", width=3))
+        )
+        for stat in stats:
+            columns.append(
+                (stat, dict(label=stat[0].upper(), width=3))
+            )
+        return tuple(columns)
+
+    @classmethod
+    def period_label(cls, i):
+        return str(i+1)
+
+
+class MLBLineScoreDataTable(LineScoreDataTable):
+
+    MIN_PERIODS = 9
+
+    @classmethod
+    def parse(cls, line_score,
+              away_team=None, home_team=None,
+              hide_spoilers=False
+    ):
 
         if "teams" in line_score:
             tk = line_score["teams"]
         else:
             tk = line_score
 
+        periods = None
+        stats = tuple(
+            stat for stat in ["runs", "hits", "errors"]
+            if stat in tk["away"]
+        )
+
         data = []
         for s, side in enumerate(["away", "home"]):
 
@@ -97,11 +229,9 @@ class MLBLineScoreDataTable(DataTable):
             line = AttrDict()
 
             if isinstance(line_score["innings"], list):
+                periods = len(line_score["innings"])
                 for i, inning in enumerate(line_score["innings"]):
                     if not s:
-                        columns.append(
-                            DataTableColumn(str(i+1), label=str(i+1), width=3)
-                        )
                         line.team = away_team
                     else:
                         line.team = home_team
@@ -119,25 +249,12 @@ class MLBLineScoreDataTable(DataTable):
                         setattr(line, str(i+1), "X")
 
                 for n in range(i+1, 9):
-                    if not s:
-                        columns.append(
-                            DataTableColumn(str(n+1), label=str(n+1), width=3)
-                        )
                     if hide_spoilers:
                         setattr(line, str(n+1), "?")
 
-            if not s:
-                columns.append(
-                    DataTableColumn("empty", label="", width=3)
-                )
-
-            for stat in ["runs", "hits", "errors"]:
+            for stat in stats:
                 if not stat in tk[side]: continue
 
-                if not s:
-                    columns.append(
-                        DataTableColumn(stat, label=stat[0].upper(), width=3)
-                    )
                 if not hide_spoilers:
                     setattr(line, stat, parse_int(tk[side][stat]))
                 else:
@@ -145,7 +262,7 @@ class MLBLineScoreDataTable(DataTable):
 
 
             data.append(line)
-        return cls(columns, data=data)
+        return LineScore(table_class=cls, columns=(periods, stats), data=data)
 
     # def keypress(self, size, key):
         # key = super(LineScoreDataTable, self).keypress(size, key)
@@ -155,34 +272,40 @@ class MLBLineScoreDataTable(DataTable):
         # return key
 
 
-class NHLLineScoreDataTable(DataTable):
+class NHLLineScoreDataTable(LineScoreDataTable):
+
+    MIN_PERIODS = 3
 
     @classmethod
-    def from_json(cls, line_score,
-                     away_team=None, home_team=None,
-                     hide_spoilers=False
-    ):
+    def period_label(cls, i):
+        return str(i+1) if i < 3 else "O"
 
-        columns = [
-            DataTableColumn("team", width=6, label="", align="right", padding=1),
-        ]
+    @classmethod
+    def parse(cls, line_score,
+              away_team=None, home_team=None,
+              hide_spoilers=False
+    ):
 
         if "teams" in line_score:
             tk = line_score["teams"]
         else:
             tk = line_score
 
+        periods = None
+        stats = tuple(
+            stat for stat in ["goals", "shotsOnGoal"]
+            if stat in tk["away"]
+        )
+
         data = []
         for s, side in enumerate(["away", "home"]):
 
             i = -1
             line = AttrDict()
             if "periods" in line_score and isinstance(line_score["periods"], list):
+                periods = len(line_score["periods"])
                 for i, period in enumerate(line_score["periods"]):
                     if not s:
-                        columns.append(
-                            DataTableColumn(str(i+1), label=str(i+1) if i < 3 else "O", width=3)
-                        )
                         line.team = away_team
                     else:
                         line.team = home_team
@@ -197,25 +320,12 @@ class NHLLineScoreDataTable(DataTable):
                         setattr(line, str(i+1), "X")
 
                 for n in list(range(i+1, 3)):
-                    if not s:
-                        columns.append(
-                            DataTableColumn(str(n+1), label=str(n+1), width=3)
-                        )
                     if hide_spoilers:
                         setattr(line, str(n+1), "?")
 
-            if not s:
-                columns.append(
-                    DataTableColumn("empty", label="", width=3)
-                )
-
-            for stat in ["goals", "shotsOnGoal"]:
+            for stat in stats:
                 if not stat in tk[side]: continue
 
-                if not s:
-                    columns.append(
-                        DataTableColumn(stat, label=stat[0].upper(), width=3)
-                    )
                 if not hide_spoilers:
                     setattr(line, stat, parse_int(tk[side][stat]))
                 else:
@@ -223,10 +333,16 @@ class NHLLineScoreDataTable(DataTable):
 
 
             data.append(line)
-        return cls(columns, data=data)
+        return LineScore(table_class=cls, columns=(periods, stats), data=data)
 
 
 
+LINE_SCORE_TABLES = {
+    "mlb": MLBLineScoreDataTable,
+    "nhl": NHLLineScoreDataTable
+}
+
+
 def format_start_time(d):
     s = datetime.strftime(d, "%I:%M%p").lower()[:-1]
     if s[0] == "0":
@@ -242,6 +358,41 @@ class MediaAttributes(AttrDict):
         return f"{state}{free}"
 
 
+class PageCache(object):
+    """
+    Bounded LRU cache of table rows that have already been built, keyed by
+    provider, game type and date.  Pages for today and later expire after
+    `max_age` seconds, since their scores and media state still change.
+    """
+
+    def __init__(self, size, max_age):
+        self.size = size
+        self.max_age = max_age
+        self.pages = OrderedDict()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key):
+        try:
+            (rows, loaded) = self.pages[key]
+        except KeyError:
+            return None
+        (provider, game_type, game_date) = key
+        if (game_date >= datetime.now().date()
+            and time.time() - loaded > self.max_age):
+            del self.pages[key]
+            return None
+        self.pages.move_to_end(key)
+        return rows
+
+    def put(self, key, rows):
+        self.pages[key] = (rows, time.time())
+        self.pages.move_to_end(key)
+        while len(self.pages) > self.size:
+            self.pages.popitem(last=False)
+
+
 class GamesDataTable(DataTable):
 
     # sort_by = "start"
@@ -253,11 +404,32 @@ class GamesDataTable(DataTable):
         # DataTableColumn("game_type", label="type", width=5, align="right"),
         DataTableColumn("away", width=16),
         DataTableColumn("home", width=16),
-        DataTableColumn("line"),
+        DataTableColumn("line", format_fn = format_line_score),
         # DataTableColumn("game_id", width=6, align="right"),
     ]
 
 
+    index = "game_id"
+
+    signals = DataTable.signals + ["loading", "loaded", "focus"]
+
+    PREFETCH_DAYS = 3
+    PAGE_CACHE_SIZE = 21
+    PAGE_CACHE_MAX_AGE = 60
+
+    # seconds between live updates while games are in progress, and while
+    # waiting for today's games to start
+    LIVE_UPDATE_INTERVAL = 15
+    IDLE_UPDATE_INTERVAL = 120
+    # games this close to their start time are polled along with live ones
+    PREGAME_WINDOW = timedelta(minutes=15)
+
+    # row keys that can change while a game is on
+    LIVE_KEYS = ["status", "game_state", "attrs", "line"]
+
+    # shared by all tables, so switching providers keeps the pages around
+    page_cache = PageCache(PAGE_CACHE_SIZE, PAGE_CACHE_MAX_AGE)
+
     def __init__(self, provider, game_date, game_type=None, *args, **kwargs):
 
         # self.sport_id = sport_id
@@ -265,24 +437,218 @@ class GamesDataTable(DataTable):
         self.provider = provider
         self.game_date = game_date
         self.game_type = game_type
-        self.line_score_table = None
+        self.line_score_class = LINE_SCORE_TABLES[self.provider]
+        self.rows = None
+        self.pending = set()
+        self.update_alarm = None
+        self.updating = False
         if not self.game_type:
             self.game_type = ""
+        self.prefetch_days = config.settings.profile.get(
+            "prefetch_days", self.PREFETCH_DAYS
+        )
         super(GamesDataTable, self).__init__(*args, **kwargs)
+        self.load()
 
     def set_game_date(self, game_date):
         self.game_date = game_date
+        self.load()
+
+    def page_key(self, game_date):
+        # PageCache compares the date with today's
+        if isinstance(game_date, datetime):
+            game_date = game_date.date()
+        return (self.provider, self.game_type, game_date)
+
+    def fetch(self, game_date, callback, errback=None):
+        key = self.page_key(game_date)
+        self.pending.add(key)
+
+        def on_fetch(schedule):
+            self.pending.discard(key)
+            self.page_cache.put(key, list(self.rows_from_schedule(schedule)))
+            callback(game_date)
+
+        def on_error(e):
+            self.pending.discard(key)
+            if errback:
+                errback(game_date, e)
+
+        state.worker.submit(
+            state.session.schedule,
+            start=game_date,
+            end=game_date,
+            game_type=self.game_type,
+            callback=on_fetch,
+            errback=on_error
+        )
+
+    def load(self):
+        # Show the page right away if we have it, otherwise clear the table
+        # and fetch the schedule in the background.  If the date changes
+        # again before the fetch finishes, the result is ignored.
+        self.stop_updates()
+        rows = self.page_cache.get(self.page_key(self.game_date))
+        if rows is not None:
+            self.on_load(self.game_date)
+            return
+        self.rows = None
         self.reset()
+        self._emit("loading")
+        if self.page_key(self.game_date) not in self.pending:
+            self.fetch(self.game_date, self.on_load, self.on_load_error)
 
-    def query(self, *args, **kwargs):
+    def on_load(self, game_date):
+        if game_date != self.game_date:
+            return
+        self.rows = self.page_cache.get(self.page_key(game_date))
+        self.reset()
+        self._emit("loaded")
+        self.prefetch()
+        self.schedule_update()
+
+    def on_load_error(self, game_date, e):
+        if game_date != self.game_date:
+            return
+        logger.error("couldn't load schedule for %s: %s" %(game_date, e))
+        self._emit("loaded")
+
+    def prefetch(self):
+        # Load the days around the current one in the background, nearest
+        # first, so paging left and right doesn't wait on the network.
+        for n in range(1, self.prefetch_days+1):
+            for game_date in [self.game_date + timedelta(days=-n),
+                              self.game_date + timedelta(days=n)]:
+                key = self.page_key(game_date)
+                if key in self.pending or key in self.page_cache:
+                    continue
+                self.fetch(game_date, self.on_load, self.on_load_error)
+
+    def update_interval(self):
+        # Poll often while anything is live, slowly while today's games have
+        # yet to start, and not at all once everything is final.
+        if not self.rows:
+            return None
+        game_states = set(row["game_state"] for row in self.rows)
+        if "Live" in game_states:
+            return self.LIVE_UPDATE_INTERVAL
+        elif ("Preview" in game_states
+              and self.game_date == datetime.now().date()):
+            return self.IDLE_UPDATE_INTERVAL
+        return None
 
-        j = state.session.schedule(
-            # sport_id=self.sport_id,
-            start=self.game_date,
-            end=self.game_date,
-            game_type=self.game_type
+    def schedule_update(self):
+        self.stop_updates()
+        interval = self.update_interval()
+        if not interval:
+            return
+        logger.debug("next live update in %ds" %(interval))
+        self.update_alarm = state.loop.set_alarm_in(
+            interval, lambda loop, data: self.update()
         )
-        for d in j["dates"]:
+
+    def stop_updates(self):
+        if self.update_alarm:
+            state.loop.remove_alarm(self.update_alarm)
+            self.update_alarm = None
+
+    def live_games(self):
+        now = datetime.now(pytz.utc)
+        for row in self.rows or []:
+            if row["game_state"] == "Live" or (
+                    row["game_state"] == "Preview"
+                    and row["start"] - self.PREGAME_WINDOW <= now):
+                yield row["game_id"]
+
+    def update(self):
+        # Fetch only the games that are in progress (or about to be), and
+        # update the rows that changed in place rather than rebuilding the
+        # whole table.
+        self.update_alarm = None
+        if self.updating:
+            # the last update is still running; try again next tick rather
+            # than stopping live updates
+            self.schedule_update()
+            return
+        game_date = self.game_date
+        game_ids = list(self.live_games())
+        if not game_ids:
+            self.schedule_update()
+            return
+
+        self.updating = True
+        remaining = set(game_ids)
+
+        def on_done(game_id):
+            remaining.discard(game_id)
+            if remaining:
+                return
+            self.updating = False
+            if game_date == self.game_date:
+                self.page_cache.put(self.page_key(game_date), self.rows)
+                self.schedule_update()
+
+        def on_fetch(game_id, schedule):
+            if game_date == self.game_date:
+                for row in self.rows_from_schedule(schedule):
+                    self.update_row(row)
+            on_done(game_id)
+
+        def on_error(game_id, e):
+            logger.warning("couldn't update game %s: %s" %(game_id, e))
+            on_done(game_id)
+
+        for game_id in game_ids:
+            state.worker.submit(
+                state.session.refresh_schedule,
+                game_id=game_id,
+                callback=functools.partial(on_fetch, game_id),
+                errback=functools.partial(on_error, game_id)
+            )
+
+    def update_row(self, new):
+        game_id = new["game_id"]
+        try:
+            row = next(r for r in self.rows if r["game_id"] == game_id)
+        except StopIteration:
+            return
+
+        changes = {
+            k: new[k] for k in self.LIVE_KEYS
+            if not self.row_value_equal(row[k], new[k])
+        }
+        if not changes:
+            return
+        logger.debug("game %s changed: %s" %(game_id, list(changes.keys())))
+        row.update(changes)
+        if game_id not in self.df.index:
+            return
+        for k, v in changes.items():
+            self.df.set(game_id, k, v)
+        self.invalidate_rows([game_id])
+
+    @staticmethod
+    def row_value_equal(a, b):
+        if isinstance(a, LineScore) and isinstance(b, LineScore):
+            # ignore the cached widget
+            return (a.columns, a.data) == (b.columns, b.data)
+        return a == b
+
+    def set_focus(self, position):
+        super(GamesDataTable, self).set_focus(position)
+        self._emit("focus", position)
+
+    def query(self, *args, **kwargs):
+
+        if not self.rows:
+            return
+
+        for row in self.rows:
+            yield row
+
+    def rows_from_schedule(self, schedule):
+
+        for d in schedule["dates"]:
 
             games = sorted(d["games"], key= lambda g: g["gameDate"])
 
@@ -290,6 +656,7 @@ class GamesDataTable(DataTable):
                 game_pk = g["gamePk"]
                 game_type = g["gameType"]
                 status = g["status"]["statusCode"]
+                game_state = g["status"].get("abstractGameState")
                 away_team = g["teams"]["away"]["team"]["teamName"]
                 home_team = g["teams"]["home"]["team"]["teamName"]
                 away_abbrev = g["teams"]["away"]["team"]["abbreviation"]
@@ -319,20 +686,15 @@ class GamesDataTable(DataTable):
                 # raise Exception(json.dumps(g["linescore"], sort_keys=True,
                                  # indent=4, separators=(',', ': ')))
                 if "linescore" in g:
-                    line_score_cls = globals().get(f"{self.provider.upper()}LineScoreDataTable")
                     # and "innings" in g["linescore"] and len(g["linescore"]["innings"]):
-                    self.line_score_table = line_score_cls.from_json(
+                    line_score = self.line_score_class.parse(
                             g["linescore"],
                             g["teams"]["away"]["team"]["abbreviation"],
                             g["teams"]["home"]["team"]["abbreviation"],
                             hide_spoilers
                     )
-                    self.line_score = urwid.BoxAdapter(
-                        self.line_score_table,
-                        3
-                    )
                 else:
-                    self.line_score = None
+                    line_score = None
 
                 # timestr = datetime.strftime(
                 yield dict(
@@ -340,13 +702,17 @@ class GamesDataTable(DataTable):
                     game_type = game_type,
                     away = away_team,
                     home = home_team,
+                    away_abbrev = away_abbrev,
+                    home_abbrev = home_abbrev,
                     start = start_time,
+                    status = status,
+                    game_state = game_state,
                     # start = "%d:%02d%s" %(
                     #     start_time.hour - 12 if start_time.hour > 12 else start_time.hour,
                     #     start_time.minute,
                     #     "p" if start_time.hour >= 12 else "a"
                     # ),
-                    line = self.line_score,
+                    line = line_score,
                     attrs = attrs
                 )
 
@@ -429,62 +795,89 @@ class Toolbar(urwid.WidgetWrap):
 class DateBar(urwid.WidgetWrap):
 
     def __init__(self, game_date):
-        self.text = urwid.Text(game_date.strftime("%A, %Y-%m-%d"))
+        self.game_date = game_date
+        self.loading = False
+        self.text = urwid.Text("")
         self.fill = urwid.Filler(self.text)
         super(DateBar, self).__init__(self.fill)
+        self.update()
 
     def set_date(self, game_date):
-        self.text.set_text(game_date.strftime("%A, %Y-%m-%d"))
-
-
-class WatchDialog(BasePopUp):
+        self.game_date = game_date
+        self.update()
 
-    signals = ["watch"]
+    def set_loading(self, loading):
+        self.loading = loading
+        self.update()
 
-    def __init__(self, game_id,
-                 resolution=None, from_beginning=None):
+    def update(self):
+        self.text.set_text(
+            self.game_date.strftime("%A, %Y-%m-%d")
+            + (" (loading...)" if self.loading else "")
+        )
 
-        self.game_id = game_id
-        self.resolution = resolution
-        self.from_beginning = from_beginning
 
-        self.game_data = state.session.schedule(
-            game_id=self.game_id,
-        )["dates"][0]["games"][0]
-        # raise Exception(self.game_data)
+class WatchDialog(BasePopUp):
 
-        self.title = urwid.Text("%s@%s" %(
-            self.game_data["teams"]["away"]["team"]["abbreviation"],
-            self.game_data["teams"]["home"]["team"]["abbreviation"],
-        ))
+    signals = ["watch"]
 
+    @staticmethod
+    def fetch_feeds(game_id):
+        """
+        Get the feeds for a game, and the home feed to select by default.
+        This makes network requests, so call it from a worker thread.
+        """
         feed_map = sorted([
             ("%s (%s)" %(e["mediaFeedType"].title(),
                          e["callLetters"]), e["mediaId"].lower())
-            for e in state.session.get_media(self.game_id)
+            for e in state.session.get_media(game_id)
         ], key=lambda v: v[0])
         home_feed = next(state.session.get_media(
-            self.game_id,
+            game_id,
             preferred_stream = "home"
         ))
-        self.live_stream = (home_feed.get("mediaState") == "MEDIA_ON")
-        self.feed_dropdown = Dropdown(
-            feed_map,
-            label="Feed",
-            default=home_feed["mediaId"]
-        )
-        urwid.connect_signal(
-            self.feed_dropdown,
-            "change",
-            lambda s, b, media_id: self.update_inning_dropdown(media_id)
+        return (feed_map, home_feed)
+
+    @staticmethod
+    def fetch_variants(game_id):
+        """
+        Get the variants of a game's home stream.  This makes network
+        requests, so call it from a worker thread.
+        """
+        resolved = play.resolve_stream(game_id, preferred_stream="home")
+        return resolved.stream_session.stream_variants(resolved.media_url)
+
+    def __init__(self, game_id, row,
+                 resolution=None, from_beginning=None):
+
+        # Everything that needs the network is fetched in parallel after the
+        # dialog opens, and each dropdown appears as its data arrives.
+        self.game_id = game_id
+        self.resolution = resolution
+        self.from_beginning = from_beginning
+
+        self.title = urwid.Text("%s@%s" %(row.away_abbrev, row.home_abbrev))
+
+        self.live_stream = (row.attrs.state == "MEDIA_ON")
+        self.feed_dropdown = None
+        self.feed_dropdown_placeholder = urwid.WidgetPlaceholder(
+            urwid.Text("Loading...")
         )
 
+        # Until the stream's own variants are known
         self.resolution_dropdown = ResolutionDropdown(
+            state.session.RESOLUTIONS,
             default=resolution
         )
+        self.resolution_dropdown_placeholder = urwid.WidgetPlaceholder(
+            self.resolution_dropdown
+        )
 
-        self.inning_dropdown_placeholder = urwid.WidgetPlaceholder(urwid.Text(""))
-        self.update_inning_dropdown(self.feed_dropdown.selected_value)
+        self.airings_loaded = False
+        self.inning_dropdown = None
+        self.inning_dropdown_placeholder = urwid.WidgetPlaceholder(
+            urwid.Text("Loading...")
+        )
 
         self.ok_button = urwid.Button("OK")
         urwid.connect_signal(self.ok_button, "click", self.watch)
@@ -500,8 +893,8 @@ class WatchDialog(BasePopUp):
             ("weight", 1, urwid.Pile([
                 ("weight", 1, urwid.Filler(
                     urwid.Columns([
-                        ("weight", 1, self.feed_dropdown),
-                        ("weight", 1, self.resolution_dropdown),
+                        ("weight", 1, self.feed_dropdown_placeholder),
+                        ("weight", 1, self.resolution_dropdown_placeholder),
                     ]))),
                 ("weight", 1, urwid.Filler(self.inning_dropdown_placeholder)),
                 ("weight", 1, urwid.Filler(
@@ -513,11 +906,97 @@ class WatchDialog(BasePopUp):
         ])
         super(WatchDialog, self).__init__(pile)
 
+        state.worker.submit(
+            self.fetch_feeds, game_id,
+            callback=self.set_feeds,
+            errback=self.on_feeds_error
+        )
+        # The inning timestamps need to know the feed, but the airings they
+        # come from don't, so get those at the same time.
+        state.worker.submit(
+            state.session.airings, game_id,
+            callback=lambda airings: self.on_airings(),
+            errback=self.on_timestamps_error
+        )
+        state.worker.submit(
+            self.fetch_variants, game_id,
+            callback=self.set_variants,
+            errback=lambda e: logger.debug(
+                "couldn't get variants for game %s: %s" %(game_id, e)
+            )
+        )
+
+    def set_feeds(self, feeds):
+        (feed_map, home_feed) = feeds
+        self.live_stream = (home_feed.get("mediaState") == "MEDIA_ON")
+        self.feed_dropdown = Dropdown(
+            feed_map,
+            label="Feed",
+            default=home_feed["mediaId"]
+        )
+        urwid.connect_signal(
+            self.feed_dropdown,
+            "change",
+            lambda s, b, media_id: self.update_inning_dropdown(media_id)
+        )
+        self.feed_dropdown_placeholder.original_widget = self.feed_dropdown
+        if self.airings_loaded:
+            self.update_inning_dropdown(self.feed_dropdown.selected_value)
+
+    def set_variants(self, variants):
+        if not variants:
+            return
+        # select whichever variant the current choice would have played
+        selected = hls.choose_variant(
+            variants, self.resolution_dropdown.selected_value
+        )
+        self.resolution_dropdown = ResolutionDropdown(
+            AttrDict(
+                ("%s (%.1fM)" %(v.name, v.bandwidth / 1e6), v.name)
+                for v in variants
+            ),
+            default="%s (%.1fM)" %(selected.name, selected.bandwidth / 1e6)
+        )
+        self.resolution_dropdown_placeholder.original_widget = (
+            self.resolution_dropdown
+        )
+
+    def on_feeds_error(self, e):
+        logger.warning("couldn't get feeds for game %s: %s" %(self.game_id, e))
+        self.feed_dropdown_placeholder.original_widget = urwid.Text(
+            "No feeds"
+        )
+        self.inning_dropdown_placeholder.original_widget = urwid.Text("")
+
+    def on_airings(self):
+        self.airings_loaded = True
+        if self.feed_dropdown:
+            self.update_inning_dropdown(self.feed_dropdown.selected_value)
+
+    def on_timestamps_error(self, e):
+        logger.debug("couldn't get timestamps for game %s: %s" %(self.game_id, e))
+        self.inning_dropdown_placeholder.original_widget = urwid.Text("")
+
     def update_inning_dropdown(self, media_id):
         # raise Exception(media_id)
-        self.timestamps = state.session.media_timestamps(
-            self.game_id, media_id
+        self.inning_dropdown = None
+        self.inning_dropdown_placeholder.original_widget = urwid.Text(
+            "Loading..."
+        )
+        state.worker.submit(
+            state.session.media_timestamps,
+            self.game_id, media_id,
+            callback=lambda timestamps: self.set_timestamps(
+                media_id, timestamps
+            ),
+            errback=self.on_timestamps_error
         )
+
+    def set_timestamps(self, media_id, timestamps):
+        if not self.feed_dropdown or media_id != self.feed_dropdown.selected_value:
+            # feed changed again while we were waiting
+            return
+        self.timestamps = AttrDict(timestamps)
         del self.timestamps["S"]
         timestamp_map = AttrDict(
             ( k if k[0] in "TB" else "Start", k ) for k in self.timestamps.keys()
@@ -540,8 +1019,8 @@ class WatchDialog(BasePopUp):
             "watch",
             self.game_id,
             self.resolution_dropdown.selected_value,
-            self.feed_dropdown.selected_value,
-            self.inning_dropdown.selected_value
+            self.feed_dropdown.selected_value if self.feed_dropdown else None,
+            self.inning_dropdown.selected_value if self.inning_dropdown else None
         )
         urwid.signals.emit_signal(self, "close_popup")
 
@@ -552,9 +1031,11 @@ class WatchDialog(BasePopUp):
         elif key in ["<", ">"]:
             self.resolution_dropdown.cycle(1 if key == "<" else -1)
         elif key in ["[", "]"]:
-            self.feed_dropdown.cycle(-1 if key == "[" else 1)
+            if self.feed_dropdown:
+                self.feed_dropdown.cycle(-1 if key == "[" else 1)
         elif key in ["-", "="]:
-            self.inning_dropdown.cycle(-1 if key == "-" else 1)
+            if self.inning_dropdown:
+                self.inning_dropdown.cycle(-1 if key == "-" else 1)
         else:
             # return super(WatchDialog, self).keypress(size, key)
             key = super(WatchDialog, self).keypress(size, key)
@@ -565,9 +1046,14 @@ class WatchDialog(BasePopUp):
 
 class ScheduleView(BaseView):
 
+    # seconds the highlighted game has to stay put before its stream is
+    # looked up in the background
+    RESOLVE_DELAY = 0.5
+
     def __init__(self, provider, date):
 
         self.game_date = date
+        self.resolve_alarm = None
 
         self.toolbar = Toolbar()
         urwid.connect_signal(
@@ -575,6 +1061,7 @@ class ScheduleView(BaseView):
             lambda w, p: self.set_provider(p)
         )
 
+        self.table = None
         self.table_placeholder = urwid.WidgetPlaceholder(urwid.Text(""))
 
         self.datebar = DateBar(self.game_date)
@@ -593,18 +1080,75 @@ class ScheduleView(BaseView):
 
         logger.warning("set provider")
         self.provider = provider
-        state.session = session.new(self.provider)
-        self.toolbar.set_resolutions(state.session.RESOLUTIONS)
+        self.toolbar.set_resolutions(session.PROVIDERS[provider].RESOLUTIONS)
+
+        # Logging in to a provider for the first time can take a while, so
+        # do it in the background.
+        if self.table:
+            self.table.stop_updates()
+        self.table = None
+        self.table_placeholder.original_widget = urwid.Filler(
+            urwid.Text("Loading...", align="center")
+        )
+        state.worker.submit(
+            session.get, provider,
+            callback=lambda s: self.on_provider_session(provider, s)
+        )
+
+    def on_provider_session(self, provider, provider_session):
+
+        if provider != self.provider:
+            return
+        state.session = provider_session
 
         self.table = GamesDataTable(self.provider, self.game_date) # preseason
+        urwid.connect_signal(self.table, "loading",
+                             lambda source: self.datebar.set_loading(True))
+        urwid.connect_signal(self.table, "loaded",
+                             lambda source: self.on_table_loaded())
+        urwid.connect_signal(self.table, "focus",
+                             lambda source, position: self.on_focus())
         self.table_placeholder.original_widget = self.table
         urwid.connect_signal(self.table, "select",
-                             lambda source, selection: self.open_watch_dialog(selection["game_id"]))
+                             lambda source, selection: self.open_watch_dialog(AttrDict(selection)))
+        self.datebar.set_loading(self.table.rows is None)
+
 
+    def on_table_loaded(self):
+        self.datebar.set_loading(False)
+        self.on_focus()
+
+    def on_focus(self):
+        # Wait for the focus to settle so scrolling through the list doesn't
+        # look up every game along the way.
+        if self.resolve_alarm:
+            state.loop.remove_alarm(self.resolve_alarm)
+        self.resolve_alarm = state.loop.set_alarm_in(
+            self.RESOLVE_DELAY, lambda loop, data: self.resolve_focused()
+        )
+
+    def resolve_focused(self):
+        # Look up the stream for the highlighted game ahead of time, so
+        # pressing "w" can start the player right away.
+        self.resolve_alarm = None
+        if not (self.table and self.table.selection):
+            return
+        row = self.table.selection.data
+        if not row.attrs.state:
+            # no media for this game
+            return
+        state.worker.submit(
+            play.resolve_stream,
+            row.game_id,
+            preferred_stream="home",
+            errback=lambda e: logger.debug(
+                "couldn't resolve stream for game %s: %s" %(row.game_id, e)
+            )
+        )
 
+    def open_watch_dialog(self, row):
 
-    def open_watch_dialog(self, game_id):
-        dialog = WatchDialog(game_id,
+        dialog = WatchDialog(row.game_id, row,
                              resolution = self.toolbar.resolution,
                              from_beginning = self.toolbar.start_from_beginning
         )
@@ -618,6 +1162,9 @@ class ScheduleView(BaseView):
     def keypress(self, size, key):
 
         key = super(ScheduleView, self).keypress(size, key)
+        if not self.table:
+            # still logging in
+            return key
         if key in ["left", "right"]:
             self.game_date += timedelta(days= -1 if key == "left" else 1)
             self.datebar.set_date(self.game_date)
@@ -652,34 +1199,77 @@ class ScheduleView(BaseView):
               resolution=None, feed=None,
               offset=None, preferred_stream=None):
 
-        try:
-            state.proc = play.play_stream(
-                game_id,
-                resolution,
-                call_letters = feed,
-                preferred_stream = preferred_stream,
-                offset = offset
-            )
-        except play.MLBPlayException as e:
-            logger.warning(e)
+        requested = time.time()
+
+        def on_error(e):
+            if isinstance(e, play.MLBPlayException):
+                logger.warning(e)
+            else:
+                logger.error("couldn't play game %s" %(game_id), exc_info=e)
+
+        def on_started(proc):
+            state.proc = proc
+            play.watch_player(proc)
+
+        state.worker.submit(
+            play.play_stream,
+            game_id,
+            resolution,
+            call_letters = feed,
+            preferred_stream = preferred_stream,
+            offset = offset,
+            requested = requested,
+            callback=on_started,
+            errback=on_error
+        )
+
 
 
+def get_palette():
+
+    entries = Dropdown.get_palette_entries()
+    entries.update(ScrollingListBox.get_palette_entries())
+    entries.update(DataTable.get_palette_entries())
+    # raise Exception(entries)
+    return Palette("default", **entries)
+
 
 def main():
 
+    init_parser = argparse.ArgumentParser()
+    init_parser.add_argument("-p", "--profile", help="use alternate config profile")
+    init_parser.add_argument("--timings", action="store_true",
+                             help="print a tree of where the time went on exit")
+    init_parser.add_argument("--pstats", metavar="FILE",
+                             help="save cProfile stats for the UI thread to FILE")
+    init_options, args = init_parser.parse_known_args()
+
+    if init_options.timings:
+        timing.enable()
+    try:
+        with timing.profiled(init_options.pstats):
+            run(init_options, args)
+    finally:
+        if init_options.timings:
+            timing.report()
+
+
+def run(init_options, args):
+
     global options
     global logger
 
     today = datetime.now(pytz.timezone('US/Eastern')).date()
 
-    init_parser = argparse.ArgumentParser()
-    init_parser.add_argument("-p", "--profile", help="use alternate config profile")
-    options, args = init_parser.parse_known_args()
-
     config.settings.load()
 
-    if options.profile:
-        config.settings.set_profile(options.profile)
+    if init_options.profile:
+        config.settings.set_profile(init_options.profile)
+
+    metrics.export(
+        port=config.settings.profile.get("metrics_port"),
+        textfile=config.settings.profile.get("metrics_textfile")
+    )
 
     parser = argparse.ArgumentParser()
     # parser.add_argument("-d", "--date", help="game date",
@@ -692,9 +1282,11 @@ def main():
                         help="verbose logging")
     group.add_argument("-q", "--quiet", action="count", default=0,
                         help="quiet logging")
+    parser.add_argument("--log-json", help="write the log file as JSON lines",
+                        action="store_true")
     parser.add_argument("game", metavar="game",
                         help="game specifier", nargs="?")
-    options, args = parser.parse_known_args()
+    options, args = parser.parse_known_args(args)
 
     log_file = os.path.join(config.CONFIG_DIR, "mlbstreamer.log")
 
@@ -713,64 +1305,78 @@ def main():
 
     ulh = UrwidLoggingHandler()
     # ulh.setLevel(logging.DEBUG)
-    # ulh.setFormatter(formatter)
+    # the console is for people, so it stays in plain text
+    ulh.setFormatter(utils.text_formatter())
     # logger.addHandler(ulh)
 
     utils.setup_logging(options.verbose - options.quiet,
                         handlers=[fh, ulh],
-                        quiet_stdout=True)
+                        quiet_stdout=True,
+                        json_format=(
+                            options.log_json
+                            or config.settings.profile.get("log_format") == "json"
+                        ))
 
     try:
         (provider, game_date) = options.game.split("/", 1)
+        game_date = dateutil.parser.parse(game_date).date()
     except (ValueError, AttributeError):
         if options.game in session.PROVIDERS:
             provider = options.game
             game_date = datetime.now().date()
         else:
             provider = list(config.settings.profile.providers.keys())[0]
-            game_date = dateutil.parser.parse(options.game)
+            game_date = dateutil.parser.parse(options.game).date()
 
 
 
 
     logger.debug("mlbstreamer starting")
 
-    entries = Dropdown.get_palette_entries()
-    entries.update(ScrollingListBox.get_palette_entries())
-    entries.update(DataTable.get_palette_entries())
-    # raise Exception(entries)
-    palette = Palette("default", **entries)
+    palette = get_palette()
     screen = urwid.raw_display.Screen()
     screen.set_terminal_properties(256)
 
-    view = ScheduleView(provider, game_date)
-
-    log_console = widgets.ConsoleWindow()
-    # log_box = urwid.BoxAdapter(urwid.LineBox(log_console), 10)
-    pile = urwid.Pile([
-        ("weight", 5, urwid.LineBox(view)),
-        ("weight", 1, urwid.LineBox(log_console))
-    ])
-
     def global_input(key):
         if key in ('q', 'Q'):
             raise urwid.ExitMainLoop()
         else:
             return False
 
+    # Create the main loop first so the worker can hook into it before the
+    # views start loading data.
     state.loop = urwid.MainLoop(
-        pile,
+        urwid.SolidFill(),
         palette,
         screen=screen,
         unhandled_input=global_input,
         pop_ups=True
     )
-    ulh.connect(state.loop.watch_pipe(log_console.log_message))
+    state.worker = worker.Worker(state.loop)
+
+    view = ScheduleView(provider, game_date)
+
+    log_console = widgets.ConsoleWindow(
+        max_lines=config.settings.profile.get(
+            "console_lines", widgets.MAX_LINES
+        )
+    )
+    # log_box = urwid.BoxAdapter(urwid.LineBox(log_console), 10)
+    pile = urwid.Pile([
+        ("weight", 5, urwid.LineBox(view)),
+        ("weight", 1, urwid.LineBox(log_console))
+    ])
+    state.loop.widget = pile
+
+    ulh.connect(state.loop, log_console.log_message)
     logger.info("mlbstreamer starting")
     if options.verbose:
         logger.setLevel(logging.DEBUG)
 
-    state.loop.run()
+    try:
+        state.loop.run()
+    finally:
+        state.worker.shutdown()
 
 
 if __name__ == "__main__":
@@ -7,107 +7,78 @@ try:
 except ImportError:
     from collections import MutableMapping
 import yaml
-import functools
-from orderedattrdict import Tree
+from orderedattrdict import AttrDict, Tree
 import orderedattrdict.yamlutils
 from orderedattrdict.yamlutils import AttrDictYAMLLoader
-import distutils.spawn
-import tzlocal
 
-from prompt_toolkit import prompt
-from prompt_toolkit.validation import Validator, ValidationError
-from prompt_toolkit.shortcuts import confirm
-from prompt_toolkit.shortcuts import prompt
-import getpass
+from . import timing
 
-CONFIG_DIR=os.path.expanduser("~/.config/mlbstreamer")
+CONFIG_DIR=os.environ.get(
+    "MLBSTREAMER_CONFIG_DIR",
+    os.path.expanduser("~/.config/mlbstreamer")
+)
 CONFIG_FILE=os.path.join(CONFIG_DIR, "config.yaml")
 LOG_FILE=os.path.join(CONFIG_DIR, "mlbstreamer.log")
+CONFIG_CACHE_FILE=os.path.join(CONFIG_DIR, "config.cache")
+
+# Bump this whenever the layout of the compiled config cache changes
+CONFIG_CACHE_VERSION = 2
 
 KNOWN_PLAYERS = ["mpv", "vlc"]
 
 settings = None
 
 
-class NotEmptyValidator(Validator):
-
-    def validate(self, document):
-        text = document.text
-        if not len(text):
-            raise ValidationError(message="Please supply a value")
-
-class RangeNumberValidator(Validator):
-
-    def __init__(self, minimum=None, maximum=None):
-        self.minimum = minimum
-        self.maximum = maximum
-
-    def validate(self, document):
-
-        text = document.text
-
-        if not text:
-            raise ValidationError(message="Please supply a value")
-
-        if text.isdigit():
-            value = int(text)
-        else:
-            i = 0
-
-            raise ValidationError(
-                message='Please enter an integer.'
-            )
-
-        if self.minimum and value < self.minimum:
-            raise ValidationError(
-                message="Value must be greater than %s" %(self.minimum)
-            )
-
-        if self.maximum and value > self.maximum:
-            raise ValidationError(
-                message="Value must be less than %s" %(self.maximum)
-            )
-
 class ProfileTree(Tree):
 
     DEFAULT_PROFILE_NAME = "default"
 
     def __init__(self, profile=DEFAULT_PROFILE_NAME, *args, **kwargs):
         super(ProfileTree, self).__init__(*args, **kwargs)
-        self.__exclude_keys__ |= {"_profile_name", "_default_profile_name", "profile"}
+        self.__exclude_keys__ |= {"_profile_name", "_default_profile_name",
+                                  "_merged", "profile"}
         self._default_profile_name = profile
+        self._merged = {}
         self.set_profile(self._default_profile_name)
 
     @property
     def profile(self):
-        return self[self._profile_name]
+        return self[(self._default_profile_name, self._profile_name)]
 
     def set_profile(self, profile):
         self._profile_name = profile
 
     def __getattr__(self, name):
         if not name.startswith("_"):
-            p = self.profile
-            return p.get(name) if name in p else self[self._default_profile_name].get(name)
+            return self.profile.get(name)
         raise AttributeError
 
     def __setattr__(self, name, value):
         if not name.startswith("_"):
             self[self._profile_name][name] = value
+            self._merged.clear()
         else:
             object.__setattr__(self, name, value)
 
     def get(self, name, default=None):
-        p = self.profile
-        return p.get(name, default) if name in p else self[self._default_profile_name].get(name, default)
+        return self.profile.get(name, default)
+
+    def merge(self, names):
+        """
+        Merge a chain of profiles, with later profiles taking precedence.
+        """
+        merged = AttrDict()
+        for name in names:
+            merged.update(self[name])
+        return merged
 
     def __getitem__(self, name):
         if isinstance(name, tuple):
-            return functools.reduce(
-                lambda a, b: AttrDict(a, **{ k: v for k, v in b.items() if k not in a}),
-                [ self[p] for p in reversed(name) ]
-            )
-
+            try:
+                return self._merged[name]
+            except KeyError:
+                merged = self._merged[name] = self.merge(name)
+                return merged
         else:
             return super(ProfileTree, self).__getitem__(name)
 
@@ -117,10 +88,13 @@ class Config(Tree):
 
     def __init__(self, config_file, *args, **kwargs):
         super(Config, self).__init__(*args, **kwargs)
-        self.__exclude_keys__ |= {"_config_file", "set_profile", "_profile_tree"}
+        self.__exclude_keys__ |= {"_config_file", "set_profile",
+                                  "_profile_tree", "_team_profile_names", "_stamp"}
         self._config_file = config_file
+        self._stamp = None
+        self._profile_tree = ProfileTree()
+        self._team_profile_names = {}
         self.load()
-        self._profile_tree = ProfileTree(**self.profiles)
 
 
     def init_config(self):
@@ -131,7 +105,14 @@ class Config(Tree):
         in the "docs" directory of the distribution.
         """)
 
+        # The interactive configurator is the only user of these, so keep
+        # them off the import path of mlbplay / mlbstreamer.
+        import distutils.spawn
+        import tzlocal
+        from prompt_toolkit.shortcuts import confirm, prompt
+
         from .session import StreamSession, StreamSessionException
+        from .validators import NotEmptyValidator, RangeNumberValidator
 
         def mkdir_p(path):
             try:
@@ -248,10 +229,111 @@ class Config(Tree):
     def set_profile(self, profile):
         self._profile_tree.set_profile(profile)
 
+    @property
+    def cache_file(self):
+        if self._config_file == CONFIG_FILE:
+            return CONFIG_CACHE_FILE
+        return os.path.splitext(self._config_file)[0] + ".cache"
+
+    def compile(self):
+        """
+        Parse the config file and merge every profile with the default
+        profile, so that profile lookups are plain dictionary reads.
+        """
+        with open(self._config_file) as f:
+            config = yaml.load(f, Loader=AttrDictYAMLLoader) or AttrDict()
+
+        tree = ProfileTree(**config.get("profiles", {}))
+        default = ProfileTree.DEFAULT_PROFILE_NAME
+        chains = [ (default, name) for name in tree ]
+
+        # profile chains for team overrides, e.g. {"pit": "proxy"}
+        teams = AttrDict()
+        for d in (config.get("profile_map") or {}).get("team") or []:
+            for team, name in d.items():
+                team = str(team).lower()
+                teams[team] = teams.get(team, ()) + (name,)
+        chains += list(teams.values())
+
+        return AttrDict([
+            ("config", config),
+            ("profiles", { chain: tree.merge(chain) for chain in chains }),
+            ("teams", teams)
+        ])
+
+    def load_cache(self, stamp):
+        import pickle
+        try:
+            with open(self.cache_file, "rb") as f:
+                compiled = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError, IndexError):
+            return None
+
+        if compiled.get("version") != CONFIG_CACHE_VERSION \
+           or compiled.get("config_file") != self._config_file \
+           or compiled.get("stamp") != stamp:
+            return None
+        return compiled
+
+    def save_cache(self, stamp, compiled):
+        import pickle
+        compiled = AttrDict(compiled)
+        compiled.version = CONFIG_CACHE_VERSION
+        compiled.config_file = self._config_file
+        compiled.stamp = stamp
+        tmp_file = "%s.%d" %(self.cache_file, os.getpid())
+        try:
+            with open(tmp_file, "wb") as f:
+                pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self.cache_file)
+        except OSError:
+            # The cache is only an optimization, so carry on without it
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
     def load(self):
-        if os.path.exists(self._config_file):
-            config = yaml.load(open(self._config_file), Loader=AttrDictYAMLLoader)
-            self.update(config.items())
+        try:
+            stat = os.stat(self._config_file)
+        except FileNotFoundError:
+            return
+
+        # The cache is keyed by the config file's mtime and size
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+
+        with timing.span("config load"):
+            with timing.span("cache config"):
+                compiled = self.load_cache(stamp)
+            if not compiled:
+                with timing.span("config compile"):
+                    compiled = self.compile()
+                self.save_cache(stamp, compiled)
+
+            self.update(compiled["config"].items())
+            profile_name = self._profile_tree._profile_name
+            self._profile_tree = ProfileTree(**self["profiles"])
+            self._profile_tree._merged.update(compiled["profiles"])
+            self._profile_tree.set_profile(profile_name)
+            # keep the profile chains, not the merged profiles, which go
+            # stale when the profile tree is edited
+            self._team_profile_names = compiled["teams"]
+            self._stamp = stamp
+
+    def team_profile(self, *teams):
+        """
+        Return the merged profile overrides for a game involving the given
+        teams, or None if none of them have overrides.
+        """
+        profiles = [ self._profile_tree[self._team_profile_names[t]]
+                     for t in teams if t in self._team_profile_names ]
+        if len(profiles) < 2:
+            return profiles[0] if profiles else None
+        merged = AttrDict()
+        for profile in profiles:
+            merged.update(profile)
+        return merged
 
     def save(self):
 
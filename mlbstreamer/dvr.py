@@ -0,0 +1,358 @@
+"""
+DVR daemon that records games as soon as their streams go live.
+
+Games are picked from the schedule for the given teams (and/or by game ID)
+and kept in a job table on disk, so the daemon can be restarted without
+losing track of them.  Each game's schedule entry is polled until its feed's
+media state turns MEDIA_ON, rarely while the start is far off and every
+MIN_POLL seconds from shortly before the scheduled start, which catches
+delayed starts and the second game of doubleheaders.  Recording is then
+handed to the same supervisor that mlbrecord uses.
+"""
+import logging
+logger = logging.getLogger("mlbstreamer")
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+from datetime import datetime, timedelta
+
+import pytz
+import dateutil.parser
+from orderedattrdict import AttrDict
+
+from . import config
+from . import state
+from . import session
+from . import record
+from . import utils
+from . import metrics
+from .exceptions import *
+
+JOBS_FILE = os.path.join(config.CONFIG_DIR, "dvr.json")
+
+# Polling intervals, in seconds
+MIN_POLL = 30
+MAX_POLL = 60*60
+SCAN_INTERVAL = 60*60
+LOOP_INTERVAL = 1
+
+# Start polling frequently this long before the scheduled start
+PREGAME_WINDOW = 15*60
+# Give up on games whose media hasn't gone live this long after the
+# scheduled start
+GIVE_UP_AFTER = 12*60*60
+
+SCHEDULE_TIMEZONE = pytz.timezone("US/Eastern")
+
+
+def poll_interval(until_start):
+    """
+    Seconds to wait before checking a game again, given the number of
+    seconds until it's scheduled to start (negative once it's past).
+    """
+    return max(MIN_POLL, min(MAX_POLL, until_start - PREGAME_WINDOW))
+
+
+def media_on(game, feed):
+    try:
+        epgs = game["content"]["media"]["epg"]
+    except KeyError:
+        return False
+    return any(
+        item.get("mediaState") == "MEDIA_ON"
+        and item.get("mediaFeedType", "").lower() == feed
+        for epg in epgs if epg.get("title") == "MLBTV"
+        for item in epg["items"]
+    )
+
+
+class JobTable(object):
+    """
+    Recording jobs, keyed by game ID, saved to a JSON file whenever they
+    change.
+    """
+
+    def __init__(self, path=JOBS_FILE):
+        self.path = path
+        self.jobs = AttrDict()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                jobs = json.load(f)
+        except FileNotFoundError:
+            return
+        self.jobs = AttrDict(
+            (game_id, AttrDict(job)) for game_id, job in jobs.items()
+        )
+        for job in self.jobs.values():
+            if job.status == "recording":
+                # the daemon died mid-recording, so start over in a new file
+                logger.info("resuming job for game %s" %(job.game_id))
+                job.status = "scheduled"
+                job.next_check = 0
+                job.attempts += 1
+
+    def save(self):
+        tmp_file = "%s.%d" %(self.path, os.getpid())
+        with open(tmp_file, "w") as f:
+            json.dump(self.jobs, f, indent=4)
+        os.replace(tmp_file, self.path)
+
+    def add(self, game_id, feed):
+        if str(game_id) in self.jobs:
+            return False
+        self.jobs[str(game_id)] = AttrDict(
+            game_id = game_id,
+            feed = feed,
+            game_date = None,
+            status = "scheduled",
+            next_check = 0,
+            attempts = 0,
+            outfile = None
+        )
+        return True
+
+    def due(self, now):
+        return [ job for job in self.jobs.values()
+                 if job.status == "scheduled" and job.next_check <= now ]
+
+
+class DVR(object):
+
+    def __init__(self, jobs, recorder, teams=None, days=1):
+        self.jobs = jobs
+        self.recorder = recorder
+        self.teams = teams or []
+        self.days = days
+        self.recordings = {}
+        self.next_scan = 0
+
+    def scan(self):
+        """
+        Add jobs for the teams' games today and over the next few days.
+        """
+        today = datetime.now(SCHEDULE_TIMEZONE).date()
+        added = 0
+        for n in range(self.days + 1):
+            game_date = today + timedelta(days=n)
+            for (game_id, feed) in record.scheduled_games(game_date, self.teams):
+                if self.jobs.add(game_id, feed):
+                    logger.info("added job for game %d (%s feed)" %(
+                        game_id, feed))
+                    added += 1
+        if added:
+            self.jobs.save()
+
+    def check(self, jobs, now):
+        """
+        Look up the current schedule entries for jobs, starting recordings
+        for those whose media is live and deciding when to check the rest.
+        """
+        # one schedule request per date, or per game if the date isn't
+        # known yet
+        by_date = {}
+        for job in jobs:
+            by_date.setdefault(
+                self.schedule_date(job) or job.game_id, []
+            ).append(job)
+
+        for (key, jobs) in by_date.items():
+            if isinstance(key, int):
+                schedule = state.session.refresh_schedule(game_id=key)
+            else:
+                schedule = state.session.refresh_schedule(start=key, end=key)
+            games = {
+                game["gamePk"]: game
+                for date in schedule["dates"] for game in date["games"]
+            }
+            for job in jobs:
+                self.check_job(job, games.get(job.game_id), now)
+
+        self.jobs.save()
+
+    def schedule_date(self, job):
+        if not job.game_date:
+            return None
+        return dateutil.parser.parse(job.game_date).astimezone(
+            SCHEDULE_TIMEZONE).date()
+
+    def check_job(self, job, game, now):
+
+        if not game:
+            logger.debug("game %d not on the schedule" %(job.game_id))
+            job.game_date = None
+            job.next_check = now + MAX_POLL
+            return
+
+        job.game_date = game["gameDate"]
+        start = dateutil.parser.parse(job.game_date).timestamp()
+        status = game.get("status", {})
+
+        if status.get("detailedState") in ["Postponed", "Cancelled"]:
+            logger.info("game %d %s" %(
+                job.game_id, status["detailedState"].lower()))
+            job.status = "cancelled"
+        elif media_on(game, job.feed):
+            self.start(job)
+        elif (status.get("abstractGameState") == "Final"
+              or now - start > GIVE_UP_AFTER):
+            logger.warning("missed game %d" %(job.game_id))
+            job.status = "missed"
+        else:
+            job.next_check = now + poll_interval(start - now)
+            logger.debug("checking game %d again at %s" %(
+                job.game_id, datetime.fromtimestamp(job.next_check)))
+
+    def start(self, job):
+        logger.info("media is live for game %d, recording" %(job.game_id))
+        recording = record.Recording(job.game_id, preferred_stream=job.feed)
+        recording.attempts = job.attempts
+        self.recordings[job.game_id] = recording
+        self.recorder.recordings.append(recording)
+        self.recorder.resolve(recording)
+        job.status = "recording"
+
+    def sync(self):
+        """
+        Copy the state of finished recordings to their jobs.
+        """
+        changed = False
+        for (game_id, recording) in list(self.recordings.items()):
+            job = self.jobs.jobs[str(game_id)]
+            if recording.outfile != job.outfile:
+                job.outfile = recording.outfile
+                changed = True
+            if recording.status in ["done", "failed"]:
+                job.status = recording.status
+                job.attempts = recording.attempts
+                del self.recordings[game_id]
+                self.recorder.recordings.remove(recording)
+                changed = True
+        if changed:
+            self.jobs.save()
+
+    def run(self):
+        try:
+            while True:
+                now = time.time()
+                if now >= self.next_scan and self.teams:
+                    try:
+                        self.scan()
+                        self.next_scan = now + SCAN_INTERVAL
+                    except Exception as e:
+                        logger.error("couldn't scan schedule", exc_info=e)
+                        self.next_scan = now + MIN_POLL
+                due = self.jobs.due(now)
+                if due:
+                    try:
+                        self.check(due, now)
+                    except Exception as e:
+                        logger.error("couldn't check schedule", exc_info=e)
+                        for job in due:
+                            job.next_check = now + MIN_POLL
+                self.recorder.poll()
+                self.sync()
+                time.sleep(LOOP_INTERVAL)
+        finally:
+            self.recorder.stop()
+            self.jobs.save()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-p", "--profile", help="use alternate config profile")
+    parser.add_argument("-t", "--team", action="append", default=[],
+                        help="record this team's games")
+    parser.add_argument("-g", "--game", action="append", type=int, default=[],
+                        help="record this game ID")
+    parser.add_argument("-f", "--feed", default="home", choices=["home", "away"],
+                        help="feed to record for --game")
+    parser.add_argument("--days", type=int, default=1,
+                        help="days ahead to look for games")
+    parser.add_argument("-r", "--resolution", help="stream resolution")
+    parser.add_argument("-o", "--output-dir", default=".",
+                        help="directory to record to")
+    parser.add_argument("-j", "--concurrency", type=int,
+                        help="maximum number of simultaneous recordings")
+    parser.add_argument("--restarts", type=int, default=record.DEFAULT_RESTARTS,
+                        help="times to restart a failed recording")
+    parser.add_argument("--native", action="store_true",
+                        help="record with the built-in HLS downloader "
+                        "instead of streamlink")
+    parser.add_argument("--jobs", default=JOBS_FILE, help="job table file")
+    parser.add_argument("-l", "--list", action="store_true",
+                        help="list jobs and exit")
+    parser.add_argument("--log-json", help="log one JSON object per line",
+                        action="store_true")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("-v", "--verbose", action="count", default=0,
+                        help="verbose logging")
+    group.add_argument("-q", "--quiet", action="count", default=0,
+                        help="quiet logging")
+    options = parser.parse_args()
+
+    jobs = JobTable(options.jobs)
+    jobs.load()
+
+    if options.list:
+        for job in jobs.jobs.values():
+            print("%-8s %-5s %-10s %-20s %s" %(
+                job.game_id, job.feed, job.status,
+                job.game_date or "", job.outfile or ""))
+        return
+
+    config.settings.load()
+    if options.profile:
+        config.settings.set_profile(options.profile)
+
+    utils.setup_logging(
+        options.verbose - options.quiet,
+        json_format=(options.log_json
+                     or config.settings.profile.get("log_format") == "json")
+    )
+    metrics.export(
+        port=config.settings.profile.get("metrics_port"),
+        textfile=config.settings.profile.get("metrics_textfile")
+    )
+
+    # Let the job table be saved and recordings stopped on SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    state.session = session.get("mlb")
+
+    for game_id in options.game:
+        jobs.add(game_id, options.feed)
+    jobs.save()
+
+    recorder = record.Recorder(
+        [],
+        output_dir = options.output_dir,
+        resolution = (options.resolution
+                      or config.settings.profile.default_resolution
+                      or "best"),
+        concurrency = (options.concurrency
+                       or config.settings.profile.get("record_concurrency")
+                       or record.DEFAULT_CONCURRENCY),
+        max_restarts = options.restarts,
+        native = (options.native
+                  or config.settings.profile.get("native_recording", False))
+    )
+    dvr = DVR(jobs, recorder,
+              teams = [ t.lower() for t in options.team ],
+              days = options.days)
+    try:
+        dvr.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
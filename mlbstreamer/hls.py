@@ -0,0 +1,632 @@
+"""
+Built-in HLS downloader, for recording without streamlink.
+
+Segments are fetched through the stream session's own requests session, so
+they share its connection pool, cookies and auth headers, several at a time
+on a bounded thread pool, and written to the output file in playlist order.
+AES-128 encrypted streams need the optional `cryptography` package.
+"""
+import logging
+logger = logging.getLogger("mlbstreamer")
+import os
+import re
+import json
+import time
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+import urllib3
+from orderedattrdict import AttrDict
+
+from .exceptions import *
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+DEFAULT_WORKERS = 8
+MAX_RETRIES = 3
+RETRY_DELAY = 1
+
+# Segments are read from the network this many bytes at a time
+READ_SIZE = 256*1024
+# Written segments are synced to disk, and added to the manifest, in
+# batches of this many
+SYNC_SEGMENTS = 16
+# Preallocate this much more than the playlist's duration times its
+# bandwidth, which is only an estimate
+PREALLOCATE_MARGIN = 1.1
+
+MANIFEST_SUFFIX = ".manifest"
+# manifest key for the EXT-X-MAP initialization section
+INIT_SEQUENCE = -1
+
+ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(value):
+    return {
+        k: v[1:-1] if v.startswith('"') else v
+        for k, v in ATTRIBUTE_RE.findall(value)
+    }
+
+
+class Playlist(object):
+
+    def __init__(self, url):
+        self.url = url
+        self.variants = []
+        self.renditions = []
+        self.segments = []
+        self.target_duration = None
+        self.media_sequence = 0
+        self.init_uri = None
+        self.ended = False
+
+    @property
+    def is_master(self):
+        return bool(self.variants)
+
+    @property
+    def duration(self):
+        return sum(s.duration for s in self.segments)
+
+
+def parse_playlist(text, url):
+    """
+    Parse a master or media playlist.  URIs are made absolute relative to
+    the playlist's URL.
+    """
+    lines = [ l.strip() for l in text.splitlines() if l.strip() ]
+    if not lines or lines[0] != "#EXTM3U":
+        raise MLBPlayException("%s is not an HLS playlist" %(url))
+
+    playlist = Playlist(url)
+    key = None
+    duration = None
+    stream_info = None
+
+    for line in lines[1:]:
+        if line.startswith("#EXT-X-TARGETDURATION:"):
+            playlist.target_duration = float(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            playlist.media_sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",")[0])
+        elif line.startswith("#EXT-X-KEY:"):
+            attrs = parse_attributes(line.split(":", 1)[1])
+            if attrs.get("METHOD", "NONE") == "NONE":
+                key = None
+            else:
+                iv = attrs.get("IV")
+                key = AttrDict(
+                    method = attrs["METHOD"],
+                    uri = urljoin(url, attrs["URI"]),
+                    iv = bytes.fromhex(iv[2:]) if iv else None
+                )
+        elif line.startswith("#EXT-X-MAP:"):
+            playlist.init_uri = urljoin(
+                url, parse_attributes(line.split(":", 1)[1])["URI"]
+            )
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            stream_info = parse_attributes(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-MEDIA:"):
+            attrs = parse_attributes(line.split(":", 1)[1])
+            playlist.renditions.append(AttrDict(
+                type = attrs.get("TYPE"),
+                group_id = attrs.get("GROUP-ID"),
+                name = attrs.get("NAME"),
+                language = attrs.get("LANGUAGE"),
+                default = attrs.get("DEFAULT") == "YES",
+                uri = urljoin(url, attrs["URI"]) if "URI" in attrs else None
+            ))
+        elif line.startswith("#EXT-X-ENDLIST"):
+            playlist.ended = True
+        elif line.startswith("#"):
+            continue
+        elif stream_info is not None:
+            variant = AttrDict(
+                uri = urljoin(url, line),
+                bandwidth = int(stream_info.get("BANDWIDTH", 0)),
+                resolution = stream_info.get("RESOLUTION"),
+                frame_rate = float(stream_info.get("FRAME-RATE", 0)) or None,
+                codecs = stream_info.get("CODECS"),
+                audio = stream_info.get("AUDIO"),
+                video = stream_info.get("VIDEO")
+            )
+            variant.height = (int(variant.resolution.split("x")[1])
+                              if variant.resolution else None)
+            variant.name = variant_name(variant)
+            playlist.variants.append(variant)
+            stream_info = None
+        else:
+            playlist.segments.append(AttrDict(
+                sequence = playlist.media_sequence + len(playlist.segments),
+                uri = urljoin(url, line),
+                duration = duration or 0,
+                key = key
+            ))
+            duration = None
+
+    name_streamlink_variants(playlist)
+    return playlist
+
+
+def name_streamlink_variants(playlist):
+    """
+    Give each variant the name streamlink will list it under, the same way
+    streamlink's HLSStream.parse_variant_playlist does: its video
+    rendition's name, or its height like "720p", or its bandwidth like
+    "3500k", in playlist order, with "_alt" and "_alt2" added for
+    duplicates and any more duplicates left out.
+    """
+    names = set()
+    for variant in playlist.variants:
+        video_name = next(
+            (r.name for r in playlist.renditions
+             if r.type == "VIDEO" and r.group_id == variant.video and r.name),
+            None
+        )
+        if video_name:
+            name = video_name
+        elif variant.height:
+            name = "%dp" %(variant.height)
+        elif variant.bandwidth:
+            name = "%dk" %(variant.bandwidth // 1000)
+        else:
+            name = None
+        if name in names:
+            name += "_alt"
+            alts = len([ n for n in names if n.startswith(name) ])
+            if alts >= 2:
+                name = None
+            elif alts:
+                name += str(alts + 1)
+        if name:
+            names.add(name)
+        variant.streamlink_name = name
+
+
+def audio_renditions(playlist, variant):
+    """
+    Return the variant's alternate audio renditions that have their own
+    playlists, rather than being muxed into the variant's segments.
+    """
+    return [ r for r in playlist.renditions
+             if r.type == "AUDIO" and r.group_id == variant.audio and r.uri ]
+
+
+def variant_name(variant):
+    """
+    Name a variant like "720p", or "720p60" if its frame rate is over 30, or
+    by its bandwidth if its resolution isn't given.
+    """
+    if not variant.height:
+        return "%dk" %(variant.bandwidth // 1000)
+    if variant.frame_rate and variant.frame_rate > 30:
+        return "%dp%d" %(variant.height, round(variant.frame_rate))
+    return "%dp" %(variant.height)
+
+
+RESOLUTION_RE = re.compile(r"(\d+)p(?:@?(\d+))?(_alt)?$")
+
+def choose_variant(variants, resolution=None):
+    """
+    Pick the variant for a resolution like "720p", "720p60", "720p@30",
+    "best" or "worst", falling back to the best one.  A plain height prefers
+    a variant at 30fps or less if there is one.  Streamlink's "_alt" names
+    pick the variant streamlink would, or the best one at that height.
+    """
+    by_bandwidth = sorted(variants, key=lambda v: v.bandwidth)
+    if resolution == "worst":
+        return by_bandwidth[0]
+    if resolution and "_alt" in resolution:
+        exact = [ v for v in variants
+                  if v.get("streamlink_name") == resolution ]
+        if exact:
+            return exact[0]
+    match = RESOLUTION_RE.match(resolution or "")
+    if match:
+        (height, frame_rate, alt) = match.groups()
+        matching = [ v for v in by_bandwidth if v.height == int(height) ]
+        if frame_rate:
+            matching = [ v for v in matching
+                         if round(v.frame_rate or 30) == int(frame_rate) ]
+        elif not alt:
+            matching = ([ v for v in matching if (v.frame_rate or 30) <= 30 ]
+                        or matching)
+        if matching:
+            return matching[-1]
+        logger.warning("no %s variant, using the best one" %(resolution))
+    elif resolution not in [None, "best"]:
+        exact = [ v for v in by_bandwidth if v.name == resolution ]
+        if exact:
+            return exact[-1]
+        logger.warning("no %s variant, using the best one" %(resolution))
+    return by_bandwidth[-1]
+
+
+class BufferPool(object):
+    """
+    Reusable buffers for segment bodies, so memory use stays flat however
+    long the download runs.
+    """
+
+    def __init__(self):
+        self.buffers = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            return self.buffers.pop() if self.buffers else bytearray()
+
+    def put(self, buf):
+        with self.lock:
+            self.buffers.append(buf)
+
+
+def read_body(response, buf):
+    """
+    Read a streamed response's body into buf, growing it if needed, and
+    return the number of bytes read.
+    """
+    response.raw.decode_content = True
+    expected = int(response.headers.get("Content-Length") or 0)
+    if len(buf) < expected:
+        buf.extend(bytes(expected - len(buf)))
+    length = 0
+    while True:
+        if length == len(buf):
+            buf.extend(bytes(max(READ_SIZE, len(buf) // 2)))
+        with memoryview(buf) as view, view[length:] as chunk:
+            count = response.raw.readinto(chunk)
+        if not count:
+            return length
+        length += count
+
+
+def preallocate(f, length):
+    """
+    Reserve disk space for the rest of a download, where supported, so the
+    file isn't fragmented as it grows.
+    """
+    if not hasattr(os, "posix_fallocate"):
+        return
+    offset = f.tell()
+    if length <= offset:
+        return
+    try:
+        os.posix_fallocate(f.fileno(), offset, length - offset)
+    except OSError as e:
+        logger.debug("couldn't preallocate %s: %s" %(f.name, e))
+
+
+class Manifest(object):
+    """
+    Sidecar file listing the segments of a download that have been written,
+    and where, so an interrupted download can be resumed.  It holds one JSON
+    object per line: the variant being downloaded, then one line per
+    segment, then a final line once the download is complete.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.variant = None
+        self.segments = {}
+        self.complete = False
+        self.file = None
+
+    @property
+    def size(self):
+        return max(
+            (offset + length for (offset, length) in self.segments.values()),
+            default=0
+        )
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return False
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a line cut short when the last run died
+                break
+            if "variant" in entry:
+                self.variant = entry["variant"]
+            elif "sequence" in entry:
+                self.segments[entry["sequence"]] = (
+                    entry["offset"], entry["length"]
+                )
+            elif entry.get("complete"):
+                self.complete = True
+        return True
+
+    def open(self, variant=None, resume=False):
+        # rewrite the manifest, so a line cut short by the last run doesn't
+        # hide the lines appended after it
+        if not resume:
+            self.segments = {}
+        self.file = open(self.path, "w")
+        self.write(dict(variant=variant))
+        for sequence, (offset, length) in sorted(self.segments.items()):
+            self.write(dict(sequence=sequence, offset=offset, length=length))
+        self.sync()
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry) + "\n")
+
+    def add(self, sequence, offset, length):
+        self.segments[sequence] = (offset, length)
+        self.write(dict(sequence=sequence, offset=offset, length=length))
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def finish(self):
+        self.complete = True
+        self.write(dict(complete=True))
+        self.sync()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class HLSDownloader(object):
+    """
+    Downloads an HLS stream to a file.  Live playlists are reloaded until
+    they end.  With resume set, a download with a manifest from an earlier
+    run only fetches the segments it's missing, and appends them to the
+    file.
+    """
+
+    def __init__(self, stream_session, url, output,
+                 resolution=None, workers=DEFAULT_WORKERS, resume=False):
+        self.stream_session = stream_session
+        self.url = url
+        self.output = output
+        self.resolution = resolution
+        self.workers = workers
+        self.resume = resume
+        self.variant = None
+        self.manifest = Manifest(output + MANIFEST_SUFFIX)
+        self.buffers = BufferPool()
+        self.unsynced = []
+        self.keys = {}
+        self.keys_lock = threading.Lock()
+
+    @property
+    def headers(self):
+        # read per request, so a refreshed token is picked up
+        return self.stream_session.headers or {}
+
+    def fetch(self, url, into=None):
+        """
+        Fetch a URL, retrying on errors.  If a buffer is given, the body is
+        read into it and its length returned instead of the response.
+        """
+        for attempt in range(MAX_RETRIES):
+            try:
+                response = self.stream_session.session.get(
+                    url, headers=self.headers, stream=into is not None
+                )
+                response.raise_for_status()
+                if into is None:
+                    return response
+                with response:
+                    return read_body(response, into)
+            except (requests.exceptions.RequestException,
+                    urllib3.exceptions.HTTPError) as e:
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                logger.debug("retrying %s: %s" %(url, e))
+                time.sleep(RETRY_DELAY * (attempt + 1))
+
+    def load_playlist(self, previous_variant=None):
+        playlist = parse_playlist(self.fetch(self.url).text, self.url)
+        if playlist.is_master:
+            # stick with the variant an earlier run was downloading, since
+            # the segments of different variants don't line up
+            variant = next(
+                (v for v in playlist.variants
+                 if previous_variant
+                 and v.resolution == previous_variant["resolution"]
+                 and v.bandwidth == previous_variant["bandwidth"]),
+                None
+            ) or choose_variant(playlist.variants, self.resolution)
+            if audio_renditions(playlist, variant):
+                raise MLBPlayException(
+                    "%s has separate audio renditions, which the built-in "
+                    "downloader doesn't support; record with streamlink "
+                    "instead" %(self.url))
+            logger.info("using %s variant at %d bps" %(
+                variant.resolution, variant.bandwidth))
+            self.variant = dict(resolution=variant.resolution,
+                                bandwidth=variant.bandwidth)
+            self.url = variant.uri
+            playlist = parse_playlist(self.fetch(self.url).text, self.url)
+        return playlist
+
+    def get_key(self, key):
+        if key.method != "AES-128":
+            raise MLBPlayException("unsupported HLS encryption: %s" %(key.method))
+        if Cipher is None:
+            raise MLBPlayException(
+                "encrypted HLS streams need the cryptography package")
+        with self.keys_lock:
+            if key.uri not in self.keys:
+                self.keys[key.uri] = self.fetch(key.uri).content
+            return self.keys[key.uri]
+
+    def download_segment(self, segment):
+        """
+        Fetch and decrypt a segment into a pooled buffer, returning
+        (sequence, buffer, length).
+        """
+        buf = self.buffers.get()
+        length = self.fetch(segment.uri, into=buf)
+        if segment.key:
+            iv = segment.key.iv or segment.sequence.to_bytes(16, "big")
+            decryptor = Cipher(
+                algorithms.AES(self.get_key(segment.key)), modes.CBC(iv)
+            ).decryptor()
+            with memoryview(buf) as view, view[:length] as body:
+                data = decryptor.update(body) + decryptor.finalize()
+            # strip PKCS7 padding
+            length = len(data) - data[-1]
+            buf[:length] = data[:length]
+        return (segment.sequence, buf, length)
+
+    def write_segment(self, outfile, sequence, buf, length):
+        offset = outfile.tell()
+        with memoryview(buf) as view:
+            written = 0
+            while written < length:
+                with view[written:length] as chunk:
+                    written += outfile.write(chunk)
+        if isinstance(buf, bytearray):
+            self.buffers.put(buf)
+        self.unsynced.append((sequence, offset, length))
+        if len(self.unsynced) >= SYNC_SEGMENTS:
+            self.sync(outfile)
+
+    def sync(self, outfile):
+        """
+        Sync written segments to disk, then add them to the manifest, so it
+        never lists data that could be lost.
+        """
+        if not self.unsynced:
+            return
+        os.fsync(outfile.fileno())
+        for entry in self.unsynced:
+            self.manifest.add(*entry)
+        self.manifest.sync()
+        self.unsynced = []
+
+    def run(self, stopped=None):
+        """
+        Download the stream, stopping early if the `stopped` event is set.
+        """
+        stopped = stopped or threading.Event()
+
+        resume = (self.resume and os.path.exists(self.output)
+                  and self.manifest.load())
+        if resume and self.manifest.complete:
+            logger.info("%s is already complete" %(self.output))
+            return
+
+        playlist = self.load_playlist(
+            self.manifest.variant if resume else None
+        )
+        done = self.manifest.segments if resume else {}
+        if resume:
+            logger.info("resuming %s after %d segments" %(
+                self.output, len(done)))
+        next_sequence = playlist.media_sequence
+        # segments in flight, beyond which we wait for the oldest to finish
+        window = self.workers * 2
+
+        # unbuffered, so segments go from their buffers straight to the file
+        with open(self.output, "r+b" if resume else "wb",
+                  buffering=0) as outfile, \
+             ThreadPoolExecutor(max_workers=self.workers) as executor:
+
+            if resume:
+                # drop anything written after the last manifest entry
+                outfile.truncate(self.manifest.size)
+                outfile.seek(self.manifest.size)
+            self.manifest.open(self.variant, resume=resume)
+            if playlist.ended and self.variant:
+                preallocate(outfile, int(
+                    playlist.duration * self.variant["bandwidth"] / 8
+                    * PREALLOCATE_MARGIN
+                ))
+
+            try:
+                if playlist.init_uri and INIT_SEQUENCE not in done:
+                    init = self.fetch(playlist.init_uri).content
+                    self.write_segment(outfile, INIT_SEQUENCE, init, len(init))
+
+                while not stopped.is_set():
+                    pending = deque()
+                    for segment in playlist.segments:
+                        if (segment.sequence < next_sequence
+                            or segment.sequence in done):
+                            continue
+                        if stopped.is_set():
+                            break
+                        while len(pending) >= window:
+                            self.write_segment(outfile, *pending.popleft().result())
+                        pending.append(
+                            executor.submit(self.download_segment, segment)
+                        )
+                        next_sequence = segment.sequence + 1
+                    while pending:
+                        self.write_segment(outfile, *pending.popleft().result())
+
+                    if playlist.ended:
+                        if not stopped.is_set():
+                            self.sync(outfile)
+                            self.manifest.finish()
+                        break
+                    stopped.wait(playlist.target_duration or RETRY_DELAY)
+                    playlist = parse_playlist(self.fetch(self.url).text, self.url)
+            finally:
+                self.sync(outfile)
+                # drop whatever preallocated space wasn't used
+                outfile.truncate(outfile.tell())
+                self.manifest.close()
+
+
+class DownloadProcess(object):
+    """
+    Runs an HLSDownloader in a thread, behind the parts of the Popen
+    interface that mlbplay and mlbrecord use, so it can stand in for a
+    streamlink process.
+    """
+
+    def __init__(self, downloader):
+        self.downloader = downloader
+        self.stopped = threading.Event()
+        self.returncode = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        try:
+            self.downloader.run(self.stopped)
+            self.returncode = -15 if self.stopped.is_set() else 0
+        except Exception as e:
+            logger.error("download of %s failed" %(self.downloader.url),
+                         exc_info=e)
+            self.returncode = 1
+
+    def poll(self):
+        if self.thread.is_alive():
+            return None
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            raise subprocess.TimeoutExpired("hls", timeout)
+        return self.returncode
+
+    def terminate(self):
+        self.stopped.set()
+
+    kill = terminate
@@ -0,0 +1,287 @@
+"""
+In-process counters and histograms, exported in the Prometheus text format.
+
+Metrics can be scraped from a local HTTP endpoint (the `metrics_port`
+profile setting) or written to a file for node_exporter's textfile
+collector (`metrics_textfile`).
+"""
+import logging
+logger = logging.getLogger("mlbstreamer")
+import os
+import atexit
+import threading
+
+# Default histogram buckets, in seconds
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+TEXTFILE_INTERVAL = 15
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    return "{%s}" %(",".join(
+        '%s="%s"' %(k, str(v).replace("\\", "\\\\")
+                    .replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in pairs
+    ))
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+
+    TYPE = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        try:
+            return tuple(str(labels[l]) for l in self.labels)
+        except KeyError as e:
+            raise ValueError("missing label %s for %s" %(e, self.name))
+
+    def render(self):
+        lines = [
+            "# HELP %s %s" %(self.name, self.help),
+            "# TYPE %s %s" %(self.name, self.TYPE)
+        ]
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            lines += self.render_value(key, value)
+        return lines
+
+
+class Counter(Metric):
+
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    def render_value(self, key, value):
+        return ["%s%s %s" %(
+            self.name, format_labels(self.labels, key), format_value(value)
+        )]
+
+
+class Histogram(Metric):
+
+    TYPE = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = sorted(buckets) + [float("inf")]
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            try:
+                (counts, total) = self.values[key]
+            except KeyError:
+                counts = [0] * len(self.buckets)
+                total = 0.0
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def render_value(self, key, value):
+        (counts, total) = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append("%s_bucket%s %d" %(
+                self.name,
+                format_labels(self.labels, key,
+                              [("le", format_value(float(bound)))]),
+                cumulative
+            ))
+        lines.append("%s_sum%s %s" %(
+            self.name, format_labels(self.labels, key), format_value(total)))
+        lines.append("%s_count%s %d" %(
+            self.name, format_labels(self.labels, key), cumulative))
+        return lines
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        return "\n".join(
+            line for metric in self.metrics for line in metric.render()
+        ) + "\n"
+
+    def write_textfile(self, path):
+        # Write atomically so the collector never reads a partial file
+        tmp_file = "%s.%d" %(path, os.getpid())
+        with open(tmp_file, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_file, path)
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "mlbstreamer_http_requests_total",
+    "HTTP requests made, by endpoint and status code",
+    ["endpoint", "status"]
+)
+http_request_duration = registry.histogram(
+    "mlbstreamer_http_request_duration_seconds",
+    "Time taken by HTTP requests, by endpoint",
+    ["endpoint"]
+)
+cache_lookups = registry.counter(
+    "mlbstreamer_cache_lookups_total",
+    "Cache lookups, by cache and result (hit or miss)",
+    ["cache", "result"]
+)
+token_refreshes = registry.counter(
+    "mlbstreamer_token_refreshes_total",
+    "Access token refreshes, by provider",
+    ["provider"]
+)
+auth_failures = registry.counter(
+    "mlbstreamer_auth_failures_total",
+    "Rejected authentication or authorization attempts, by endpoint",
+    ["endpoint"]
+)
+stream_spawn_latency = registry.histogram(
+    "mlbstreamer_stream_spawn_seconds",
+    "Time from a stream being requested to the player or downloader being "
+    "spawned (not to playback starting)",
+    ["provider"]
+)
+player_exits = registry.counter(
+    "mlbstreamer_player_exits_total",
+    "Player (streamlink) exits, by exit code",
+    ["code"]
+)
+
+
+class MetricsServer(object):
+    """
+    Serves the registry at /metrics from a background thread.
+    """
+
+    def __init__(self, registry, host="127.0.0.1", port=0):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ["/", "/metrics"]:
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        logger.info("serving metrics at http://%s:%d/metrics" %(
+            self.host, self.port))
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class TextfileWriter(object):
+    """
+    Rewrites a textfile collector file periodically, and once more on exit.
+    """
+
+    def __init__(self, registry, path, interval=TEXTFILE_INTERVAL):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def write(self):
+        try:
+            self.registry.write_textfile(self.path)
+        except OSError as e:
+            logger.warning("couldn't write metrics to %s: %s" %(self.path, e))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self.stopped.set()
+        self.write()
+
+
+exporters = []
+
+def export(port=None, textfile=None, host="127.0.0.1"):
+    """
+    Start exporting the metrics, if either a port or textfile is given.
+    Does nothing if the metrics are already being exported.
+    """
+    if exporters:
+        return
+    if port is not None:
+        exporters.append(MetricsServer(registry, host=host, port=int(port)))
+    if textfile:
+        exporters.append(TextfileWriter(registry, os.path.expanduser(textfile)))
+    for exporter in exporters:
+        exporter.start()
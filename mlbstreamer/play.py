@@ -3,6 +3,8 @@ import logging
 logger = logging.getLogger(__name__)
 
 import os
+import time
+import threading
 import pytz
 import subprocess
 import argparse
@@ -11,13 +13,15 @@ import pytz
 import shlex
 from itertools import chain
 
-import dateutil.parser
 from orderedattrdict import AttrDict
 
 from . import config
 from . import state
 from . import session
 from . import utils
+from . import timing
+from . import metrics
+from . import hls
 from .exceptions import *
 # from .session import *
 
@@ -33,26 +37,45 @@ def handle_exception(exc_type, exc_value, exc_traceback):
 
 sys.excepthook = handle_exception
 
-def play_stream(game_specifier, resolution=None,
-                offset=None,
-                media_id = None,
-                preferred_stream=None,
-                call_letters=None,
-                output=None,
-                verbose=0):
+# seconds a resolved stream URL is reused for before being looked up again
+RESOLVED_STREAM_MAX_AGE = 60
+
+
+class ResolvedStreamCache(object):
+    """
+    Recently resolved streams, keyed by provider, game and feed, so that a
+    stream looked up ahead of time can be played without going back to the
+    network.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                (resolved, resolved_at) = self.streams[key]
+            except KeyError:
+                return None
+            if time.time() - resolved_at > self.max_age:
+                del self.streams[key]
+                return None
+            return resolved
+
+    def put(self, key, resolved):
+        with self.lock:
+            self.streams[key] = (resolved, time.time())
+
+resolved_streams = ResolvedStreamCache(RESOLVED_STREAM_MAX_AGE)
+
+
+def find_game(game_specifier):
 
-    live = False
     team = None
     game_number = 1
     game_date = None
-    # sport_code = "mlb" # default sport is MLB
-
-    # media_title = "MLBTV"
-    media_id = None
-    allow_stdout=False
-
-    if resolution is None:
-        resolution = "best"
 
     if isinstance(game_specifier, int):
         game_id = game_specifier
@@ -67,12 +90,14 @@ def play_stream(game_specifier, resolution=None,
             try:
                 (game_date, team) = game_specifier.split(".")
             except ValueError:
-                game_date = datetime.now().date()
+                game_date = datetime.now().strftime("%Y-%m-%d")
                 team = game_specifier
 
         if "-" in team:
             (sport_code, team) = team.split("-")
 
+        # dateutil pulls in six, so keep it off the startup path
+        import dateutil.parser
         game_date = dateutil.parser.parse(game_date)
         game_number = int(game_number)
         teams =  state.session.teams(season=game_date.year)
@@ -96,15 +121,36 @@ def play_stream(game_specifier, resolution=None,
     try:
         date = schedule["dates"][-1]
         game = date["games"][game_number-1]
-        game_id = game["gamePk"]
     except IndexError:
         raise MLBPlayException("No game %d found for %s on %s" %(
             game_number, team, game_date)
         )
+    return (game, team)
 
-    logger.info("playing game %d at %s" %(
-        game_id, resolution)
-    )
+
+def resolve_stream(game_specifier, preferred_stream=None, call_letters=None,
+                   refresh=False):
+    """
+    Find the game, media item and stream URL for a game.  Streams for game
+    IDs are cached for a short while, so they can be resolved ahead of time.
+    With refresh set, the cached stream is replaced with a new one.
+    """
+
+    key = None
+    if isinstance(game_specifier, int):
+        key = (state.session.session_type(), game_specifier,
+               preferred_stream, call_letters)
+    if key and not refresh:
+        with timing.span("cache resolved_streams"):
+            resolved = resolved_streams.get(key)
+        metrics.cache_lookups.inc(cache="resolved_streams",
+                                  result="hit" if resolved else "miss")
+        if resolved:
+            logger.debug("using resolved stream for game %d" %(game_specifier))
+            return resolved
+
+    (game, team) = find_game(game_specifier)
+    game_id = game["gamePk"]
 
     away_team_abbrev = game["teams"]["away"]["team"]["abbreviation"].lower()
     home_team_abbrev = game["teams"]["home"]["team"]["abbreviation"].lower()
@@ -119,7 +165,6 @@ def play_stream(game_specifier, resolution=None,
     try:
         media = next(state.session.get_media(
             game_id,
-            media_id = media_id,
             # title=media_title,
             preferred_stream=preferred_stream,
             call_letters = call_letters
@@ -129,28 +174,21 @@ def play_stream(game_specifier, resolution=None,
 
     # media_id = media["mediaId"] if "mediaId" in media else media["guid"]
 
-    media_state = media["mediaState"]
-
     # Get any team-specific profile overrides, and apply settings for them
-    profiles = tuple([ list(d.values())[0]
-                 for d in config.settings.profile_map.get("team", {})
-                 if list(d.keys())[0] in [
-                         away_team_abbrev, home_team_abbrev
-                 ] ])
-
-    if len(profiles):
-        # override proxies for team, if defined
-        if len(config.settings.profiles[profiles].proxies):
-            old_proxies = state.session.proxies
-            state.session.proxies = config.settings.profiles[profiles].proxies
-            state.session.refresh_access_token(clear_token=True)
-            state.session.proxies = old_proxies
+    team_profile = config.settings.team_profile(
+        away_team_abbrev, home_team_abbrev
+    )
+
+    stream_session = state.session
+    if team_profile and team_profile.get("proxies"):
+        # use a session that goes through the team's proxies, if defined
+        stream_session = state.session.proxy_session(team_profile.proxies)
 
     if "playbacks" in media:
         playback = media["playbacks"][0]
         media_url = playback["location"]
     else:
-        stream = state.session.get_stream(media)
+        stream = stream_session.get_stream(media)
 
         try:
             # media_url = stream["stream"]["complete"]
@@ -158,6 +196,30 @@ def play_stream(game_specifier, resolution=None,
         except (TypeError, AttributeError):
             raise MLBPlayException("no stream URL for game %d" %(game_id))
 
+    resolved = AttrDict(
+        game = game,
+        media = media,
+        media_url = media_url,
+        stream_session = stream_session
+    )
+    if key:
+        resolved_streams.put(key, resolved)
+    return resolved
+
+
+def build_command(resolved, resolution,
+                  offset=None,
+                  output=None,
+                  verbose=0):
+
+    game = resolved.game
+    game_id = game["gamePk"]
+    media = resolved.media
+    media_id = media.get("mediaId", media.get("guid"))
+    media_state = media["mediaState"]
+    stream_session = resolved.stream_session
+    allow_stdout = False
+
     offset_timestamp = None
     offset_seconds = None
 
@@ -175,6 +237,7 @@ def play_stream(game_specifier, resolution=None,
             logger.debug("live stream")
             # calculate HLS offset, which is negative from end of stream
             # for live streams
+            import dateutil.parser
             start_time = dateutil.parser.parse(timestamps["S"])
             offset_delta = (
                 datetime.now(pytz.utc)
@@ -192,28 +255,34 @@ def play_stream(game_specifier, resolution=None,
     header_args = []
     cookie_args = []
 
-    if state.session.headers:
+    if stream_session.headers:
         header_args = list(
             chain.from_iterable([
                 ("--http-header", f"{k}={v}")
-            for k, v in state.session.headers.items()
+            for k, v in stream_session.headers.items()
         ]))
 
-    if state.session.cookies:
+    if stream_session.cookies:
         cookie_args = list(
             chain.from_iterable([
                 ("--http-cookie", f"{c.name}={c.value}")
-            for c in state.session.cookies
+            for c in stream_session.cookies
         ]))
 
+    # Pick the variant ourselves, then ask streamlink for it by the name
+    # streamlink gives it.  Streamlink still gets the master playlist, so
+    # alternate audio renditions (--hls-audio-select) keep working.
+    variant = stream_session.get_variant(resolved.media_url, resolution)
+    if variant and variant.get("streamlink_name"):
+        stream_args = [resolved.media_url, variant.streamlink_name]
+    else:
+        stream_args = [resolved.media_url, resolution]
+
     cmd = [
         "streamlink",
         # "-l", "debug",
         "--player", config.settings.profile.player,
-    ] + cookie_args + header_args + [
-        media_url,
-        resolution,
-    ]
+    ] + cookie_args + header_args + stream_args
 
     if config.settings.profile.streamlink_args:
         cmd += shlex.split(config.settings.profile.streamlink_args)
@@ -232,23 +301,124 @@ def play_stream(game_specifier, resolution=None,
             cmd += ["--ffmpeg-verbose"]
 
     if output is not None:
-        if output == True or os.path.isdir(output):
-            outfile = get_output_filename(
-                game,
-                media["callLetters"],
-                resolution,
-                offset=str(offset_seconds)
+        cmd += ["-o", get_output_path(
+            resolved, resolution, output,
+            offset=str(offset_seconds) if offset_seconds is not None else None
+        )]
+
+    return (cmd, allow_stdout)
+
+
+def get_output_path(resolved, resolution, output, offset=None):
+    """
+    Return the file to save a stream to, given the -s option: a file name,
+    a directory, or True for a generated file name.
+    """
+    if output == True or os.path.isdir(output):
+        outfile = get_output_filename(
+            resolved.game,
+            resolved.media["callLetters"],
+            resolution,
+            offset=offset
+        )
+        if os.path.isdir(output):
+            outfile = os.path.join(output, outfile)
+        return outfile
+    return output
+
+
+def play_stream(game_specifier, resolution=None,
+                offset=None,
+                media_id = None,
+                preferred_stream=None,
+                call_letters=None,
+                output=None,
+                verbose=0,
+                requested=None,
+                native=False,
+                resume=False):
+
+    # media_title = "MLBTV"
+    if requested is None:
+        requested = time.time()
+
+    with utils.log_flow("play"):
+        if resolution is None:
+            resolution = "best"
+
+        with timing.span("resolve_stream"):
+            resolved = resolve_stream(
+                game_specifier,
+                preferred_stream = preferred_stream,
+                call_letters = call_letters
             )
-            if os.path.isdir(output):
-                outfile = os.path.join(output, outfile)
+        game_id = resolved.game["gamePk"]
+
+        logger.info("playing game %d at %s" %(
+            game_id, resolution)
+        )
+
+        if native and output is not None:
+            if offset is not None:
+                logger.warning("the built-in downloader ignores -b")
+            outfile = get_output_path(resolved, resolution, output)
+            logger.info("downloading to %s" %(outfile))
+            proc = hls.DownloadProcess(hls.HLSDownloader(
+                resolved.stream_session, resolved.media_url, outfile,
+                resolution = resolution,
+                resume = resume
+            )).start()
         else:
-            outfile = output
+            with timing.span("build_command"):
+                (cmd, allow_stdout) = build_command(
+                    resolved, resolution,
+                    offset = offset,
+                    output = output,
+                    verbose = verbose
+                )
+
+            logger.debug("Running cmd: %s" % " ".join(cmd))
+            with timing.span("spawn %s" %(os.path.basename(cmd[0]))):
+                proc = subprocess.Popen(cmd, stdout=None if allow_stdout else open(os.devnull, 'w'))
+        latency = time.time() - requested
+        # only as far as the process starting: streamlink still has to
+        # fetch the playlists and first segments before anything plays
+        metrics.stream_spawn_latency.observe(
+            latency, provider=state.session.session_type()
+        )
+        logger.info("spawned player for game %d in %.3fs" %(
+            game_id, latency)
+        )
+        return proc
+
 
-        cmd += ["-o", outfile]
+def wait_player(proc):
+    """
+    Wait for a player started by play_stream to exit, and return its exit
+    code.
+    """
+    try:
+        code = proc.wait()
+    except KeyboardInterrupt:
+        # the built-in downloader runs on a daemon thread, so give it the
+        # chance to trim and sync its output file before we exit
+        logger.info("stopping player")
+        proc.terminate()
+        proc.wait()
+        raise
+    metrics.player_exits.inc(code=code)
+    if code:
+        logger.warning("player exited with code %d" %(code))
+    return code
 
-    logger.debug("Running cmd: %s" % " ".join(cmd))
-    proc = subprocess.Popen(cmd, stdout=None if allow_stdout else open(os.devnull, 'w'))
-    return proc
+
+def watch_player(proc):
+    """
+    Wait for a player to exit in the background.
+    """
+    thread = threading.Thread(target=wait_player, args=(proc,), daemon=True)
+    thread.start()
+    return thread
 
 
 def get_output_filename(game, station, resolution, offset=None):
@@ -258,6 +428,7 @@ def get_output_filename(game, station, resolution, offset=None):
         # game = date["games"][0]
         # Return file name in the format mlb.yyyy-mm-dd.away.vs.home.hh:mm.STATION.ts
 
+        import dateutil.parser
         start_time = dateutil.parser.parse(
             game["gameDate"]
         ).astimezone(pytz.timezone("US/Eastern"))
@@ -313,17 +484,38 @@ def main():
     init_parser.add_argument("--init-config", help="initialize configuration",
                         action="store_true")
     init_parser.add_argument("-p", "--profile", help="use alternate config profile")
+    init_parser.add_argument("--timings", action="store_true",
+                             help="print a tree of where the time went")
+    init_parser.add_argument("--pstats", metavar="FILE",
+                             help="save cProfile stats to FILE")
     options, args = init_parser.parse_known_args()
 
     if options.init_config:
         config.settings.init_config()
         sys.exit(0)
 
+    if options.timings:
+        timing.enable()
+    with timing.profiled(options.pstats):
+        proc = run(options, args, init_parser)
+    if options.timings:
+        timing.report()
+    if proc:
+        wait_player(proc)
+
+
+def run(options, args, init_parser):
+
     config.settings.load()
 
     if options.profile:
         config.settings.set_profile(options.profile)
 
+    metrics.export(
+        port=config.settings.profile.get("metrics_port"),
+        textfile=config.settings.profile.get("metrics_textfile")
+    )
+
     parser = argparse.ArgumentParser(
         description=init_parser.format_help(),
         formatter_class=argparse.RawDescriptionHelpFormatter
@@ -340,6 +532,13 @@ def main():
                         nargs="?", const=True)
     parser.add_argument("--no-cache", help="do not use response cache",
                         action="store_true")
+    parser.add_argument("--native", action="store_true",
+                        help="save streams with the built-in HLS downloader "
+                        "instead of streamlink")
+    parser.add_argument("--resume", action="store_true",
+                        help="with --native, resume an interrupted download")
+    parser.add_argument("--log-json", help="log one JSON object per line",
+                        action="store_true")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-v", "--verbose", action="count", default=0,
                         help="verbose logging")
@@ -361,25 +560,32 @@ def main():
     else:
         game_specifier = game
 
-    utils.setup_logging(options.verbose - options.quiet)
+    utils.setup_logging(
+        options.verbose - options.quiet,
+        json_format=(options.log_json
+                     or config.settings.profile.get("log_format") == "json")
+    )
 
     if not options.game:
         parser.error("option game")
 
-    state.session = session.new(provider)
+    with timing.span("session %s" %(provider)):
+        state.session = session.get(provider)
     preferred_stream = None
     date = None
 
     try:
-        proc = play_stream(
+        return play_stream(
             game_specifier,
             options.resolution,
             offset = options.begin,
             preferred_stream = preferred_stream,
             output = options.save_stream,
-            verbose = options.verbose
+            verbose = options.verbose,
+            native = (options.native or options.resume
+                      or config.settings.profile.get("native_recording", False)),
+            resume = options.resume
         )
-        proc.wait()
     except MLBPlayInvalidArgumentError as e:
         raise argparse.ArgumentTypeError(str(e))
     except MLBPlayException as e:
@@ -0,0 +1,336 @@
+"""
+Record several games at once.
+
+Games are given as mlbplay-style game specifiers, or picked from a day's
+schedule with --team or --all.  All of them are resolved concurrently with
+one logged-in session, then recorded by up to --concurrency streamlink
+processes at a time.  A recording whose process fails is resolved again and
+restarted, up to --restarts times, into a new file.  With --native, the
+built-in downloader is used instead, and restarts pick up where the failed
+download left off.
+"""
+import logging
+logger = logging.getLogger("mlbstreamer")
+import os
+import sys
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytz
+
+from . import config
+from . import state
+from . import session
+from . import play
+from . import utils
+from . import metrics
+from . import hls
+from .exceptions import *
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RESTARTS = 3
+RESTART_DELAY = 10
+POLL_INTERVAL = 1
+
+
+class Recording(object):
+
+    def __init__(self, game_specifier, preferred_stream=None):
+        self.game_specifier = game_specifier
+        self.preferred_stream = preferred_stream
+        self.status = "resolving"
+        self.future = None
+        self.resolved = None
+        self.proc = None
+        self.log_file = None
+        self.outfile = None
+        self.attempts = 0
+        self.restart_at = None
+        self.error = None
+
+    def __str__(self):
+        if self.resolved:
+            return str(self.resolved.game["gamePk"])
+        return str(self.game_specifier)
+
+    def output_filename(self, resolution, numbered=True):
+        filename = play.get_output_filename(
+            self.resolved.game,
+            self.resolved.media["callLetters"],
+            resolution
+        )
+        if self.attempts and numbered:
+            # keep what was recorded before the restart
+            (base, ext) = os.path.splitext(filename)
+            filename = "%s.%d%s" %(base, self.attempts, ext)
+        return filename
+
+
+class Recorder(object):
+    """
+    Resolves and records a list of games, keeping at most `concurrency`
+    streamlink processes running.
+    """
+
+    def __init__(self, recordings, output_dir=".",
+                 resolution="best",
+                 concurrency=DEFAULT_CONCURRENCY,
+                 max_restarts=DEFAULT_RESTARTS,
+                 restart_delay=RESTART_DELAY,
+                 native=False):
+        self.recordings = recordings
+        self.output_dir = output_dir
+        self.resolution = resolution
+        self.concurrency = concurrency
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.native = native
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    @property
+    def running(self):
+        return [ r for r in self.recordings if r.status == "recording" ]
+
+    @property
+    def finished(self):
+        return all(r.status in ["done", "failed"] for r in self.recordings)
+
+    def resolve(self, recording, refresh=False):
+        recording.status = "resolving"
+        recording.future = self.executor.submit(
+            play.resolve_stream,
+            recording.game_specifier,
+            preferred_stream = recording.preferred_stream,
+            refresh = refresh
+        )
+
+    def start(self, recording):
+        # the built-in downloader resumes into the same file
+        recording.outfile = os.path.join(
+            self.output_dir,
+            recording.output_filename(self.resolution, numbered=not self.native)
+        )
+        logger.info("recording %s to %s" %(recording, recording.outfile))
+        if self.native:
+            recording.proc = hls.DownloadProcess(hls.HLSDownloader(
+                recording.resolved.stream_session,
+                recording.resolved.media_url,
+                recording.outfile,
+                resolution = self.resolution,
+                resume = True
+            )).start()
+        else:
+            (cmd, allow_stdout) = play.build_command(
+                recording.resolved, self.resolution, output=recording.outfile
+            )
+            logger.debug("Running cmd: %s" % " ".join(cmd))
+            recording.log_file = open(recording.outfile + ".log", "a")
+            recording.proc = subprocess.Popen(
+                cmd, stdout=subprocess.DEVNULL, stderr=recording.log_file
+            )
+        recording.status = "recording"
+
+    def fail(self, recording, error):
+        recording.error = error
+        recording.attempts += 1
+        if recording.attempts > self.max_restarts:
+            logger.error("giving up on %s: %s" %(recording, error))
+            recording.status = "failed"
+            return
+        logger.warning("%s failed (%s), restarting in %ds (%d/%d)" %(
+            recording, error, self.restart_delay,
+            recording.attempts, self.max_restarts))
+        recording.status = "waiting"
+        recording.restart_at = time.time() + self.restart_delay
+
+    def poll(self):
+
+        now = time.time()
+        for recording in self.recordings:
+
+            if recording.status == "resolving" and recording.future.done():
+                try:
+                    recording.resolved = recording.future.result()
+                    recording.status = "ready"
+                except MLBPlayException as e:
+                    self.fail(recording, e)
+                except Exception as e:
+                    logger.debug("resolve failed", exc_info=e)
+                    self.fail(recording, e)
+
+            elif recording.status == "recording":
+                code = recording.proc.poll()
+                if code is None:
+                    continue
+                if recording.log_file:
+                    recording.log_file.close()
+                metrics.player_exits.inc(code=code)
+                if code == 0:
+                    logger.info("finished recording %s" %(recording))
+                    recording.status = "done"
+                else:
+                    self.fail(recording, "streamlink exited with code %d" %(code))
+
+            elif recording.status == "waiting" and now >= recording.restart_at:
+                # the stream URL or token may have gone stale
+                self.resolve(recording, refresh=True)
+
+        for recording in self.recordings:
+            if len(self.running) >= self.concurrency:
+                break
+            if recording.status == "ready":
+                try:
+                    self.start(recording)
+                except (MLBPlayException, OSError) as e:
+                    self.fail(recording, e)
+
+    def run(self):
+        for recording in self.recordings:
+            self.resolve(recording)
+        try:
+            while not self.finished:
+                self.poll()
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self.stop()
+        return [ r for r in self.recordings if r.status == "failed" ]
+
+    def stop(self):
+        for recording in self.running:
+            logger.info("stopping recording %s" %(recording))
+            recording.proc.terminate()
+        for recording in self.running:
+            try:
+                recording.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                recording.proc.kill()
+                # the built-in downloader stops between segments, and still
+                # has to trim and sync its output file
+                recording.proc.wait()
+            if recording.log_file:
+                recording.log_file.close()
+        self.executor.shutdown(wait=False)
+
+
+def scheduled_games(game_date, teams=None):
+    """
+    Return (game_id, preferred_stream) for each game on a date, or only the
+    games involving `teams` if given.
+    """
+    schedule = state.session.schedule(start=game_date, end=game_date)
+    games = []
+    for date in schedule["dates"]:
+        for game in date["games"]:
+            away = game["teams"]["away"]["team"]["abbreviation"].lower()
+            home = game["teams"]["home"]["team"]["abbreviation"].lower()
+            if not teams:
+                games.append((game["gamePk"], "home"))
+            elif home in teams:
+                games.append((game["gamePk"], "home"))
+            elif away in teams:
+                games.append((game["gamePk"], "away"))
+    return games
+
+
+def main():
+
+    today = datetime.now(pytz.timezone('US/Eastern')).date()
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-p", "--profile", help="use alternate config profile")
+    parser.add_argument("-d", "--date", help="date of games to record",
+                        type=utils.valid_date, default=today)
+    parser.add_argument("-t", "--team", action="append",
+                        help="record this team's games on --date")
+    parser.add_argument("-a", "--all", action="store_true",
+                        help="record all games on --date")
+    parser.add_argument("-r", "--resolution", help="stream resolution")
+    parser.add_argument("-o", "--output-dir", default=".",
+                        help="directory to record to")
+    parser.add_argument("-j", "--concurrency", type=int,
+                        help="maximum number of simultaneous recordings")
+    parser.add_argument("--restarts", type=int, default=DEFAULT_RESTARTS,
+                        help="times to restart a failed recording")
+    parser.add_argument("--provider", help="stream provider")
+    parser.add_argument("--native", action="store_true",
+                        help="record with the built-in HLS downloader "
+                        "instead of streamlink")
+    parser.add_argument("--log-json", help="log one JSON object per line",
+                        action="store_true")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("-v", "--verbose", action="count", default=0,
+                        help="verbose logging")
+    group.add_argument("-q", "--quiet", action="count", default=0,
+                        help="quiet logging")
+    parser.add_argument("games", metavar="game", nargs="*",
+                        help="game specifiers, as for mlbplay")
+    options = parser.parse_args()
+
+    if not (options.games or options.team or options.all):
+        parser.error("give some games, --team or --all")
+
+    config.settings.load()
+    if options.profile:
+        config.settings.set_profile(options.profile)
+
+    utils.setup_logging(
+        options.verbose - options.quiet,
+        json_format=(options.log_json
+                     or config.settings.profile.get("log_format") == "json")
+    )
+    metrics.export(
+        port=config.settings.profile.get("metrics_port"),
+        textfile=config.settings.profile.get("metrics_textfile")
+    )
+
+    provider = (options.provider
+                or list(config.settings.profile.providers.keys())[0])
+    state.session = session.get(provider)
+
+    recordings = [
+        Recording(int(game) if game.isdigit() else game)
+        for game in options.games
+    ]
+    if options.team or options.all:
+        recordings += [
+            Recording(game_id, preferred_stream=feed)
+            for (game_id, feed) in scheduled_games(
+                options.date,
+                None if options.all else [ t.lower() for t in options.team ]
+            )
+        ]
+    if not recordings:
+        logger.error("no games to record")
+        sys.exit(1)
+
+    recorder = Recorder(
+        recordings,
+        output_dir = options.output_dir,
+        resolution = (options.resolution
+                      or config.settings.profile.default_resolution
+                      or "best"),
+        concurrency = (options.concurrency
+                       or config.settings.profile.get("record_concurrency")
+                       or DEFAULT_CONCURRENCY),
+        max_restarts = options.restarts,
+        native = (options.native
+                  or config.settings.profile.get("native_recording", False))
+    )
+    try:
+        failed = recorder.run()
+    except KeyboardInterrupt:
+        # Recorder.run has already stopped the recordings and waited for
+        # them to finish their output files
+        failed = True
+    session.pool.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
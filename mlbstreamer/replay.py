@@ -0,0 +1,537 @@
+"""
+Record and replay the HTTP traffic of stream sessions.
+
+Setting MLBSTREAMER_RECORD_DIR saves every response a StreamSession gets
+into that directory, with credentials and tokens scrubbed out.  Setting
+MLBSTREAMER_REPLAY_URL sends every request a StreamSession makes to a
+local replay server instead, which serves the recorded responses:
+
+    python -m mlbstreamer.replay serve fixtures/ --latency 80 --jitter 20
+
+The server stands in for the MLB.tv login flow itself (API key pages,
+Okta, BAMTech device / token exchange and entitlement), handing out
+tokens that expire after --token-ttl seconds, so nothing secret ever needs
+to be recorded.
+"""
+import logging
+logger = logging.getLogger("mlbstreamer")
+import os
+import re
+import sys
+import json
+import time
+import random
+import base64
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import requests.adapters
+
+RECORD_DIR_ENV = "MLBSTREAMER_RECORD_DIR"
+REPLAY_URL_ENV = "MLBSTREAMER_REPLAY_URL"
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8910
+DEFAULT_TOKEN_TTL = 3600
+
+REDACTED = "REDACTED"
+
+SECRET_KEY_RE = re.compile(
+    "token|password|assertion|secret|apikey|api_key|sessionkey|session_key"
+    "|authorization|cookie|email|username"
+    # NHL session attributes, like the mediaAuth_v2 cookie
+    "|attributevalue",
+    re.IGNORECASE
+)
+
+JWT_RE = re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]*")
+
+# query strings of absolute URLs, which carry the tokens of stream URLs
+URL_QUERY_RE = re.compile(r"(https?://[^?#\s]+\?)[^#\s]+")
+
+SECRET_TEXT_RES = [
+    (re.compile(r'("(?:apiKey|clientApiKey)":")[^"]+(")'), r"\1%s\2" %(REDACTED)),
+    (re.compile(r'(clientId:")[^"]+(")'), r"\1%s\2" %(REDACTED)),
+    (re.compile(r"(access_token\s*=\s*')[^']*(')"), r"\1%s\2" %(REDACTED)),
+    # JWTs, wherever they turn up
+    (JWT_RE, REDACTED),
+]
+
+# (host, path) of endpoints whose whole response is a credential, like the
+# bare JWT that the entitlement endpoint returns
+SECRET_ENDPOINTS = {
+    ("media-entitlement.mlb.com", "/api/v3/jwt"),
+}
+
+# query parameters that change on every request, and don't affect the
+# response
+VOLATILE_PARAMS = {"_", "state", "nonce"}
+
+
+def scrub_value(value):
+
+    if isinstance(value, dict):
+        return {
+            k: REDACTED if SECRET_KEY_RE.search(k) else scrub_value(v)
+            for k, v in value.items()
+        }
+    elif isinstance(value, list):
+        return [ scrub_value(v) for v in value ]
+    elif isinstance(value, str):
+        value = URL_QUERY_RE.sub(r"\1%s" %(REDACTED), value)
+        return JWT_RE.sub(REDACTED, value)
+    return value
+
+
+def scrub_text(text):
+    for (regex, replacement) in SECRET_TEXT_RES:
+        text = regex.sub(replacement, text)
+    return text
+
+
+def normalize_query(query):
+    return urlencode(sorted(
+        (k, REDACTED if SECRET_KEY_RE.search(k) else v)
+        for k, v in parse_qsl(query, keep_blank_values=True)
+        if k not in VOLATILE_PARAMS
+    ))
+
+
+def fixture_key(method, host, path, query):
+    return "%s %s%s?%s" %(method.upper(), host, path, normalize_query(query))
+
+
+class FixtureStore(object):
+    """
+    Directory of recorded responses, one JSON file per request.  Requests
+    are matched on method, host, path and query string, ignoring volatile
+    and secret parameters, and failing that on method, host and path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fixtures = {}
+        self.loose = {}
+
+    def filename(self, host, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.path, host, digest + ".json")
+
+    def record(self, response, stream=False):
+
+        url = urlsplit(response.url)
+        key = fixture_key(response.request.method, url.netloc,
+                          url.path, url.query)
+        content_type = response.headers.get("Content-Type", "")
+        if stream:
+            # the caller reads the body itself, e.g. the HLS downloader's
+            # segments, so reading it here would leave nothing for them
+            body = None
+        elif (url.netloc, url.path) in SECRET_ENDPOINTS:
+            body = dict(text=REDACTED)
+        else:
+            body = self.scrub_body(response, content_type)
+
+        self.write(dict(
+            key = key,
+            method = response.request.method.upper(),
+            host = url.netloc,
+            path = url.path,
+            query = normalize_query(url.query),
+            status = response.status_code,
+            content_type = content_type,
+            body = body
+        ))
+        logger.debug("recorded %s" %(key))
+
+    def scrub_body(self, response, content_type):
+        try:
+            return dict(json=scrub_value(response.json()))
+        except ValueError:
+            if content_type.startswith("text") or "javascript" in content_type:
+                return dict(text=scrub_text(response.text))
+            return dict(base64=base64.b64encode(response.content).decode("ascii"))
+
+    def write(self, fixture):
+        filename = self.filename(fixture["host"], fixture["key"])
+        with self.lock:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "w") as f:
+                json.dump(fixture, f, indent=4, sort_keys=True)
+
+    def load(self):
+        for (dirpath, dirnames, filenames) in os.walk(self.path):
+            for filename in sorted(filenames):
+                if not filename.endswith(".json"):
+                    continue
+                with open(os.path.join(dirpath, filename)) as f:
+                    self.add(json.load(f))
+
+    def add(self, fixture):
+        self.fixtures[fixture["key"]] = fixture
+        self.loose.setdefault(
+            (fixture["method"], fixture["host"], fixture["path"]), fixture
+        )
+
+    def lookup(self, method, host, path, query):
+        try:
+            return self.fixtures[fixture_key(method, host, path, query)]
+        except KeyError:
+            return self.loose.get((method.upper(), host, path))
+
+
+def make_fixture(method, url, data, status=200):
+    """
+    Build a JSON fixture by hand, e.g. for tests and benchmarks.
+    """
+    url = urlsplit(url)
+    return dict(
+        key = fixture_key(method, url.netloc, url.path, url.query),
+        method = method.upper(),
+        host = url.netloc,
+        path = url.path,
+        query = normalize_query(url.query),
+        status = status,
+        content_type = "application/json",
+        body = dict(json=data)
+    )
+
+
+def fixture_response(fixture):
+    body = fixture["body"]
+    if body is None:
+        # streamed, so only the status was recorded
+        content = b""
+    elif "json" in body:
+        content = json.dumps(body["json"]).encode("utf-8")
+    elif "text" in body:
+        content = body["text"].encode("utf-8")
+    else:
+        content = base64.b64decode(body["base64"])
+    return (fixture["status"], fixture["content_type"], content)
+
+
+def json_response(data, status=200):
+    return (status, "application/json", json.dumps(data).encode("utf-8"))
+
+
+def text_response(text, status=200, content_type="text/html"):
+    return (status, content_type, text.encode("utf-8"))
+
+
+class AuthSimulator(object):
+    """
+    Plays the part of the MLB.tv login servers: each step checks the token
+    handed out by the step before it, and stream requests need an access
+    token that hasn't expired.
+    """
+
+    def __init__(self, token_ttl=DEFAULT_TOKEN_TTL):
+        self.token_ttl = token_ttl
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.routes = [
+            ("GET", "www.mlb.com", "/tv/", self.api_key_page),
+            ("GET", "www.mlbstatic.com", "/mlb.com/vendor/mlb-okta/", self.okta_js),
+            ("POST", "ids.mlb.com", "/api/v1/authn", self.authn),
+            ("GET", "ids.mlb.com", "/oauth2/", self.authorize),
+            ("POST", "us.edge.bamgrid.com", "/devices", self.devices),
+            ("POST", "us.edge.bamgrid.com", "/token", self.token),
+            ("GET", "us.edge.bamgrid.com", "/session", self.session),
+            ("GET", "media-entitlement.mlb.com", "/api/v3/jwt", self.entitlement),
+        ]
+
+    def issue(self, kind, ttl=None):
+        token = "%s-%s" %(kind, hashlib.sha1(os.urandom(16)).hexdigest())
+        with self.lock:
+            self.tokens[token] = (kind, time.time() + (ttl or self.token_ttl*24))
+        return token
+
+    def valid(self, token, kind):
+        if not token:
+            return False
+        if token.startswith("Bearer "):
+            token = token[len("Bearer "):]
+        with self.lock:
+            (token_kind, expires) = self.tokens.get(token, (None, 0))
+        return token_kind == kind and expires > time.time()
+
+    def route(self, method, host, path):
+        for (route_method, route_host, prefix, handler) in self.routes:
+            if (method == route_method and host == route_host
+                and path.startswith(prefix)):
+                return handler
+        return None
+
+    def api_key_page(self, request):
+        return text_response(
+            '<html><script>window.mlbtv = {"apiKey":"replay-api-key",'
+            '"clientApiKey":"replay-client-api-key"};</script></html>'
+        )
+
+    def okta_js(self, request):
+        return text_response(
+            'var config = {production:{clientId:"replay-okta-client",};',
+            content_type="application/javascript"
+        )
+
+    def authn(self, request):
+        return json_response({"sessionToken": self.issue("session")})
+
+    def authorize(self, request):
+        if not self.valid(request.params.get("sessionToken"), "session"):
+            return text_response("<html>invalid session</html>", status=403)
+        return text_response(
+            "<script>\ndata.access_token = '%s';\n</script>" %(
+                self.issue("okta")
+            )
+        )
+
+    def devices(self, request):
+        return json_response({"assertion": self.issue("assertion")})
+
+    def token(self, request):
+        form = dict(parse_qsl(request.body.decode("utf-8")))
+        token_type = form.get("subject_token_type", "")
+        if token_type.endswith(":device"):
+            if not self.valid(form.get("subject_token"), "assertion"):
+                return json_response({"error": "invalid_grant"}, status=400)
+            return json_response({
+                "access_token": self.issue("device"),
+                "refresh_token": self.issue("refresh"),
+                "expires_in": self.token_ttl
+            })
+        elif token_type.endswith(":account"):
+            if not self.valid(form.get("subject_token"), "entitlement"):
+                return json_response({"error": "invalid_grant"}, status=400)
+            return json_response({
+                "access_token": self.issue("access", self.token_ttl),
+                "expires_in": self.token_ttl
+            })
+        return json_response({"error": "unsupported_grant_type"}, status=400)
+
+    def session(self, request):
+        if not self.valid(request.headers.get("Authorization"), "device"):
+            return json_response({"errors": ["unauthorized"]}, status=401)
+        return json_response({"device": {"id": "replay-device"}})
+
+    def entitlement(self, request):
+        if not self.valid(request.headers.get("Authorization"), "okta"):
+            return text_response("unauthorized", status=401)
+        return text_response(self.issue("entitlement"), content_type="text/plain")
+
+    def stream(self, request, fixture, base_url):
+        if not self.valid(request.headers.get("Authorization"), "access"):
+            return json_response(
+                {"errors": [{"code": "access-token.invalid"}]}, status=401
+            )
+        if fixture:
+            return fixture_response(fixture)
+        media_id = request.path.split("/")[2]
+        return json_response({"stream": {
+            "complete": "%s/replay.stream/%s/master.m3u8" %(base_url, media_id)
+        }})
+
+
+class ReplayRequest(object):
+
+    def __init__(self, method, host, path, query, headers, body):
+        self.method = method
+        self.host = host
+        self.path = path
+        self.query = query
+        self.params = dict(parse_qsl(query))
+        self.headers = headers
+        self.body = body
+
+
+class ReplayServer(object):
+    """
+    Local HTTP server that answers requests rewritten by ReplayAdapter from
+    a FixtureStore, after a delay of `latency` +/- `jitter` seconds.
+    """
+
+    def __init__(self, fixture_dir,
+                 host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 latency=0, jitter=0,
+                 token_ttl=DEFAULT_TOKEN_TTL):
+        self.store = FixtureStore(fixture_dir)
+        self.store.load()
+        self.auth = AuthSimulator(token_ttl)
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%d" %(self.host, self.port)
+
+    def handle(self, request):
+
+        self.requests += 1
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        handler = self.auth.route(request.method, request.host, request.path)
+        if handler:
+            return handler(request)
+
+        fixture = self.store.lookup(
+            request.method, request.host, request.path, request.query
+        )
+        if request.host == "edge.svcs.mlb.com":
+            return self.auth.stream(request, fixture, self.url)
+        if not fixture:
+            logger.warning("no fixture for %s %s%s?%s" %(
+                request.method, request.host, request.path, request.query))
+            return json_response({"errors": ["no fixture"]}, status=404)
+        return fixture_response(fixture)
+
+    def start(self):
+        # http.server is only needed when we're serving
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+
+            def respond(self):
+                (_, host, path) = self.path.split("/", 2)
+                (path, _, query) = ("/" + path).partition("?")
+                length = int(self.headers.get("Content-Length") or 0)
+                request = ReplayRequest(
+                    self.command, host, path, query,
+                    self.headers, self.rfile.read(length)
+                )
+                (status, content_type, content) = server.handle(request)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = respond
+            do_POST = respond
+
+            def log_message(self, format, *args):
+                logger.debug("replay: " + format %(args))
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), RequestHandler)
+        self.httpd.daemon_threads = True
+        # port 0 picks a free port
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+
+def rewrite_url(url, base_url):
+    """
+    Turn e.g. https://statsapi.mlb.com/api/v1/teams into
+    <base_url>/statsapi.mlb.com/api/v1/teams
+    """
+    parts = urlsplit(url)
+    return "%s/%s%s%s" %(
+        base_url, parts.netloc, parts.path,
+        "?" + parts.query if parts.query else ""
+    )
+
+
+class ReplayAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter that sends every request to a replay server.
+    """
+
+    def __init__(self, base_url, *args, **kwargs):
+        self.base_url = base_url.rstrip("/")
+        super(ReplayAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        url = request.url
+        request.url = rewrite_url(url, self.base_url)
+        # the replay server is always local
+        kwargs["proxies"] = {}
+        response = super(ReplayAdapter, self).send(request, **kwargs)
+        # make it look like the response came from the real server
+        response.url = request.url = url
+        return response
+
+
+def install(session, replay_url=None, record_dir=None):
+    """
+    Hook a requests session up for recording and / or replay, as configured
+    by the environment.
+    """
+    replay_url = replay_url or os.environ.get(REPLAY_URL_ENV)
+    record_dir = record_dir or os.environ.get(RECORD_DIR_ENV)
+
+    if replay_url:
+        adapter = ReplayAdapter(replay_url)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+    if record_dir:
+        store = FixtureStore(record_dir)
+        session.hooks["response"].append(
+            lambda response, *args, **kwargs: store.record(
+                response, stream=kwargs.get("stream", False)
+            )
+        )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    serve_parser = subparsers.add_parser("serve", help="run a replay server")
+    serve_parser.add_argument("fixture_dir", help="recorded fixtures")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST)
+    serve_parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("-l", "--latency", type=float, default=0,
+                              help="response delay in milliseconds")
+    serve_parser.add_argument("-j", "--jitter", type=float, default=0,
+                              help="random variation in the delay, in milliseconds")
+    serve_parser.add_argument("--token-ttl", type=int, default=DEFAULT_TOKEN_TTL,
+                              help="lifetime of access tokens in seconds")
+    options = parser.parse_args()
+
+    if options.command != "serve":
+        parser.print_help()
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO)
+    server = ReplayServer(
+        options.fixture_dir,
+        host=options.host, port=options.port,
+        latency=options.latency/1000, jitter=options.jitter/1000,
+        token_ttl=options.token_ttl
+    )
+    server.start()
+    print("serving %d fixtures at %s" %(len(server.store.fixtures), server.url))
+    print("run with %s=%s to use it" %(REPLAY_URL_ENV, server.url))
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,33 +2,33 @@ import logging
 logger = logging.getLogger("mlbstreamer")
 import os
 import re
+import time
+import hashlib
+import threading
 import base64
-import binascii
 import json
 import sqlite3
-import pickle
 import functools
 import random
 import string
 from contextlib import contextmanager
+from http.cookiejar import LWPCookieJar, Cookie
 
-import six
-from six.moves.http_cookiejar import LWPCookieJar, Cookie
-from six import StringIO
 import requests
-from requests_toolbelt.utils import dump
-import lxml
-import lxml, lxml.etree
 import yaml
 from orderedattrdict import AttrDict
 import orderedattrdict.yamlutils
 from orderedattrdict.yamlutils import AttrDictYAMLLoader
 import pytz
 from datetime import datetime, timedelta
-import dateutil.parser
 
 from . import config
 from . import state
+from . import replay
+from . import timing
+from . import metrics
+from . import utils
+from . import hls
 from .state import memo
 from .exceptions import *
 
@@ -43,6 +43,47 @@ CACHE_DURATION_DEFAULT = CACHE_DURATION_SHORT
 
 CACHE_FILE=os.path.join(config.CONFIG_DIR, "cache.sqlite")
 
+# Pooled sessions that haven't been used in this long are closed
+SESSION_POOL_MAX_IDLE = 60*30 # 30 minutes
+
+def proxies_key(proxies):
+    """
+    Return a stable string identifying a proxy configuration.
+    """
+    return ",".join(
+        "%s=%s" %(k, v) for k, v in sorted((proxies or {}).items())
+    )
+
+# (pattern, label) for naming the timing span of each HTTP request
+ENDPOINT_LABELS = [
+    (re.compile(p), label) for (p, label) in [
+        (r"/api/v1/authn", "authn"),
+        (r"/v1/authorize", "authz"),
+        (r"bamgrid\.com/devices", "devices"),
+        (r"bamgrid\.com/token|/oauth/token", "token"),
+        (r"bamgrid\.com/session", "session"),
+        (r"media-entitlement\.", "entitlement"),
+        (r"nhlPurchase\.login", "login"),
+        (r"/api/v1/schedule", "schedule"),
+        (r"/Airings\?", "airings"),
+        (r"edge\.svcs\.mlb\.com/media/|/ws/media/mf/", "stream"),
+        (r"/api/v1/game/\d+/content", "content"),
+        (r"/api/v1/teams", "teams"),
+        (r"/api/v1/sports", "sports"),
+        (r"mlb\.com/tv/|mlb-okta", "api_keys"),
+    ]
+]
+
+# Requests to these are logged at INFO, and everything else (playlists and
+# segments) at DEBUG
+API_ENDPOINTS = set(label for (pattern, label) in ENDPOINT_LABELS)
+
+def endpoint_label(url):
+    for (pattern, label) in ENDPOINT_LABELS:
+        if pattern.search(url):
+            return label
+    return requests.utils.urlparse(url).netloc
+
 def gen_random_string(n):
     return ''.join(
         random.choice(
@@ -58,6 +99,59 @@ class Media(AttrDict):
 class Stream(AttrDict):
     pass
 
+class HTTPSession(requests.Session):
+    """
+    requests.Session that times each request and counts responses, labelled
+    by endpoint.
+    """
+
+    def __init__(self):
+        super(HTTPSession, self).__init__()
+        self.last_used = time.time()
+        self.active = 0
+        self.active_lock = threading.Lock()
+
+    def request(self, method, url, *args, **kwargs):
+        endpoint = endpoint_label(url)
+        status = "error"
+        start = time.perf_counter()
+        with self.active_lock:
+            self.active += 1
+        try:
+            with timing.span("http %s" %(endpoint)):
+                response = super(HTTPSession, self).request(
+                    method, url, *args, **kwargs
+                )
+            status = response.status_code
+            if status in [401, 403]:
+                metrics.auth_failures.inc(endpoint=endpoint)
+            return response
+        finally:
+            with self.active_lock:
+                self.active -= 1
+            self.last_used = time.time()
+            duration = time.perf_counter() - start
+            metrics.http_requests.inc(endpoint=endpoint, status=status)
+            metrics.http_request_duration.observe(duration, endpoint=endpoint)
+            # API request telemetry is part of the JSON log at the default
+            # level, but would only clutter the text log
+            level = (logging.INFO
+                     if endpoint in API_ENDPOINTS and utils.json_logging()
+                     else logging.DEBUG)
+            if logger.isEnabledFor(level):
+                size = (len(response.content)
+                        if status != "error" and not kwargs.get("stream")
+                        else None)
+                logger.log(
+                    level,
+                    "%s %s: %s in %.3fs, %s bytes" %(
+                        method, endpoint, status, duration, size),
+                    extra=dict(endpoint=endpoint, method=method,
+                               status=status, duration=round(duration, 6),
+                               bytes=size)
+                )
+
+
 class StreamSession(object):
     """
     Top-level stream session interface
@@ -81,24 +175,31 @@ class StreamSession(object):
             *args, **kwargs
     ):
 
-        self.session = requests.Session()
-        self.cookies = LWPCookieJar()
-        if not os.path.exists(self.COOKIES_FILE):
-            self.cookies.save(self.COOKIES_FILE)
-        self.cookies.load(self.COOKIES_FILE, ignore_discard=True)
-        self.session.headers = self.HEADERS
+        self.session = HTTPSession()
+        replay.install(self.session)
+        self.token_lock = threading.RLock()
         self._state = AttrDict([
             ("username", username),
             ("password", password),
             ("proxies", proxies)
         ])
+        self.proxies = proxies
+        self.cookies = LWPCookieJar()
+        if not os.path.exists(self.COOKIES_FILE):
+            self.cookies.save(self.COOKIES_FILE)
+        self.cookies.load(self.COOKIES_FILE, ignore_discard=True)
+        self.session.headers = self.HEADERS
         self.no_cache = no_cache
         self._cache_responses = False
         if not os.path.exists(CACHE_FILE):
             self.cache_setup(CACHE_FILE)
+        # The TUI, mlbrecord and the HLS downloader use the session from
+        # several threads, so every use of the cursor holds cache_lock
         self.conn = sqlite3.connect(CACHE_FILE,
-                                    detect_types = sqlite3.PARSE_DECLTYPES)
+                                    detect_types = sqlite3.PARSE_DECLTYPES,
+                                    check_same_thread = False)
         self.cursor = self.conn.cursor()
+        self.cache_lock = threading.Lock()
         self.cache_purge()
         # if not self.logged_in:
         self.login()
@@ -112,20 +213,30 @@ class StreamSession(object):
         return cls.__name__.replace("StreamSession", "").lower()
 
     @classmethod
-    def _COOKIES_FILE(cls):
-        return os.path.join(config.CONFIG_DIR, f"{cls.session_type()}.cookies")
+    def session_name(cls, proxies=None):
+        # Sessions using proxies keep their own cookies and tokens
+        if not proxies:
+            return cls.session_type()
+        digest = hashlib.sha1(proxies_key(proxies).encode("utf-8")).hexdigest()
+        return f"{cls.session_type()}-{digest[:8]}"
+
+    @classmethod
+    def _COOKIES_FILE(cls, proxies=None):
+        return os.path.join(config.CONFIG_DIR,
+                            f"{cls.session_name(proxies)}.cookies")
 
     @property
     def COOKIES_FILE(self):
-        return self._COOKIES_FILE()
+        return self._COOKIES_FILE(self.proxies)
 
     @classmethod
-    def _SESSION_FILE(cls):
-        return os.path.join(config.CONFIG_DIR, f"{cls.session_type()}.session")
+    def _SESSION_FILE(cls, proxies=None):
+        return os.path.join(config.CONFIG_DIR,
+                            f"{cls.session_name(proxies)}.session")
 
     @property
     def SESSION_FILE(self):
-        return self._SESSION_FILE()
+        return self._SESSION_FILE(self.proxies)
 
     @classmethod
     def new(cls, **kwargs):
@@ -148,15 +259,17 @@ class StreamSession(object):
 
     @classmethod
     def destroy(cls):
-        if os.path.exists(cls.COOKIES_FILE):
-            os.remove(cls.COOKIES_FILE)
-        if os.path.exists(cls.SESSION_FILE):
-            os.remove(cls.SESSION_FILE)
+        if os.path.exists(cls._COOKIES_FILE()):
+            os.remove(cls._COOKIES_FILE())
+        if os.path.exists(cls._SESSION_FILE()):
+            os.remove(cls._SESSION_FILE())
 
     @classmethod
     def load(cls, *args, **kwargs):
-        state = yaml.load(open(cls._SESSION_FILE()), Loader=AttrDictYAMLLoader)
+        with open(cls._SESSION_FILE(kwargs.get("proxies"))) as f:
+            state = yaml.load(f, Loader=AttrDictYAMLLoader)
         logger.trace(f"load: {cls.__name__}, {state}")
+        state.update(kwargs)
         return cls(**state)
 
     def save(self):
@@ -165,6 +278,18 @@ class StreamSession(object):
             yaml.dump(self._state, outfile, default_flow_style=False)
         self.cookies.save(self.COOKIES_FILE)
 
+    def close(self):
+        self.session.close()
+        with self.cache_lock:
+            self.conn.close()
+
+    @property
+    def last_used(self):
+        return self.session.last_used
+
+    @property
+    def in_use(self):
+        return self.session.active > 0
 
     def get_cookie(self, name):
         return requests.utils.dict_from_cookiejar(self.cookies).get(name)
@@ -182,18 +307,21 @@ class StreamSession(object):
         use_cache = not self.no_cache and self._cache_responses
         if use_cache:
             logger.debug("getting cached response fsesor %s" %(url))
-            self.cursor.execute(
-                "SELECT response, last_seen "
-                "FROM response_cache "
-                "WHERE url = ?",
-                (url,)
-            )
+            with self.cache_lock:
+                self.cursor.execute(
+                    "SELECT response, last_seen "
+                    "FROM response_cache "
+                    "WHERE url = ?",
+                    (url,)
+                )
+                row = self.cursor.fetchone()
             try:
-                (pickled_response, last_seen) = self.cursor.fetchone()
+                (pickled_response, last_seen) = row
                 td = datetime.now() - last_seen
                 if td.seconds >= self._cache_responses:
                     logger.debug("cache expired for %s" %(url))
                 else:
+                    import pickle
                     response = pickle.loads(pickled_response)
                     logger.debug("using cached response for %s" %(url))
             except TypeError:
@@ -203,15 +331,17 @@ class StreamSession(object):
         #     response = method(url, *args, **kwargs)
         #     logger.trace(dump.dump_all(response).decode("utf-8"))
         if use_cache:
+            import pickle
             pickled_response = pickle.dumps(response)
             sql="""INSERT OR REPLACE
             INTO response_cache (url, response, last_seen)
             VALUES (?, ?, ?)"""
-            self.cursor.execute(
-                sql,
-                (url, pickled_response, datetime.now())
-            )
-            self.conn.commit()
+            with self.cache_lock:
+                self.cursor.execute(
+                    sql,
+                    (url, pickled_response, datetime.now())
+                )
+                self.conn.commit()
 
         return response
 
@@ -234,11 +364,18 @@ class StreamSession(object):
     @proxies.setter
     def proxies(self, value):
         # Override proxy environment variables if proxies are defined on session
-        if value is not None:
-            self.session.trust_env = (len(value) == 0)
+        self.session.trust_env = not value
         self._state.proxies = value
-        self.session.proxies.update(value)
+        self.session.proxies = dict(value or {})
 
+    def proxy_session(self, proxies):
+        """
+        Return the pooled session of this type that goes through the given
+        proxies, which has its own cookies and tokens.
+        """
+        if not proxies or proxies_key(proxies) == proxies_key(self.proxies):
+            return self
+        return pool.get(self.session_type(), proxies=proxies)
 
     @contextmanager
     def cache_responses(self, duration=CACHE_DURATION_DEFAULT):
@@ -272,11 +409,41 @@ class StreamSession(object):
 
     def cache_purge(self, days=CACHE_DURATION_LONG):
 
-        self.cursor.execute(
-            "DELETE "
-            "FROM response_cache "
-            "WHERE last_seen < datetime('now', '-%d days')" %(days)
-        )
+        with self.cache_lock:
+            self.cursor.execute(
+                "DELETE "
+                "FROM response_cache "
+                "WHERE last_seen < datetime('now', '-%d days')" %(days)
+            )
+
+    @memo(region="long")
+    def stream_variants(self, url):
+        """
+        Fetch a stream's master playlist and return its variants, best
+        first, or an empty list if the URL is a media playlist.
+        """
+        response = self.session.get(url, headers=self.headers or {})
+        response.raise_for_status()
+        playlist = hls.parse_playlist(response.text, url)
+        return sorted(playlist.variants, key=lambda v: v.bandwidth,
+                      reverse=True)
+
+    def get_variant(self, url, resolution=None):
+        """
+        Return the stream variant that best matches a resolution, or None if
+        the variants can't be read.
+        """
+        try:
+            variants = self.stream_variants(url)
+        except (requests.exceptions.RequestException, MLBPlayException) as e:
+            logger.warning("couldn't get variants of %s: %s" %(url, e))
+            return None
+        if not variants:
+            return None
+        variant = hls.choose_variant(variants, resolution)
+        logger.debug("using %s variant at %d bps for %s" %(
+            variant.name, variant.bandwidth, resolution))
+        return variant
 
 class BAMStreamSessionMixin(object):
     """
@@ -317,6 +484,15 @@ class BAMStreamSessionMixin(object):
         with self.cache_responses_short():
             return self.session.get(url).json()
 
+    def refresh_schedule(self, **kwargs):
+        """
+        Fetch a schedule from the server even if a memoized copy exists, and
+        replace the memoized copy with it.
+        """
+        with utils.log_flow("refresh"):
+            self.schedule.delete(kwargs=kwargs)
+            return self.schedule(**kwargs)
+
     @memo(region="short")
     def get_epgs(self, game_id, title=None):
 
@@ -500,6 +676,11 @@ class MLBStreamSession(BAMStreamSessionMixin, StreamSession):
 
     def update_api_keys(self):
 
+        # lxml is only needed for scraping the API keys, which are saved in
+        # the session file, so don't pay for importing it on every run.
+        from io import StringIO
+        import lxml.etree
+
         logger.debug("updating MLB api keys")
         content = self.session.get(self.MLB_API_KEY_URL).text
         parser = lxml.etree.HTMLParser()
@@ -533,6 +714,8 @@ class MLBStreamSession(BAMStreamSessionMixin, StreamSession):
     def access_token_expiry(self):
 
         if self._state.access_token_expiry:
+            # dateutil pulls in six, so keep it off the mlbplay startup path
+            import dateutil.parser
             return dateutil.parser.parse(self._state.access_token_expiry)
 
     @access_token_expiry.setter
@@ -540,21 +723,31 @@ class MLBStreamSession(BAMStreamSessionMixin, StreamSession):
         if val:
             self._state.access_token_expiry = val.isoformat()
 
+    def access_token_expired(self):
+        return (not self._state.access_token or not self.access_token_expiry
+                or self.access_token_expiry < datetime.now(tz=pytz.UTC))
+
     @property
     def access_token(self):
-        if not self._state.access_token or not self.access_token_expiry or \
-                self.access_token_expiry < datetime.now(tz=pytz.UTC):
-            try:
-                self.refresh_access_token()
-            except requests.exceptions.HTTPError:
-                # Clear token and then try to get a new access_token
-                self.refresh_access_token(clear_token=True)
+        if self.access_token_expired():
+            # Threads sharing this session wait for one refresh, then all
+            # use the new token
+            with self.token_lock:
+                if self.access_token_expired():
+                    with utils.log_flow("token"):
+                        try:
+                            self.refresh_access_token()
+                        except requests.exceptions.HTTPError:
+                            metrics.auth_failures.inc(endpoint="refresh")
+                            # Clear token and then try to get a new access_token
+                            self.refresh_access_token(clear_token=True)
 
         logger.debug("access_token: %s" %(self._state.access_token))
         return self._state.access_token
 
     def refresh_access_token(self, clear_token=False):
         logger.debug("refreshing access token")
+        metrics.token_refreshes.inc(provider=self.session_type())
 
         if clear_token:
             self.session_token = None
@@ -584,6 +777,7 @@ class MLBStreamSession(BAMStreamSessionMixin, StreamSession):
                 OKTA_ACCESS_TOKEN = line.split("'")[1].encode('utf-8').decode('unicode_escape')
                 break
         else:
+            metrics.auth_failures.inc(endpoint="authz")
             raise Exception(authz_content)
 
         # ----------------------------------------------------------------------
@@ -747,6 +941,7 @@ class MLBStreamSession(BAMStreamSessionMixin, StreamSession):
 
         return teams
 
+    @memo(region="short")
     def airings(self, game_id):
 
         airings_url = self.AIRINGS_URL_TEMPLATE.format(game_id = game_id)
@@ -907,6 +1102,7 @@ class NHLStreamSession(BAMStreamSessionMixin, StreamSession):
         }
 
         res = self.session.post(token_url, headers=headers)
+        metrics.token_refreshes.inc(provider=self.session_type())
         self.session_token = json.loads(res.text)["access_token"]
 
         login_url="https://gateway.web.nhl.com/ws/subscription/flow/nhlPurchase.login"
@@ -1046,13 +1242,114 @@ class NHLStreamSession(BAMStreamSessionMixin, StreamSession):
         return stream
 
 
+class SessionPool(object):
+    """
+    Pool of stream sessions keyed by provider and proxy configuration.
+
+    Each pooled session has its own connection pool, cookies and tokens, so
+    switching between proxied and unproxied streams doesn't require logging
+    in or refreshing tokens again once the pool is warm.  Proxied sessions
+    that go unused for longer than `max_idle` seconds are saved and closed;
+    the default session for each provider is kept for the life of the
+    process.
+    """
+
+    def __init__(self, max_idle=SESSION_POOL_MAX_IDLE):
+        self.max_idle = max_idle
+        self.sessions = {}
+        self.lock = threading.RLock()
+        # held while the session for a key is being created
+        self.creating = {}
+
+    def get(self, provider, proxies=None, **kwargs):
+        key = (provider, proxies_key(proxies))
+        self.evict()
+        with self.lock:
+            session = self.touch(key)
+            if session:
+                return session
+            creating = self.creating.setdefault(key, threading.Lock())
+
+        # Log in without holding the pool lock, so a slow login only holds
+        # up callers that want the same session.
+        with creating:
+            try:
+                with self.lock:
+                    session = self.touch(key)
+                if session:
+                    return session
+                logger.debug(f"creating pooled session: {key}")
+                session = new(provider, proxies=proxies, **kwargs)
+                with self.lock:
+                    self.sessions[key] = (session, time.time())
+            finally:
+                # callers already waiting on this lock find the session
+                # once they get it, so it's only needed while logging in
+                with self.lock:
+                    if self.creating.get(key) is creating:
+                        del self.creating[key]
+        return session
+
+    def touch(self, key):
+        try:
+            (session, last_used) = self.sessions[key]
+        except KeyError:
+            return None
+        self.sessions[key] = (session, time.time())
+        return session
+
+    def evict(self, max_idle=None, force=False):
+        """
+        Save and close proxied sessions that haven't made a request in
+        `max_idle` seconds, or every session if `force` is set.  Sessions
+        with requests in progress are never closed.
+        """
+        if max_idle is None:
+            max_idle = self.max_idle
+        now = time.time()
+        evicted = []
+        with self.lock:
+            for key, (session, last_used) in list(self.sessions.items()):
+                (provider, proxies) = key
+                if not (proxies or force):
+                    continue
+                # a download keeps a session busy without going through get()
+                if session.in_use or now - max(
+                        last_used, session.last_used) < max_idle:
+                    continue
+                logger.debug(f"evicting idle session: {key}")
+                del self.sessions[key]
+                evicted.append(session)
+        for session in evicted:
+            session.save()
+            session.close()
+
+    def close(self):
+        self.evict(max_idle=0, force=True)
+
+pool = SessionPool()
+
+PROVIDERS = AttrDict([
+    (cls.session_type(), cls)
+    for cls in [MLBStreamSession, NHLStreamSession]
+])
+
 def new(provider, *args, **kwargs):
-    session_class = globals().get(f"{provider.upper()}StreamSession")
+    """
+    Create a new session for a provider.  Most callers want get() instead.
+    """
+    try:
+        session_class = PROVIDERS[provider]
+    except KeyError:
+        raise StreamSessionException(f"unknown provider: {provider}")
     return session_class.new(*args, **kwargs)
 
-PROVIDERS_RE = re.compile(r"(.+)StreamSession$")
-PROVIDERS = [ k.replace("StreamSession", "").lower()
-              for k in globals() if PROVIDERS_RE.search(k) ]
+def get(provider):
+    """
+    Return the process-wide session for a provider, creating and logging in
+    on first use and handing back the same warm session afterwards.
+    """
+    return pool.get(provider)
 
 
 def main():
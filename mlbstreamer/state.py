@@ -1,6 +1,31 @@
 from memoize import *
+
+from . import timing
+from . import metrics
+
+class InstrumentedMemoizer(Memoizer):
+    """
+    Memoizer that times each cache lookup and counts hits and misses.  On a
+    miss, the work done to fill the cache shows up underneath the lookup.
+    """
+
+    def get(self, key, func=None, args=(), kwargs=None, **opts):
+        if func is None:
+            return super(InstrumentedMemoizer, self).get(key, func, args, kwargs, **opts)
+
+        name = getattr(func, "__name__", key)
+        missed = []
+        def fill(*args, **kwargs):
+            missed.append(True)
+            return func(*args, **kwargs)
+
+        with timing.span("cache %s" %(name)):
+            value = super(InstrumentedMemoizer, self).get(key, fill, args, kwargs, **opts)
+        metrics.cache_lookups.inc(cache=name, result="miss" if missed else "hit")
+        return value
+
 session = None
 store = {}
-memo = Memoizer(store)
+memo = InstrumentedMemoizer(store)
 memo.regions['short'] = {'max_age': 60}
 memo.regions['long'] = {'max_age': 900}
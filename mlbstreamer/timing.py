@@ -0,0 +1,148 @@
+"""
+Lightweight timing spans for finding out where the time goes.
+
+Spans are only recorded once timing is enabled, either with the --timings
+option or by setting MLBSTREAMER_TIMINGS=1 (which also catches work done
+at import time, like loading the config file).  Otherwise span() returns a
+shared no-op context manager.  Finished spans are added to running totals
+for their call path, so a long-running TUI or mlbdvr doesn't keep piling
+them up.
+"""
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+enabled = bool(os.environ.get("MLBSTREAMER_TIMINGS"))
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+class Node(object):
+    """
+    Totals for all the completed spans with the same name under the same
+    parent, so memory use doesn't grow with the number of spans.
+    """
+
+    __slots__ = ["count", "total", "children"]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.children = OrderedDict()
+
+    def child(self, name):
+        with _lock:
+            try:
+                return self.children[name]
+            except KeyError:
+                node = self.children[name] = Node()
+                return node
+
+_root = Node()
+
+
+class Span(object):
+
+    __slots__ = ["name", "start", "end", "node"]
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+        self.end = None
+        self.node = None
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def __enter__(self):
+        stack = _stack()
+        self.node = (stack[-1].node if stack else _root).child(self.name)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter()
+        _stack().pop()
+        with _lock:
+            self.node.count += 1
+            self.node.total += self.end - self.start
+
+
+class NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+NULL_SPAN = NullSpan()
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def span(name):
+    if not enabled:
+        return NULL_SPAN
+    return Span(name)
+
+
+def reset():
+    global _root
+    _root = Node()
+
+
+def report(out=None):
+    """
+    Print the completed spans as a tree, with repeated spans merged.
+    """
+    out = out or sys.stderr
+
+    def print_tree(node, depth):
+        with _lock:
+            children = list(node.children.items())
+        for name, child in children:
+            print("%s%-*s %9.1fms%s" %(
+                "  " * depth, 40 - 2*depth, name, child.total * 1000,
+                " (x%d)" %(child.count) if child.count > 1 else ""
+            ), file=out)
+            print_tree(child, depth+1)
+
+    print("timings:", file=out)
+    print_tree(_root, 1)
+
+
+@contextmanager
+def profiled(pstats_file=None):
+    """
+    Run the enclosed code under cProfile and save the stats to pstats_file,
+    if given.  Only the calling thread is profiled.
+    """
+    if not pstats_file:
+        yield
+        return
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(pstats_file)
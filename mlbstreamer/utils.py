@@ -1,6 +1,10 @@
 import logging
 import sys
+import json
+import uuid
 import argparse
+import contextvars
+from contextlib import contextmanager
 from datetime import datetime
 from orderedattrdict import AttrDict
 
@@ -13,7 +17,99 @@ LOG_LEVELS = [
     "debug",
     "trace"
 ]
-def setup_logging(level=0, handlers=[], quiet_stdout=False):
+# Correlation id and flow name for the current play or refresh, added to
+# every log record
+log_context = contextvars.ContextVar("log_context", default=None)
+
+@contextmanager
+def log_flow(flow):
+    """
+    Tag log records from the enclosed code, including work it hands to the
+    worker threads, with a new correlation id.  Nested flows keep the id of
+    the outermost one.
+    """
+    if log_context.get():
+        yield log_context.get()
+        return
+    context = AttrDict(
+        correlation_id = uuid.uuid4().hex[:12],
+        flow = flow
+    )
+    token = log_context.set(context)
+    try:
+        yield context
+    finally:
+        log_context.reset(token)
+
+
+class LogContextFilter(logging.Filter):
+
+    def filter(self, record):
+        context = log_context.get()
+        record.correlation_id = context.correlation_id if context else None
+        record.flow = context.flow if context else None
+        return True
+
+
+# Attributes every LogRecord has, so anything else was passed in `extra`
+LOG_RECORD_ATTRS = set(
+    logging.LogRecord(None, None, "", 0, "", (), None).__dict__.keys()
+) | {"message", "asctime", "correlation_id", "flow"}
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats each record as one line of JSON, including the correlation id
+    and any fields passed in `extra`.
+    """
+
+    def format(self, record):
+        event = AttrDict([
+            ("time", datetime.fromtimestamp(record.created).isoformat(
+                timespec="milliseconds")),
+            ("level", record.levelname.lower()),
+            ("logger", record.name),
+            ("module", record.module),
+            ("line", record.lineno),
+            ("thread", record.threadName),
+            ("message", record.getMessage()),
+        ])
+        correlation_id = getattr(record, "correlation_id", None)
+        if correlation_id:
+            event.correlation_id = correlation_id
+            event.flow = record.flow
+        for key, value in record.__dict__.items():
+            if key not in LOG_RECORD_ATTRS and not key.startswith("_"):
+                event[key] = value
+        if record.exc_info:
+            event.exception = self.formatException(record.exc_info)
+        return json.dumps(event, default=str)
+
+
+def text_formatter():
+    return logging.Formatter(
+        "%(asctime)s [%(module)16s:%(lineno)-4d] [%(levelname)8s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+
+# Handlers installed by the last setup_logging call
+_installed_handlers = []
+_context_filter = LogContextFilter()
+_json_format = False
+
+def json_logging():
+    """
+    Whether the last setup_logging call asked for JSON output.
+    """
+    return _json_format
+
+def setup_logging(level=0, handlers=None, quiet_stdout=False,
+                  json_format=False):
+    """
+    Configure the root logger.  Handlers that were given their own formatter
+    keep it; the others get the text formatter, or the JSON formatter if
+    json_format is set.  Calling this again replaces the handlers installed
+    by the previous call.
+    """
 
     level = LOG_LEVEL_DEFAULT + level
     if level < 0 or level >= len(LOG_LEVELS):
@@ -32,30 +128,32 @@ def setup_logging(level=0, handlers=[], quiet_stdout=False):
     else:
         level = getattr(logging, LOG_LEVELS[level].upper())
 
-    if not isinstance(handlers, list):
+    if handlers is None:
+        handlers = []
+    elif not isinstance(handlers, list):
         handlers = [handlers]
 
+    global _json_format
+    _json_format = json_format
+
     logger = logging.getLogger()
-    formatter = logging.Formatter(
-        "%(asctime)s [%(module)16s:%(lineno)-4d] [%(levelname)8s] %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
+    formatter = JSONFormatter() if json_format else text_formatter()
+    formatter.default = True
     logger.setLevel(level)
+
+    for handler in _installed_handlers:
+        logger.removeHandler(handler)
+    del _installed_handlers[:]
+
     outh = logging.StreamHandler(sys.stdout)
     outh.setLevel(logging.ERROR if quiet_stdout else level)
 
-    handlers.insert(0, outh)
-    # if not handlers:
-    #     handlers = [logging.StreamHandler(sys.stdout)]
-    for handler in handlers:
-        handler.setFormatter(formatter)
+    for handler in [outh] + handlers:
+        if not handler.formatter or getattr(handler.formatter, "default", False):
+            handler.setFormatter(formatter)
+        handler.addFilter(_context_filter)
         logger.addHandler(handler)
-
-    # logger = logging.basicConfig(
-    #     level=level,
-    #     format="%(asctime)s [%(module)16s:%(lineno)-4d] [%(levelname)8s] %(message)s",
-    #     datefmt="%Y-%m-%d %H:%M:%S"
-    # )
+        _installed_handlers.append(handler)
 
     logging.getLogger("requests").setLevel(level+1)
     logging.getLogger("urllib3").setLevel(level+1)
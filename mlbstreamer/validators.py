@@ -0,0 +1,39 @@
+from prompt_toolkit.validation import Validator, ValidationError
+
+
+class NotEmptyValidator(Validator):
+
+    def validate(self, document):
+        text = document.text
+        if not len(text):
+            raise ValidationError(message="Please supply a value")
+
+class RangeNumberValidator(Validator):
+
+    def __init__(self, minimum=None, maximum=None):
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def validate(self, document):
+
+        text = document.text
+
+        if not text:
+            raise ValidationError(message="Please supply a value")
+
+        if text.isdigit():
+            value = int(text)
+        else:
+            raise ValidationError(
+                message='Please enter an integer.'
+            )
+
+        if self.minimum and value < self.minimum:
+            raise ValidationError(
+                message="Value must be greater than %s" %(self.minimum)
+            )
+
+        if self.maximum and value > self.maximum:
+            raise ValidationError(
+                message="Value must be less than %s" %(self.maximum)
+            )
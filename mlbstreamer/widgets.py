@@ -1,60 +1,152 @@
+import collections
+from collections import OrderedDict
+
 import urwid
 import panwid
 from . import state
 
+# default number of lines kept in the log console
+MAX_LINES = 5000
+
+# seconds between redraws of the log console while messages are arriving
+REDRAW_INTERVAL = 0.1
+
+
+class ScrollbackListWalker(urwid.ListWalker):
+    """
+    List walker that keeps the last `max_lines` lines of text in a ring
+    buffer, and only builds Text widgets for the lines that get displayed.
+    """
+
+    WIDGET_CACHE_SIZE = 256
+
+    def __init__(self, max_lines=MAX_LINES):
+        self.lines = collections.deque(maxlen=max_lines)
+        self.focus = 0
+        # lines that have fallen off the front of the buffer, so cached
+        # widgets can be keyed by absolute line number
+        self.dropped = 0
+        self.widgets = OrderedDict()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, position):
+        if position < 0 or position >= len(self.lines):
+            raise IndexError
+        key = self.dropped + position
+        try:
+            widget = self.widgets[key]
+            self.widgets.move_to_end(key)
+        except KeyError:
+            widget = self.widgets[key] = urwid.Text(self.lines[position])
+            if len(self.widgets) > self.WIDGET_CACHE_SIZE:
+                self.widgets.popitem(last=False)
+        return widget
+
+    def extend(self, lines):
+        overflow = max(
+            len(self.lines) + len(lines) - self.lines.maxlen, 0
+        )
+        self.lines.extend(lines)
+        self.dropped += overflow
+        # keep the focus on the same line while it's still around
+        self.focus = max(self.focus - overflow, 0)
+
+    def get_focus(self):
+        if not self.lines:
+            return (None, None)
+        return (self[self.focus], self.focus)
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        try:
+            return (self[position+1], position+1)
+        except IndexError:
+            return (None, None)
+
+    def get_prev(self, position):
+        try:
+            return (self[position-1], position-1)
+        except IndexError:
+            return (None, None)
+
+    def positions(self, reverse=False):
+        if reverse:
+            return range(len(self) - 1, -1, -1)
+        return range(len(self))
+
+
 class ScrollbackListBox(panwid.listbox.ScrollingListBox):
 
     signals = ["updated"]
 
-    # def __init__(self, update_interval=1):
-    #     self.update_interval = update_interval
-    #     self._results = ScrollbackListWalker(1000)
-    #     self._fields = []
-    #     # self.lock = threading.Lock()
-    #     self.collapsed = True
-    #     self.hidefields = []
-    #     self.filters = []
-    #     self.pattern = None
-    #     self.updated = False
-    #     self.update_timer = None
-    #     self._listbox = urwid.ListBox(self._results)
-    #     urwid.WidgetWrap.__init__(self, self._listbox)
+    def __init__(self, max_lines=MAX_LINES,
+                 redraw_interval=REDRAW_INTERVAL, *args, **kwargs):
+        self.redraw_interval = redraw_interval
+        self.pending = []
+        self.redraw_alarm = None
+        super(ScrollbackListBox, self).__init__(
+            ScrollbackListWalker(max_lines), *args, **kwargs
+        )
 
     def _modified(self):
         self.body._modified()
 
     def append(self, text):
 
-        result = urwid.Text(text)
-        self.body.append(result)
-        self.on_updated()
+        # Lines are added on the next redraw, so a burst of messages only
+        # costs one.
+        self.pending.append(text)
+        if self.redraw_alarm:
+            return
+        if state.loop:
+            self.redraw_alarm = state.loop.set_alarm_in(
+                self.redraw_interval, lambda loop, data: self.on_updated()
+            )
+        else:
+            self.on_updated()
 
     def keypress(self, size, key):
 
         if key == 'up' or key == 'k':
-            self._listbox.keypress(size, 'up')
+            return self.listbox.keypress(size, 'up')
         elif key == 'page up' or key == 'ctrl u':
-            self._listbox.keypress(size, 'page up')
+            return self.listbox.keypress(size, 'page up')
         elif key == 'down' or key == 'j':
-            self._listbox.keypress(size, 'down')
+            return self.listbox.keypress(size, 'down')
         elif key == 'page down' or key == 'ctrl d':
-            self._listbox.keypress(size, 'page down')
+            return self.listbox.keypress(size, 'page down')
         elif key == 'home':
-            if len(self._listbox.body):
-                self._listbox.focus_position = 0
+            if len(self.listbox.body):
+                self.listbox.focus_position = 0
                 self.listbox._invalidate()
+            return None
         elif key == 'end':
-            if len(self._listbox.body):
-                self._listbox.focus_position = len(self._listbox.body)-1
-                self._listbox._invalidate()
+            if len(self.listbox.body):
+                self.listbox.focus_position = len(self.listbox.body)-1
+                self.listbox._invalidate()
+            return None
         return super(ScrollbackListBox, self).keypress(size, key)
 
     # def clear(self):
     #     self._results.reset()
 
     def on_updated(self):
+        self.redraw_alarm = None
+        # only follow new messages if we're already at the end
+        follow = (not len(self.body)
+                  or self.body.focus == len(self.body)-1)
+        self.body.extend(self.pending)
+        self.pending = []
+        if follow and len(self.body):
+            self.body.focus = len(self.body)-1
+        self.body._modified()
         self._invalidate()
-        self.set_focus(len(self.body)-1)
+        self._emit("updated")
         # state.loop.draw_screen()
 
     def selectable(self):
@@ -63,16 +155,18 @@ class ScrollbackListBox(panwid.listbox.ScrollingListBox):
 
 class ConsoleWindow(urwid.WidgetWrap):
 
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, max_lines=MAX_LINES):
 
         # self.fd = fd
         self.verbose = verbose
-        self.listbox =  ScrollbackListBox([], with_scrollbar=True)
+        self.listbox =  ScrollbackListBox(max_lines, with_scrollbar=True)
         super(ConsoleWindow, self).__init__(self.listbox)
 
     def log_message(self, msg):
-        self.listbox.append(msg.rstrip())
-        self.listbox._modified()
+        if isinstance(msg, bytes):
+            msg = msg.decode("utf-8", "replace")
+        for line in msg.rstrip().split("\n"):
+            self.listbox.append(line)
 
     def mark(self):
         self.log_message("-" * 80)
@@ -0,0 +1,86 @@
+import logging
+logger = logging.getLogger("mlbstreamer")
+import os
+import queue
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from . import timing
+
+MAX_WORKERS = 4
+
+
+class Worker(object):
+    """
+    Runs blocking calls (mostly network requests) on a thread pool and hands
+    their results back to the urwid main loop through a watch pipe, so input
+    handlers never have to wait on the network.
+
+    Callbacks are always called from the main loop, so they're free to
+    update widgets.
+    """
+
+    def __init__(self, loop, max_workers=MAX_WORKERS):
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.results = queue.Queue()
+        self.pipe = self.loop.watch_pipe(self.on_pipe)
+
+    def submit(self, fn, *args, callback=None, errback=None, **kwargs):
+        """
+        Call fn(*args, **kwargs) in a worker thread, then pass its result to
+        callback, or the exception it raised to errback.
+        """
+        if timing.enabled:
+            (fn, args) = (self.call_timed, (fn,) + args)
+        # run in a copy of the caller's context, so log records keep its
+        # correlation id
+        context = contextvars.copy_context()
+        future = self.executor.submit(context.run, fn, *args, **kwargs)
+        future.add_done_callback(
+            lambda f: self.on_done(f, callback, errback)
+        )
+        return future
+
+    @staticmethod
+    def call_timed(fn, *args, **kwargs):
+        with timing.span("worker %s" %(getattr(fn, "__name__", "task"))):
+            return fn(*args, **kwargs)
+
+    def on_done(self, future, callback, errback):
+        # Called from the worker thread, so just queue the result and wake
+        # up the main loop.
+        self.results.put((future, callback, errback))
+        try:
+            os.write(self.pipe, b"\n")
+        except OSError:
+            pass
+
+    def on_pipe(self, data):
+
+        while True:
+            try:
+                (future, callback, errback) = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            if future.cancelled():
+                continue
+            exc = future.exception()
+            try:
+                if exc:
+                    if errback:
+                        errback(exc)
+                    else:
+                        logger.error("background task failed", exc_info=exc)
+                elif callback:
+                    callback(future.result())
+            except Exception as e:
+                logger.error("background task callback failed", exc_info=e)
+
+        # keep the pipe open
+        return True
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        self.loop.remove_watch_pipe(self.pipe)
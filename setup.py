@@ -25,7 +25,6 @@ setup(name=name,
       ],
       include_package_data=True,
       install_requires = [
-          "six",
           "requests",
           "lxml",
           "pytz",
@@ -40,11 +39,17 @@ setup(name=name,
           "urwid_utils>=0.1.2",
           "panwid>=0.2.5"
       ],
+      extras_require = {
+          # AES-128 decryption for the built-in HLS downloader
+          "hls": ["cryptography"]
+      },
       test_suite="test",
       entry_points = {
           "console_scripts": [
               "mlbstreamer=mlbstreamer.__main__:main",
-              "mlbplay=mlbstreamer.play:main"
+              "mlbplay=mlbstreamer.play:main",
+              "mlbrecord=mlbstreamer.record:main",
+              "mlbdvr=mlbstreamer.dvr:main"
           ],
       }
      )
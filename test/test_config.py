@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mlbstreamer.config import Config
+
+CONFIG = """
+profiles:
+    default:
+        default_resolution: 720p_alt
+        streamlink_args: --hls-audio-select *
+    540p:
+        default_resolution: 540p
+        streamlink_args:
+    proxy:
+        proxies:
+            http: http://10.0.0.1:4123
+
+profile_map:
+    team:
+        - pit: proxy
+"""
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.config_dir, "config.yaml")
+        with open(self.config_file, "w") as f:
+            f.write(CONFIG)
+
+    def tearDown(self):
+        shutil.rmtree(self.config_dir)
+
+    def test_profile_merge(self):
+        settings = Config(self.config_file)
+        self.assertEqual(settings.profile.default_resolution, "720p_alt")
+        settings.set_profile("540p")
+        self.assertEqual(settings.profile.default_resolution, "540p")
+        self.assertEqual(settings.profile.streamlink_args, None)
+        self.assertEqual(
+            settings.profiles[("default", "proxy")].default_resolution,
+            "720p_alt"
+        )
+
+    def test_cache_invalidated_on_change(self):
+        Config(self.config_file)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.config_dir, "config.cache")
+        ))
+        with open(self.config_file, "w") as f:
+            f.write(CONFIG.replace("720p_alt", "1080p"))
+        settings = Config(self.config_file)
+        self.assertEqual(settings.profile.default_resolution, "1080p")
+        settings.profile.default_resolution = "360p"
+        self.assertEqual(settings.profile.default_resolution, "360p")
+
+    def test_team_profile(self):
+        settings = Config(self.config_file)
+        self.assertEqual(
+            settings.team_profile("phi", "pit").proxies.http,
+            "http://10.0.0.1:4123"
+        )
+        self.assertIsNone(settings.team_profile("phi", "nym"))
+
+    def test_team_profile_edited(self):
+        settings = Config(self.config_file)
+        settings.team_profile("pit")
+        settings.set_profile("proxy")
+        settings.profiles.proxies = {"http": "http://10.0.0.2:4123"}
+        self.assertEqual(
+            settings.team_profile("pit").proxies["http"],
+            "http://10.0.0.2:4123"
+        )
@@ -0,0 +1,177 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import dateutil.parser
+
+from mlbstreamer import dvr
+
+GAME_DATE = "2018-06-01T23:05:00Z"
+START = dateutil.parser.parse(GAME_DATE).timestamp()
+
+
+def schedule_game(game_id, state="Preview", detailed_state="Scheduled",
+                  media_state="MEDIA_OFF"):
+    return dict(
+        gamePk = game_id,
+        gameDate = GAME_DATE,
+        status = dict(abstractGameState=state, detailedState=detailed_state),
+        content = dict(media=dict(epg=[
+            dict(title="MLBTV", items=[
+                dict(mediaFeedType="HOME", mediaState=media_state),
+                dict(mediaFeedType="AWAY", mediaState="MEDIA_OFF")
+            ])
+        ]))
+    )
+
+
+class FakeRecorder(object):
+
+    def __init__(self):
+        self.recordings = []
+        self.resolved = []
+
+    def resolve(self, recording, refresh=False):
+        self.resolved.append(recording)
+
+
+class TestPollInterval(unittest.TestCase):
+
+    def test_far_off(self):
+        self.assertEqual(dvr.poll_interval(7*24*60*60), dvr.MAX_POLL)
+
+    def test_approaching(self):
+        self.assertEqual(dvr.poll_interval(dvr.PREGAME_WINDOW + 600), 600)
+
+    def test_pregame(self):
+        self.assertEqual(dvr.poll_interval(dvr.PREGAME_WINDOW), dvr.MIN_POLL)
+        self.assertEqual(dvr.poll_interval(-3600), dvr.MIN_POLL)
+
+
+class TestJobTable(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "dvr.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_load(self):
+        jobs = dvr.JobTable(self.path)
+        self.assertTrue(jobs.add(530000, "home"))
+        self.assertFalse(jobs.add(530000, "away"))
+        jobs.save()
+
+        loaded = dvr.JobTable(self.path)
+        loaded.load()
+        self.assertEqual(loaded.jobs, jobs.jobs)
+        self.assertEqual(loaded.due(0), list(loaded.jobs.values()))
+
+    def test_recover_recording(self):
+        jobs = dvr.JobTable(self.path)
+        jobs.add(530000, "home")
+        job = jobs.jobs["530000"]
+        job.status = "recording"
+        job.next_check = START
+        job.attempts = 1
+        jobs.save()
+
+        loaded = dvr.JobTable(self.path)
+        loaded.load()
+        job = loaded.jobs["530000"]
+        self.assertEqual(job.status, "scheduled")
+        self.assertEqual(job.next_check, 0)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(loaded.due(START), [job])
+
+    def test_missing_file(self):
+        jobs = dvr.JobTable(self.path)
+        jobs.load()
+        self.assertEqual(jobs.jobs, {})
+
+
+class TestCheckJob(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.jobs = dvr.JobTable(os.path.join(self.dir, "dvr.json"))
+        self.jobs.add(530000, "home")
+        self.job = self.jobs.jobs["530000"]
+        self.recorder = FakeRecorder()
+        self.dvr = dvr.DVR(self.jobs, self.recorder)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_not_scheduled(self):
+        self.dvr.check_job(self.job, None, START)
+        self.assertEqual(self.job.status, "scheduled")
+        self.assertIsNone(self.job.game_date)
+        self.assertEqual(self.job.next_check, START + dvr.MAX_POLL)
+
+    def test_waiting(self):
+        now = START - 60*60
+        self.dvr.check_job(self.job, schedule_game(530000), now)
+        self.assertEqual(self.job.status, "scheduled")
+        self.assertEqual(self.job.game_date, GAME_DATE)
+        self.assertEqual(self.job.next_check,
+                         START - dvr.PREGAME_WINDOW)
+
+    def test_delayed(self):
+        self.dvr.check_job(self.job, schedule_game(530000), START + 3600)
+        self.assertEqual(self.job.status, "scheduled")
+        self.assertEqual(self.job.next_check, START + 3600 + dvr.MIN_POLL)
+
+    def test_postponed(self):
+        game = schedule_game(530000, detailed_state="Postponed")
+        self.dvr.check_job(self.job, game, START)
+        self.assertEqual(self.job.status, "cancelled")
+
+    def test_final(self):
+        game = schedule_game(530000, state="Final", detailed_state="Final")
+        self.dvr.check_job(self.job, game, START + 3*60*60)
+        self.assertEqual(self.job.status, "missed")
+
+    def test_give_up(self):
+        self.dvr.check_job(self.job, schedule_game(530000),
+                           START + dvr.GIVE_UP_AFTER + 1)
+        self.assertEqual(self.job.status, "missed")
+
+    def test_media_on(self):
+        self.job.attempts = 1
+        game = schedule_game(530000, state="Live",
+                             detailed_state="In Progress",
+                             media_state="MEDIA_ON")
+        self.dvr.check_job(self.job, game, START)
+        self.assertEqual(self.job.status, "recording")
+        [recording] = self.recorder.resolved
+        self.assertEqual(recording.game_specifier, 530000)
+        self.assertEqual(recording.preferred_stream, "home")
+        self.assertEqual(recording.attempts, 1)
+        self.assertEqual(self.recorder.recordings, [recording])
+
+    def test_other_feed_on(self):
+        self.job.feed = "away"
+        game = schedule_game(530000, media_state="MEDIA_ON")
+        self.dvr.check_job(self.job, game, START)
+        self.assertEqual(self.job.status, "scheduled")
+
+    def test_sync(self):
+        self.dvr.check_job(
+            self.job, schedule_game(530000, media_state="MEDIA_ON"), START)
+        [recording] = self.recorder.recordings
+        recording.status = "done"
+        recording.outfile = "game.ts"
+        self.dvr.sync()
+        self.assertEqual(self.job.status, "done")
+        self.assertEqual(self.job.outfile, "game.ts")
+        self.assertEqual(self.recorder.recordings, [])
+        with open(self.jobs.path) as f:
+            self.assertEqual(json.load(f)["530000"]["status"], "done")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from mlbstreamer import hls
+
+MASTER = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=1200000,RESOLUTION=640x360,FRAME-RATE=29.97,CODECS="avc1.4d401e,mp4a.40.2"
+360p/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=6600000,RESOLUTION=1280x720,FRAME-RATE=59.94,CODECS="avc1.640020,mp4a.40.2"
+720p/index.m3u8
+"""
+
+AUDIO_MASTER = """#EXTM3U
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aac",NAME="English",LANGUAGE="en",DEFAULT=YES
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aac",NAME="Radio",LANGUAGE="en",URI="radio/index.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=6600000,RESOLUTION=1280x720,FRAME-RATE=59.94,AUDIO="aac"
+720p/index.m3u8
+"""
+
+SEGMENTS = 20
+
+MEDIA = "#EXTM3U\n#EXT-X-TARGETDURATION:5\n#EXT-X-MEDIA-SEQUENCE:100\n" + "".join(
+    "#EXTINF:5.0,\nseg%d.ts\n" %(n) for n in range(SEGMENTS)
+) + "#EXT-X-ENDLIST\n"
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    broken = set()
+    requested = []
+
+    def do_GET(self):
+        self.requested.append(self.path)
+        if self.path in self.broken:
+            self.send_error(500)
+            return
+        if self.path == "/master.m3u8":
+            body = MASTER.encode("utf-8")
+        elif self.path == "/audio.m3u8":
+            body = AUDIO_MASTER.encode("utf-8")
+        elif self.path == "/720p/index.m3u8":
+            body = MEDIA.encode("utf-8")
+        elif self.path.startswith("/720p/seg"):
+            body = ("<%s>" %(self.path)).encode("utf-8")
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StreamSession(object):
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.headers = {"Authorization": "token"}
+
+
+class TestHLS(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:%d/master.m3u8" %(self.server.server_address[1])
+        self.work_dir = tempfile.mkdtemp()
+        self.retry_delay = hls.RETRY_DELAY
+        hls.RETRY_DELAY = 0
+
+    def tearDown(self):
+        hls.RETRY_DELAY = self.retry_delay
+        Handler.broken.clear()
+        del Handler.requested[:]
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.work_dir)
+
+    def test_parse(self):
+        master = hls.parse_playlist(MASTER, "http://example.com/a/master.m3u8")
+        self.assertTrue(master.is_master)
+        self.assertEqual(master.variants[1].uri,
+                         "http://example.com/a/720p/index.m3u8")
+        self.assertEqual(master.variants[1].frame_rate, 59.94)
+        self.assertEqual(hls.choose_variant(master.variants, "360p").bandwidth,
+                         1200000)
+        self.assertEqual(hls.choose_variant(master.variants, "best").bandwidth,
+                         6600000)
+
+        self.assertEqual([ v.name for v in master.variants ],
+                         ["360p", "720p60"])
+
+        media = hls.parse_playlist(MEDIA, "http://example.com/a/720p/index.m3u8")
+        self.assertTrue(media.ended)
+        self.assertEqual(media.segments[0].sequence, 100)
+        self.assertEqual(media.duration, 5.0 * SEGMENTS)
+
+    def test_streamlink_names(self):
+        variants = hls.parse_playlist(
+            "#EXTM3U\n" + "".join(
+                "#EXT-X-STREAM-INF:BANDWIDTH=%d%s\n%d.m3u8\n" %(
+                    bandwidth, resolution, bandwidth)
+                for (bandwidth, resolution) in [
+                    (3500000, ",RESOLUTION=1280x720"),
+                    (6600000, ",RESOLUTION=1280x720"),
+                    (1200000, ",RESOLUTION=640x360"),
+                    (5000000, ",RESOLUTION=1280x720"),
+                    (4000000, ",RESOLUTION=1280x720"),
+                    (64000, ""),
+                ]
+            ), "http://example.com/master.m3u8"
+        ).variants
+        self.assertEqual(
+            [ v.streamlink_name for v in variants ],
+            ["720p", "720p_alt", "360p", "720p_alt2", None, "64k"]
+        )
+        self.assertEqual(hls.choose_variant(variants, "720p_alt").bandwidth,
+                         6600000)
+        self.assertEqual(hls.choose_variant(variants, "720p_alt2").bandwidth,
+                         5000000)
+
+    def test_audio_renditions(self):
+        master = hls.parse_playlist(AUDIO_MASTER,
+                                    "http://example.com/a/master.m3u8")
+        [variant] = master.variants
+        self.assertEqual(variant.audio, "aac")
+        self.assertEqual(variant.streamlink_name, "720p")
+        self.assertEqual([ r.name for r in master.renditions ],
+                         ["English", "Radio"])
+        self.assertTrue(master.renditions[0].default)
+        self.assertEqual(
+            hls.audio_renditions(master, variant),
+            [master.renditions[1]]
+        )
+        self.assertEqual(master.renditions[1].uri,
+                         "http://example.com/a/radio/index.m3u8")
+
+        # the built-in downloader would record the video without them
+        output = os.path.join(self.work_dir, "game.ts")
+        self.url = self.url.replace("/master.m3u8", "/audio.m3u8")
+        self.assertEqual(self.download(output), 1)
+        self.assertNotIn("/720p/seg0.ts", Handler.requested)
+
+    def download(self, output, resume=False):
+        downloader = hls.HLSDownloader(StreamSession(), self.url, output,
+                                       resolution="720p", workers=4,
+                                       resume=resume)
+        return hls.DownloadProcess(downloader).start().wait(timeout=10)
+
+    def assertComplete(self, output):
+        with open(output) as f:
+            self.assertEqual(
+                f.read(),
+                "".join("</720p/seg%d.ts>" %(n) for n in range(SEGMENTS))
+            )
+
+    def test_choose_variant(self):
+        variants = hls.parse_playlist(
+            "#EXTM3U\n" + "".join(
+                "#EXT-X-STREAM-INF:BANDWIDTH=%d,RESOLUTION=%s,FRAME-RATE=%s\n"
+                "%d.m3u8\n" %(bandwidth, resolution, frame_rate, bandwidth)
+                for (bandwidth, resolution, frame_rate) in [
+                    (6600000, "1280x720", "59.94"),
+                    (3500000, "1280x720", "29.97"),
+                    (2500000, "960x540", "29.97"),
+                    (1200000, "640x360", "29.97"),
+                ]
+            ), "http://example.com/master.m3u8"
+        ).variants
+
+        def choose(resolution):
+            return hls.choose_variant(variants, resolution).bandwidth
+
+        self.assertEqual(choose("720p60"), 6600000)
+        self.assertEqual(choose("720p@30"), 3500000)
+        self.assertEqual(choose("720p"), 3500000)
+        # as streamlink names it: the second 720p variant in the playlist
+        self.assertEqual(choose("720p_alt"), 3500000)
+        self.assertEqual(choose("540p"), 2500000)
+        self.assertEqual(choose("worst"), 1200000)
+        self.assertEqual(choose("1080p"), 6600000)
+        self.assertEqual(choose(None), 6600000)
+
+    def test_download(self):
+        output = os.path.join(self.work_dir, "game.ts")
+        self.assertEqual(self.download(output), 0)
+        self.assertComplete(output)
+
+    def test_resume(self):
+        output = os.path.join(self.work_dir, "game.ts")
+        Handler.broken.add("/720p/seg12.ts")
+        self.assertEqual(self.download(output), 1)
+
+        Handler.broken.clear()
+        del Handler.requested[:]
+        self.assertEqual(self.download(output, resume=True), 0)
+        self.assertComplete(output)
+        self.assertNotIn("/720p/seg11.ts", Handler.requested)
+        self.assertIn("/720p/seg12.ts", Handler.requested)
+
+        manifest = hls.Manifest(output + hls.MANIFEST_SUFFIX)
+        manifest.load()
+        self.assertTrue(manifest.complete)
+        self.assertEqual(len(manifest.segments), SEGMENTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import io
+import json
+import logging
+import unittest
+
+from mlbstreamer import utils
+
+class TestLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.root = logging.getLogger()
+        self.saved_handlers = list(self.root.handlers)
+        self.stream = io.StringIO()
+        self.handler = logging.StreamHandler(self.stream)
+
+    def tearDown(self):
+        del utils._installed_handlers[:]
+        self.root.handlers = self.saved_handlers
+
+    def test_idempotent(self):
+        utils.setup_logging(handlers=[self.handler], quiet_stdout=True)
+        count = len(self.root.handlers)
+        utils.setup_logging(handlers=[self.handler], quiet_stdout=True)
+        self.assertEqual(len(self.root.handlers), count)
+
+    def test_json(self):
+        utils.setup_logging(handlers=[self.handler], quiet_stdout=True,
+                            json_format=True)
+        logger = logging.getLogger("mlbstreamer")
+        with utils.log_flow("play") as context:
+            with utils.log_flow("refresh"):
+                logger.info("request", extra=dict(endpoint="schedule"))
+        logger.info("done")
+        (first, second) = [ json.loads(l)
+                            for l in self.stream.getvalue().splitlines() ]
+        self.assertEqual(first["correlation_id"], context.correlation_id)
+        self.assertEqual(first["flow"], "play")
+        self.assertEqual(first["endpoint"], "schedule")
+        self.assertNotIn("correlation_id", second)
+
+    def test_json_logging(self):
+        utils.setup_logging(handlers=[self.handler], quiet_stdout=True,
+                            json_format=True)
+        self.assertTrue(utils.json_logging())
+        utils.setup_logging(handlers=[self.handler], quiet_stdout=True)
+        self.assertFalse(utils.json_logging())
+
+
+if __name__ == '__main__':
+    unittest.main()
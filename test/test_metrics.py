@@ -0,0 +1,44 @@
+import unittest
+
+import requests
+
+from mlbstreamer import metrics
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.requests = self.registry.counter(
+            "requests_total", "requests", ["endpoint", "status"])
+        self.latency = self.registry.histogram(
+            "latency_seconds", "latency", buckets=[0.1, 1])
+
+    def test_render(self):
+        self.requests.inc(endpoint="schedule", status=200)
+        self.requests.inc(endpoint="schedule", status=200)
+        self.requests.inc(endpoint="token", status=401)
+        for value in [0.05, 0.5, 5]:
+            self.latency.observe(value)
+        lines = self.registry.render().splitlines()
+        self.assertIn('requests_total{endpoint="schedule",status="200"} 2', lines)
+        self.assertIn('requests_total{endpoint="token",status="401"} 1', lines)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum 5.55', lines)
+        self.assertIn('latency_seconds_count 3', lines)
+
+    def test_server(self):
+        self.requests.inc(endpoint="airings", status=200)
+        server = metrics.MetricsServer(self.registry)
+        server.start()
+        try:
+            r = requests.get("http://127.0.0.1:%d/metrics" %(server.port))
+            self.assertIn('requests_total{endpoint="airings",status="200"} 1',
+                          r.text)
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,33 @@
 import unittest
 
+from mlbstreamer import play
+
+
+class InterruptedProcess(object):
+
+    def __init__(self):
+        self.terminated = False
+        self.waits = 0
+
+    def wait(self, timeout=None):
+        self.waits += 1
+        if not self.terminated:
+            raise KeyboardInterrupt
+        return -15
+
+    def terminate(self):
+        self.terminated = True
+
 class TestMLBPlay(unittest.TestCase):
 
     def test_noop(self):
         # FIXME: actual unit testing will have to wait until mlbplay
         # can run without MLB.tv credentials
         return
+
+    def test_wait_player_interrupted(self):
+        proc = InterruptedProcess()
+        with self.assertRaises(KeyboardInterrupt):
+            play.wait_player(proc)
+        self.assertTrue(proc.terminated)
+        self.assertEqual(proc.waits, 2)
@@ -0,0 +1,157 @@
+import unittest
+import subprocess
+from concurrent.futures import Future
+
+from orderedattrdict import AttrDict
+
+from mlbstreamer import record
+from mlbstreamer.exceptions import MLBPlayException
+
+
+class FakeProcess(object):
+
+    def __init__(self):
+        self.returncode = None
+        self.terminated = False
+        self.waits = []
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+        self.returncode = -15
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        return self.returncode
+
+
+class SlowProcess(FakeProcess):
+    """
+    Process that doesn't finish within a wait timeout, like the built-in
+    downloader finishing a segment.
+    """
+
+    def wait(self, timeout=None):
+        super(SlowProcess, self).wait(timeout)
+        if timeout:
+            raise subprocess.TimeoutExpired("slow", timeout)
+        return self.returncode
+
+    kill = FakeProcess.terminate
+
+
+class FakeRecorder(record.Recorder):
+    """
+    Recorder that resolves and records instantly, without the network or
+    any processes.
+    """
+
+    def __init__(self, recordings, **kwargs):
+        kwargs.setdefault("restart_delay", 0)
+        super(FakeRecorder, self).__init__(recordings, **kwargs)
+        self.resolved = []
+
+    def resolve(self, recording, refresh=False):
+        self.resolved.append((recording, refresh))
+        recording.status = "resolving"
+        recording.future = Future()
+
+    def start(self, recording):
+        recording.proc = FakeProcess()
+        recording.status = "recording"
+
+
+def resolved(recording):
+    recording.future.set_result(
+        AttrDict(game=dict(gamePk=recording.game_specifier))
+    )
+
+
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.recordings = [ record.Recording(n) for n in range(3) ]
+        self.recorder = FakeRecorder(self.recordings, concurrency=2,
+                                     max_restarts=1)
+        for recording in self.recordings:
+            self.recorder.resolve(recording)
+
+    def tearDown(self):
+        self.recorder.executor.shutdown(wait=False)
+
+    def test_concurrency(self):
+        for recording in self.recordings:
+            resolved(recording)
+        self.recorder.poll()
+        self.assertEqual(
+            [ r.status for r in self.recordings ],
+            ["recording", "recording", "ready"]
+        )
+        self.recordings[0].proc.returncode = 0
+        self.recorder.poll()
+        self.assertEqual(
+            [ r.status for r in self.recordings ],
+            ["done", "recording", "recording"]
+        )
+
+    def test_restart(self):
+        recording = self.recordings[0]
+        resolved(recording)
+        self.recorder.poll()
+        self.assertEqual(recording.status, "recording")
+
+        recording.proc.returncode = 1
+        self.recorder.poll()
+        self.assertEqual(recording.status, "waiting")
+        self.assertEqual(recording.attempts, 1)
+
+        # restarts resolve the stream again, skipping the cache
+        self.recorder.poll()
+        self.assertEqual(recording.status, "resolving")
+        self.assertEqual(self.recorder.resolved[-1], (recording, True))
+
+        resolved(recording)
+        self.recorder.poll()
+        recording.proc.returncode = 1
+        self.recorder.poll()
+        self.assertEqual(recording.status, "failed")
+
+    def test_resolve_failure(self):
+        recording = self.recordings[0]
+        recording.future.set_exception(MLBPlayException("blacked out"))
+        self.recorder.poll()
+        self.assertEqual(recording.status, "waiting")
+        self.assertEqual(str(recording.error), "blacked out")
+
+    def test_finished(self):
+        for recording in self.recordings:
+            resolved(recording)
+        self.assertFalse(self.recorder.finished)
+        while not self.recorder.finished:
+            self.recorder.poll()
+            for recording in self.recorder.running:
+                recording.proc.returncode = 0
+        self.assertTrue(all(r.status == "done" for r in self.recordings))
+
+    def test_stop(self):
+        for recording in self.recordings:
+            resolved(recording)
+        self.recorder.poll()
+        running = list(self.recorder.running)
+        self.recorder.stop()
+        self.assertTrue(all(r.proc.terminated for r in running))
+
+    def test_stop_waits(self):
+        resolved(self.recordings[0])
+        self.recorder.poll()
+        recording = self.recordings[0]
+        recording.proc = SlowProcess()
+        self.recorder.stop()
+        # waited out the timeout, then until the process finished
+        self.assertEqual(recording.proc.waits, [10, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from mlbstreamer import session
+from mlbstreamer.exceptions import StreamSessionException
+
+
+class PooledSession(object):
+
+    logins = 0
+    fail = False
+
+    last_used = 0
+    in_use = False
+
+    @classmethod
+    def new(cls, **kwargs):
+        if cls.fail:
+            raise StreamSessionException("login failed")
+        cls.logins += 1
+        return cls()
+
+    def save(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestSessionPool(unittest.TestCase):
+
+    def setUp(self):
+        session.PROVIDERS["test"] = PooledSession
+        PooledSession.logins = 0
+        PooledSession.fail = False
+        self.pool = session.SessionPool()
+
+    def tearDown(self):
+        del session.PROVIDERS["test"]
+
+    def test_get(self):
+        proxies = {"https": "http://proxy:3128"}
+        first = self.pool.get("test", proxies=proxies)
+        self.assertIs(self.pool.get("test", proxies=proxies), first)
+        self.assertIsNot(self.pool.get("test"), first)
+        self.assertEqual(PooledSession.logins, 2)
+        self.assertEqual(self.pool.creating, {})
+
+    def test_get_failed(self):
+        PooledSession.fail = True
+        with self.assertRaises(StreamSessionException):
+            self.pool.get("test")
+        self.assertEqual(self.pool.creating, {})
+        PooledSession.fail = False
+        self.pool.get("test")
+        self.assertEqual(PooledSession.logins, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
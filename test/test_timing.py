@@ -0,0 +1,50 @@
+import io
+import unittest
+
+from mlbstreamer import timing
+
+class TestTiming(unittest.TestCase):
+
+    def setUp(self):
+        timing.enable()
+        timing.reset()
+
+    def tearDown(self):
+        timing.enabled = False
+        timing.reset()
+
+    def test_disabled(self):
+        timing.enabled = False
+        self.assertIs(timing.span("http schedule"), timing.NULL_SPAN)
+
+    def test_report(self):
+        with timing.span("resolve_stream"):
+            for i in range(3):
+                with timing.span("http schedule"):
+                    pass
+            with timing.span("spawn streamlink"):
+                pass
+        out = io.StringIO()
+        timing.report(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(
+            [ l.split()[0] for l in lines[1:] ],
+            ["resolve_stream", "http", "spawn"]
+        )
+        self.assertTrue(lines[2].startswith("    http schedule"))
+        self.assertTrue(lines[2].endswith("(x3)"))
+
+    def test_bounded(self):
+        # spans are merged as they finish rather than kept around
+        for i in range(1000):
+            with timing.span("update"):
+                with timing.span("http schedule"):
+                    pass
+        (update,) = timing._root.children.values()
+        self.assertEqual(update.count, 1000)
+        (http,) = update.children.values()
+        self.assertEqual(http.count, 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
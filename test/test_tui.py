@@ -0,0 +1,67 @@
+import types
+import unittest
+from unittest import mock
+from datetime import datetime, timedelta
+
+import mlbstreamer.__main__ as tui
+
+
+class TestPageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = tui.PageCache(size=3, max_age=60)
+        self.table = types.SimpleNamespace(provider="mlb", game_type=None)
+
+    def page_key(self, game_date):
+        return tui.GamesDataTable.page_key(self.table, game_date)
+
+    def test_datetime_key(self):
+        # `mlbstreamer 2019-04-01` starts from a parsed datetime
+        key = self.page_key(datetime(2019, 4, 1))
+        self.cache.put(key, ["row"])
+        self.assertEqual(self.cache.get(key), ["row"])
+        self.assertEqual(key, self.page_key(datetime(2019, 4, 1).date()))
+
+    def test_current_pages_expire(self):
+        key = self.page_key(datetime.now())
+        self.cache.put(key, ["row"])
+        self.assertEqual(self.cache.get(key), ["row"])
+        self.cache.pages[key] = (["row"], 0)
+        self.assertIsNone(self.cache.get(key))
+
+    def test_lru(self):
+        keys = [ self.page_key(datetime(2019, 4, 1) + timedelta(days=n))
+                 for n in range(4) ]
+        for key in keys:
+            self.cache.put(key, [key])
+        self.assertNotIn(keys[0], self.cache)
+        self.assertIn(keys[3], self.cache)
+
+
+class TestLineScoreDataTable(unittest.TestCase):
+
+    def test_columns_not_shared(self):
+        line_score = tui.AttrDict(
+            columns = (9, ("runs", "hits", "errors")),
+            data = [
+                tui.AttrDict(team="NYM", runs=1, hits=5, errors=0),
+                tui.AttrDict(team="PHI", runs=3, hits=8, errors=1),
+            ]
+        )
+        first = tui.MLBLineScoreDataTable.from_line_score(line_score)
+        second = tui.MLBLineScoreDataTable.from_line_score(line_score)
+        self.assertTrue(first.data_columns)
+        for (a, b) in zip(first.data_columns, second.data_columns):
+            self.assertIsNot(a, b)
+        self.assertIs(first.data_columns[0].table, first)
+        self.assertIs(second.data_columns[0].table, second)
+
+
+class TestGamesDataTable(unittest.TestCase):
+
+    def test_update_while_updating(self):
+        # an update that overlaps a slow one still schedules the next
+        table = types.SimpleNamespace(updating=True, update_alarm=object(),
+                                      schedule_update=mock.Mock())
+        tui.GamesDataTable.update(table)
+        table.schedule_update.assert_called_once_with()
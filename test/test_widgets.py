@@ -0,0 +1,31 @@
+import unittest
+
+from mlbstreamer import state
+from mlbstreamer import widgets
+
+
+class TestScrollbackListBox(unittest.TestCase):
+
+    SIZE = (40, 5)
+
+    def make_listbox(self):
+        listbox = widgets.ScrollbackListBox()
+        for n in range(50):
+            listbox.append("line %d" %(n))
+        listbox.listbox.focus_position = 0
+        listbox.render(self.SIZE, focus=True)
+        return listbox
+
+    def setUp(self):
+        state.loop = None
+
+    def test_keys_move_once(self):
+        # each key should move as far as the inner listbox's own handling
+        for (key, inner_key) in [("down", "down"), ("j", "down"),
+                                 ("page down", "page down")]:
+            listbox = self.make_listbox()
+            expected = self.make_listbox()
+            listbox.keypress(self.SIZE, key)
+            expected.listbox.keypress(self.SIZE, inner_key)
+            self.assertEqual(listbox.listbox.focus_position,
+                             expected.listbox.focus_position, key)